@@ -0,0 +1,282 @@
+import os
+import asyncio
+import inspect
+import threading
+import time
+import logging
+
+try:
+    import aiohttp # optional: only needed for the asyncio client
+except ImportError:
+    aiohttp = None
+
+from whatsapp_client import WhatsAppClient
+from multipart import FileSource
+from transport import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MEDIA_READ_TIMEOUT
+from response_cache import ResponseCache, API_CACHE_ENABLED
+from outbound_scheduler import OutboundScheduler, OUTBOUND_SCHEDULER_ENABLED
+from resilience import Resilience, RESILIENCE_ENABLED, circuit_open_response
+from outbox import NotDurable
+from metrics import API_DURATION, API_ERRORS, endpoint_label
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "100"))
+
+# Raised before a request was sent; a dropped connection (ServerDisconnectedError etc.) may
+# come after the Go API has read it. ConnectionTimeoutError is aiohttp 3.10+.
+_CONNECT_ERRORS = (
+    (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ClientConnectorError))
+    if aiohttp is not None else ()
+)
+
+
+class AsyncWhatsAppClient(WhatsAppClient):
+    # Every endpoint method inherited from WhatsAppClient builds its request and returns
+    # self._send_request(...). Here that is a coroutine, so the same methods become
+    # awaitables: `await client.send_message(phone, "hi")`. A client belongs to the event
+    # loop it is first used on.
+    def __init__(self, base_url, username, password, cache=None, scheduler=None, max_concurrency=ASYNC_MAX_CONCURRENCY,
+                 resilience=None, outbox=None, auth_header=None):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for AsyncWhatsAppClient (pip install aiohttp)")
+        self.base_url = base_url
+        # `auth_header` replaces username/password, e.g. a pool backend's own credentials
+        self.auth_header = auth_header or self._generate_auth_header(username, password)
+        self.cache = cache if cache is not None else (ResponseCache() if API_CACHE_ENABLED else None)
+        if scheduler is None and OUTBOUND_SCHEDULER_ENABLED:
+            scheduler = OutboundScheduler()
+        self.scheduler = scheduler
+        self.resilience = resilience if resilience is not None else (Resilience() if RESILIENCE_ENABLED else None)
+        # Writes are recorded like the sync client's; the outbox's dispatcher retries failures
+        self.outbox = outbox
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._semaphore = None
+        self._in_flight = {}
+        self._timeouts = {
+            False: aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+            True: aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_MEDIA_READ_TIMEOUT),
+        }
+
+    def _get_session(self):
+        # Created lazily so the session and connector are bound to the running loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.auth_header)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _send_request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.outbox is not None and method != "GET":
+            return await self._send_recorded(method, endpoint, params, json_data, files, data)
+        return await self._dispatch(method, endpoint, params, json_data, files, data)
+
+    async def _send_recorded(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        # Outbox.send for the event loop: recording waits for a SQLite commit, so it runs in
+        # the loop's executor; settling only queues a write to the outbox's writer thread
+        try:
+            record_id = await asyncio.get_running_loop().run_in_executor(
+                None, self.outbox.record, method, endpoint, params, json_data, files, data
+            )
+        except NotDurable:
+            return await self._dispatch(method, endpoint, params, json_data, files, data)
+        return self.outbox.settle(record_id, await self._dispatch(method, endpoint, params, json_data, files, data))
+
+    async def _dispatch(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.resilience is not None and self.resilience.rejects(self._base_urls(), endpoint_label(endpoint)):
+            return circuit_open_response(endpoint_label(endpoint))
+        if self.scheduler is not None and self.scheduler.is_scheduled(endpoint):
+            recipient = (json_data or data or {}).get("phone")
+            await self.scheduler.acquire_async(self.scheduler.classify(endpoint), recipient)
+        if self.cache is None:
+            return await self._request(method, endpoint, params, json_data, files, data)
+        if method == "GET" and self.cache.is_cacheable(endpoint):
+            return await self._cached_get(endpoint, params)
+        response = await self._request(method, endpoint, params, json_data, files, data)
+        if method != "GET":
+            self.cache.invalidate_for(endpoint)
+        return response
+
+    async def _cached_get(self, endpoint, params):
+        # Same cache as the sync client; concurrent misses on this loop share one request
+        key = self.cache.make_key(endpoint, params)
+        hit, value = self.cache.lookup(key)
+        if hit:
+            return value
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.cache.record_miss(coalesced=True)
+            return await asyncio.shield(pending)
+        self.cache.record_miss()
+        generation = self.cache.generation(endpoint)
+        pending = self._in_flight[key] = asyncio.ensure_future(self._request("GET", endpoint, params))
+        try:
+            value = await pending
+        finally:
+            del self._in_flight[key]
+        self.cache.store(key, value, generation)
+        return value
+
+    def _form(self, data, files):
+        form = aiohttp.FormData()
+        for name, value in (data or {}).items():
+            form.add_field(name, str(value))
+        for field, part in files.items():
+            if isinstance(part, tuple):
+                filename, content, content_type = part
+                if isinstance(content, FileSource):
+                    content = content.open() # aiohttp streams it and closes it afterwards
+                form.add_field(field, content, filename=filename, content_type=content_type)
+            else:
+                form.add_field(field, part, filename=os.path.basename(getattr(part, "name", field)))
+        return form
+
+    async def _request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.resilience is None:
+            return await self._attempt(method, endpoint, params, json_data, files, data)
+        label = endpoint_label(endpoint)
+        attempt = 0
+        while True:
+            breaker, timeout = self.resilience.before(self.base_url, label, bool(files))
+            if breaker is None:
+                return circuit_open_response(label)
+            response = None
+            start = time.perf_counter()
+            try:
+                response = await self._attempt(method, endpoint, params, json_data, files, data, timeout)
+            finally:
+                delay = self.resilience.after(
+                    breaker, self.base_url, label, method, bool(files), response, time.perf_counter() - start, attempt
+                )
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _attempt(self, method, endpoint, params=None, json_data=None, files=None, data=None, timeout=None):
+        url = f"{self.base_url}{endpoint}"
+        session = self._get_session()
+        if timeout is not None:
+            timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        kwargs = {"timeout": timeout or self._timeouts[bool(files)]}
+        if params:
+            kwargs["params"] = {key: str(value) for key, value in params.items()}
+        if files:
+            kwargs["data"] = self._form(data, files)
+        elif json_data is not None:
+            kwargs["json"] = json_data
+        elif data is not None:
+            kwargs["data"] = data
+        label = endpoint_label(endpoint)
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if response.status >= 400:
+                        body = await response.text()
+                        logger.error("Error during API request to %s: HTTP %s", url, response.status)
+                        logger.debug("Response content: %s", body)
+                        API_ERRORS.inc(method, label, str(response.status))
+                        return {"code": "ERROR", "message": f"{response.status} {response.reason}", "status": response.status}
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error("Error during API request to %s: %r", url, e)
+                API_ERRORS.inc(method, label, type(e).__name__)
+                error = {"code": "ERROR", "message": str(e) or repr(e), "error": type(e).__name__}
+                if isinstance(e, _CONNECT_ERRORS):
+                    error["unsent"] = True # see resilience.is_unsent
+                return error
+            finally:
+                API_DURATION.observe(time.perf_counter() - start, method, label)
+
+
+class EventLoopThread:
+    # An asyncio event loop running in a background thread, for use from sync code
+    def __init__(self, name="asyncio-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _drain(self, timeout):
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    def stop(self, timeout=30.0, cleanup=None):
+        # Waits for scheduled coroutines, awaits the optional `cleanup` coroutine function, then stops the loop
+        if not self.loop.is_running():
+            return
+        logger.info("Draining asyncio loop...")
+        try:
+            self.submit(self._drain(timeout)).result(timeout + 1)
+            if cleanup is not None:
+                self.submit(cleanup()).result(5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(5)
+        logger.info("Asyncio loop stopped.")
+
+
+class LoopBoundClient:
+    # Sync facade over an AsyncWhatsAppClient: each call schedules the request on the
+    # loop and returns a concurrent.futures.Future right away, so callers like BotLogic
+    # never wait on the Go API. Calls for the same recipient still go out in call order.
+    # Arguments must outlive the call (bytes or MediaAsset, not a file that gets closed).
+    def __init__(self, client, loop_thread):
+        self.client = client
+        self.loop_thread = loop_thread
+        self._tails = {} # recipient -> future resolved when its latest call finishes
+        self._signatures = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith("_") or not inspect.isfunction(getattr(WhatsAppClient, name, None)):
+            return attr
+
+        def call(*args, **kwargs):
+            recipient = self._recipient(name, args, kwargs)
+            return self.loop_thread.submit(self._ordered(recipient, attr, args, kwargs))
+        return call
+
+    def _recipient(self, name, args, kwargs):
+        signature = self._signatures.get(name)
+        if signature is None:
+            signature = self._signatures[name] = inspect.signature(getattr(WhatsAppClient, name))
+        try:
+            return signature.bind(None, *args, **kwargs).arguments.get("phone")
+        except TypeError:
+            return None
+
+    async def _ordered(self, recipient, method, args, kwargs):
+        if recipient is None:
+            return await method(*args, **kwargs)
+        previous = self._tails.get(recipient)
+        current = self._tails[recipient] = asyncio.get_running_loop().create_future()
+        try:
+            if previous is not None:
+                await previous
+            return await method(*args, **kwargs)
+        finally:
+            current.set_result(None)
+            if self._tails.get(recipient) is current:
+                del self._tails[recipient]
@@ -0,0 +1,125 @@
+# Webhook ingestion rate: one event per signed request to /webhook versus batches of
+# events in one signed request to /webhook/batch, through Flask's test client. Delivery
+# receipts are used so the numbers are the ingestion path (signature, parsing, dedup, log
+# store) and not the bot's Go API calls. Also times parsing alone: json.loads plus the
+# sender normalization /webhook used to do, against events.parse_event.
+#
+#   python benchmarks/bench_events.py
+#   python benchmarks/bench_events.py --events 20000 --batch-sizes 10,100,1000
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import go_wa_stub
+
+SECRET = "bench-secret"
+PARSE_ITERATIONS = 100000
+
+
+def receipt(i):
+    return {
+        "event": "message.ack",
+        "from": f"62812{i % 500:05d}:{i % 4}@s.whatsapp.net in 62812{i % 500:05d}@s.whatsapp.net",
+        "payload": {"id": f"receipt-{i}", "receipt_type": "read"},
+    }
+
+
+def sign(body):
+    return "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def old_normalize_sender(raw_sender):
+    # main.normalize_sender before events.py
+    sender = None
+    if raw_sender:
+        parts = raw_sender.split(" in ")
+        if len(parts) > 0:
+            jid_with_device = parts[0]
+            sender_parts = jid_with_device.split(":")
+            if len(sender_parts) > 1 and "@s.whatsapp.net" in sender_parts[1]:
+                sender = sender_parts[0] + "@s.whatsapp.net"
+            else:
+                sender = jid_with_device
+    return sender
+
+
+def old_parse(payload):
+    event_data = json.loads(payload)
+    sender = old_normalize_sender(event_data.get("from"))
+    kind = event_data["event"] if event_data.get("event") else ("message" if "message" in event_data else "unknown")
+    text = event_data.get("message", {}).get("text")
+    return event_data, sender, kind, text
+
+
+def bench_parse(parse_event):
+    payloads = [json.dumps(receipt(i)).encode() for i in range(1000)]
+    print(f"{'parser':<22} {'events/s':>10}")
+    for name, parse in (("json.loads + split", old_parse), ("events.parse_event", parse_event)):
+        elapsed = timeit.timeit(lambda: [parse(p) for p in payloads], number=PARSE_ITERATIONS // len(payloads))
+        print(f"{name:<22} {PARSE_ITERATIONS / elapsed:>10.0f}")
+
+
+def bench_endpoints(client, events, batch_sizes):
+    print(f"{'endpoint':<22} {'events/s':>10} {'requests/s':>11}")
+    offset = 0
+
+    def run(name, bodies, path, count):
+        signed = [(body, sign(body)) for body in bodies]
+        start = time.perf_counter()
+        for body, signature in signed:
+            response = client.post(path, data=body, headers={"X-Hub-Signature-256": signature})
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<22} {count / elapsed:>10.0f} {len(bodies) / elapsed:>11.0f}")
+
+    # Unique ids per run, so nothing is dropped as a duplicate
+    run("/webhook", [json.dumps(receipt(offset + i)).encode() for i in range(events)], "/webhook", events)
+    offset += events
+    for size in batch_sizes:
+        bodies = []
+        for start in range(offset, offset + events, size):
+            bodies.append(b"\n".join(json.dumps(receipt(i)).encode() for i in range(start, min(start + size, offset + events))))
+        run(f"/webhook/batch x{size}", bodies, "/webhook/batch", events)
+        offset += events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook events/s, single versus batched")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--batch-sizes", default="10,100,1000")
+    args = parser.parse_args()
+
+    stub = go_wa_stub.serve(0)
+    os.environ.update({
+        "GO_WA_API_URL": f"http://127.0.0.1:{stub.server_port}",
+        "GO_WA_API_USERNAME": "bench",
+        "GO_WA_API_PASSWORD": "bench",
+        "PYTHON_WEBHOOK_SECRET": SECRET,
+        "SHARED_STATE": "false",
+        "OUTBOX_ENABLED": "false",
+        "METRICS_DIR": "",
+        "WEBHOOK_LOG_MAX_ENTRIES": str(args.events),
+        "WEBHOOK_DEDUP_MAX_ENTRIES": str(args.events * (len(args.batch_sizes.split(",")) + 1)),
+        "LOG_LEVEL": "WARNING",
+    })
+    os.chdir(ROOT) # main preloads ./assets
+    import main as app_main
+    from events import parse_event
+
+    bench_parse(parse_event)
+    print()
+    bench_endpoints(app_main.app.test_client(), args.events, [int(s) for s in args.batch_sizes.split(",")])
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
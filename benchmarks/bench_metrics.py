@@ -0,0 +1,64 @@
+# Cost of the instrumentation on the hot paths: one histogram observation, a timed
+# block, a counter increment and a perf_counter() pair on its own, single-threaded and
+# with several threads recording into the same histogram.
+#
+#   python benchmarks/bench_metrics.py
+import os
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Counter, Histogram
+
+ITERATIONS = 200000
+THREAD_COUNTS = [1, 4, 16]
+
+
+def per_call_us(stmt):
+    return timeit.timeit(stmt, number=ITERATIONS) / ITERATIONS * 1e6
+
+
+def contended_us(histogram, threads):
+    per_thread = ITERATIONS // threads
+
+    def run():
+        for _ in range(per_thread):
+            histogram.observe(0.003, "/send/message")
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (per_thread * threads) * 1e6
+
+
+def main():
+    histogram = Histogram("bench_seconds", "", ("endpoint",))
+    counter = Counter("bench_total", "", ("endpoint",))
+
+    def timed():
+        with histogram.time("/send/message"):
+            pass
+
+    def clock_pair():
+        start = time.perf_counter()
+        time.perf_counter() - start
+
+    print(f"{'operation':<28} {'us/call':>8}")
+    print(f"{'perf_counter pair':<28} {per_call_us(clock_pair):>8.3f}")
+    print(f"{'Histogram.observe':<28} {per_call_us(lambda: histogram.observe(0.003, '/send/message')):>8.3f}")
+    print(f"{'with Histogram.time()':<28} {per_call_us(timed):>8.3f}")
+    print(f"{'Counter.inc':<28} {per_call_us(lambda: counter.inc('/send/message')):>8.3f}")
+    print()
+    print(f"{'threads':>7} {'observe us/call':>16}")
+    for threads in THREAD_COUNTS:
+        print(f"{threads:>7} {contended_us(histogram, threads):>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Outbox enqueue throughput with one commit per record versus group-committed batches,
+# for a growing number of concurrent senders.
+#
+#   python benchmarks/bench_outbox.py
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outbox import Outbox
+
+SENDER_COUNTS = [1, 4, 16, 64]
+RECORDS = 4000
+
+
+def run(batch_max, batch_window, senders):
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = Outbox(os.path.join(directory, "outbox.db"), batch_max=batch_max, batch_window=batch_window)
+        per_sender = RECORDS // senders
+        json_data = {"phone": "6281234567890@s.whatsapp.net", "message": "Halo! " * 10, "is_forwarded": False}
+
+        def send():
+            for _ in range(per_sender):
+                outbox.record("POST", "/send/message", json_data=json_data)
+
+        threads = [threading.Thread(target=send) for _ in range(senders)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        avg_batch = outbox.stats()["avg_batch_size"]
+        outbox.close()
+    return per_sender * senders / elapsed, avg_batch
+
+
+def main():
+    print(f"{'senders':>7} {'unbatched/s':>12} {'batched/s':>10} {'avg batch':>9}")
+    for senders in SENDER_COUNTS:
+        unbatched, _ = run(1, 0, senders)
+        batched, avg_batch = run(256, 0, senders)
+        print(f"{senders:>7} {unbatched:>12.0f} {batched:>10.0f} {avg_batch:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
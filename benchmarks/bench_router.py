@@ -0,0 +1,49 @@
+# Routing time against the number of registered commands: a linear startswith scan
+# (how BotLogic used to match commands) versus CommandRouter.
+#
+#   python benchmarks/bench_router.py
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command_router import CommandRouter
+
+COMMAND_COUNTS = [12, 100, 1000, 5000]
+ITERATIONS = 20000
+
+
+def handler(bot, sender, args):
+    pass
+
+
+def build(count):
+    names = [f"cmd{i:05d}" if i % 2 else f"send type{i:05d}" for i in range(count)]
+    router = CommandRouter()
+    for name in names:
+        router.command(name)(handler)
+    return names, router
+
+
+def linear_route(names, text):
+    lowered = text.lower()
+    for name in names:
+        if lowered.startswith(name):
+            return name
+    return None
+
+
+def main():
+    print(f"{'commands':>8} {'linear (us)':>12} {'router (us)':>12}")
+    for count in COMMAND_COUNTS:
+        names, router = build(count)
+        # Worst case for the linear scan: the last registered command
+        text = f"{names[-1]} some arguments"
+        linear = timeit.timeit(lambda: linear_route(names, text), number=ITERATIONS)
+        routed = timeit.timeit(lambda: router.resolve(text), number=ITERATIONS)
+        print(f"{count:>8} {linear / ITERATIONS * 1e6:>12.3f} {routed / ITERATIONS * 1e6:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
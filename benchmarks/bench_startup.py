@@ -0,0 +1,156 @@
+# Startup cost of the bot. First, how long `import main` takes and which of its imports
+# dominate. Then, for the bot started as `python main.py` against the Go WA API stub, the time
+# until it answers "/", the time until /ready, and the latency of its first webhooks, with
+# the startup warm-up (startup.py) and without it.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 5 --text "send image"
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from go_wa_stub import serve
+from load_test import BOT_ENV, REPO_DIR, stop_bot
+
+SECRET = "bench-secret"
+PORT = 5056
+
+
+def bot_env(stub_url, workdir, extra=None):
+    env = dict(os.environ)
+    env.update(BOT_ENV)
+    env.update({
+        "GO_WA_API_URL": stub_url,
+        "GO_WA_API_USERNAME": "bench",
+        "GO_WA_API_PASSWORD": "bench",
+        "PYTHON_WEBHOOK_SECRET": SECRET,
+        "FLASK_RUN_PORT": str(PORT),
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "BROADCAST_DIR": os.path.join(workdir, "broadcasts"),
+        "TRANSCODE_CACHE_DIR": os.path.join(workdir, "transcode"),
+        "MEDIA_VARIANT_DIR": os.path.join(workdir, "variants"),
+        "SHARED_STATE_PATH": os.path.join(workdir, "state.db"),
+        "METRICS_DIR": "",
+    })
+    env.update(extra or {})
+    return env
+
+
+def import_times(env):
+    # (cumulative ms of `import main`, {direct import of main: cumulative ms})
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=REPO_DIR, env=env,
+        check=True, capture_output=True, text=True,
+    ).stderr
+    children = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "main":
+                return int(cumulative) / 1000, children
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+    raise RuntimeError("main not found in -X importtime output")
+
+
+def request(method, path, body=None, headers=None, timeout=30):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=timeout)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def wait_for(path, process, deadline):
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Bot exited during startup:\n{process.stderr.read().decode(errors='replace')}")
+        try:
+            if request("GET", path, timeout=1)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"Bot did not answer {path} in time")
+
+
+def webhook(text, message_id):
+    body = json.dumps({
+        "from": "6281200000001:12@s.whatsapp.net in 6281200000001@s.whatsapp.net",
+        "message": {"id": message_id, "text": text},
+    }).encode()
+    signature = "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+    start = time.perf_counter()
+    status, _ = request("POST", "/webhook", body, {"Content-Type": "application/json", "X-Hub-Signature-256": signature})
+    if status != 200:
+        raise RuntimeError(f"Webhook answered {status}")
+    return time.perf_counter() - start
+
+
+def start_up(env, text, webhooks):
+    # Seconds from spawning the bot to its first response and to /ready, then the first webhooks' latencies
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        deadline = time.monotonic() + 120
+        wait_for("/", process, deadline)
+        first_response = time.perf_counter() - start
+        wait_for("/ready", process, deadline)
+        ready = time.perf_counter() - start
+        latencies = [webhook(text, f"BENCH{time.time_ns()}{i}") for i in range(webhooks)]
+    finally:
+        stop_bot(process)
+    return first_response, ready, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time, time to first response and first webhook latency")
+    parser.add_argument("--runs", type=int, default=3, help="runs per measurement; medians are reported")
+    parser.add_argument("--text", default="time", help="message text of the webhooks sent after startup")
+    parser.add_argument("--webhooks", type=int, default=3, help="webhooks sent after startup")
+    parser.add_argument("--top", type=int, default=8, help="imports of main to list")
+    args = parser.parse_args()
+
+    stub = serve(0)
+    stub_url = f"http://127.0.0.1:{stub.server_port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        # The warm-up would keep the interpreter alive after the import; time the import alone
+        runs = [import_times(bot_env(stub_url, workdir, {"STARTUP_WARMUP": ""})) for _ in range(args.runs)]
+        print(f"import main: {statistics.median(total for total, _ in runs):.0f} ms")
+        names = sorted(runs[0][1], key=runs[0][1].get, reverse=True)[:args.top]
+        for name in names:
+            print(f"  {name:<24} {statistics.median(children.get(name, 0) for _, children in runs):>7.1f} ms")
+        print()
+
+        print(f"{'warm-up':<10} {'first response s':>16} {'ready s':>8}  first webhooks ('{args.text}') ms")
+        for label, warmup in (("on", None), ("off", "")):
+            extra = {} if warmup is None else {"STARTUP_WARMUP": warmup}
+            results = [start_up(bot_env(stub_url, workdir, extra), args.text, args.webhooks) for _ in range(args.runs)]
+            latencies = [statistics.median(run[2][i] for run in results) * 1000 for i in range(args.webhooks)]
+            print(
+                f"{label:<10} {statistics.median(r[0] for r in results):>16.2f} {statistics.median(r[1] for r in results):>8.2f}  "
+                + " ".join(f"{latency:.1f}" for latency in latencies)
+            )
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
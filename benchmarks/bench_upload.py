@@ -0,0 +1,78 @@
+# Peak memory and throughput of a media upload against file size, for requests' own
+# multipart encoding (body built in memory) versus the streaming encoder in multipart.py.
+# Each upload runs in a fresh process so its peak RSS can be read from ru_maxrss.
+#
+#   python benchmarks/bench_upload.py
+#   python benchmarks/bench_upload.py --sizes 10,100,500
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import go_wa_stub
+from transport import PooledTransport
+
+MB = 1024 * 1024
+
+
+def upload(url, path, streaming):
+    # Runs in the child process; returns (peak RSS growth in bytes, seconds)
+    transport = PooledTransport(stream_uploads=streaming)
+    transport.request("GET", f"{url}/app/devices") # connect and import everything before the baseline
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        response = transport.request(
+            "POST", f"{url}/send/video", files={"video": ("video.mp4", f, "video/mp4")}, data={"phone": "62"}
+        )
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024, elapsed
+
+
+def run(url, path, streaming):
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", url, path, "1" if streaming else "0"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload memory and throughput against file size")
+    parser.add_argument("--sizes", default="1,10,50,100", help="file sizes in MB")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        url, path, streaming = args.child
+        peak, elapsed = upload(url, path, streaming == "1")
+        print(json.dumps([peak, elapsed]))
+        return
+
+    stub = go_wa_stub.serve(0)
+    url = f"http://127.0.0.1:{stub.server_port}"
+    print(f"{'size MB':>7} {'buffered peak MB':>16} {'MB/s':>7} {'streaming peak MB':>17} {'MB/s':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(s) for s in args.sizes.split(",")):
+            path = os.path.join(directory, f"{size}.bin")
+            with open(path, "wb") as f:
+                for _ in range(size):
+                    f.write(os.urandom(MB))
+            row = [f"{size:>7}"]
+            for streaming, width in ((False, 16), (True, 17)):
+                peak, elapsed = run(url, path, streaming)
+                row.append(f"{peak / MB:>{width}.1f} {size / elapsed:>7.0f}")
+            print(" ".join(row))
+            os.remove(path)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
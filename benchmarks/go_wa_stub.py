@@ -0,0 +1,135 @@
+# Local stand-in for the Go WhatsApp API, for load tests that must run offline.
+# Every endpoint WhatsAppClient calls answers with a canned success response after an
+# injected delay; a share of requests can be made to fail or to stall.
+#
+#   python benchmarks/go_wa_stub.py --port 3000 --latency-ms 20 --jitter-ms 10 --error-rate 0.01
+#
+# /stub/stats returns request counts per endpoint and /stub/reset clears them.
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTACTS = [{"jid": f"62812000{i:05d}@s.whatsapp.net", "name": f"Contact {i}"} for i in range(50)]
+GROUPS = [{"JID": f"1203630{i:05d}@g.us", "Name": f"Group {i}"} for i in range(10)]
+
+
+def _results(method, path):
+    if path == "/user/my/contacts":
+        return {"data": CONTACTS}
+    if path == "/user/my/groups":
+        return {"data": GROUPS}
+    if path.startswith("/user/"):
+        return {"data": {"verified_name": "", "status": "", "devices": []}}
+    if method == "POST":
+        return {"message_id": "3EB0%016X" % random.getrandbits(64), "status": "success"}
+    return {}
+
+
+class StubConfig:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, stall_rate=0.0, stall_ms=5000.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    # Headers and body go out in separate writes; without TCP_NODELAY the body waits ~40ms for a delayed ACK
+    disable_nagle_algorithm = True
+    config = StubConfig()
+    counts = Counter()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                self.rfile.read(size + 2) # chunk and its CRLF
+                if size == 0:
+                    return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _handle(self, method):
+        self._read_body()
+        path = self.path.split("?", 1)[0]
+
+        if path == "/stub/stats":
+            with self.lock:
+                return self._reply(200, dict(self.counts))
+        if path == "/stub/reset":
+            with self.lock:
+                self.counts.clear()
+            return self._reply(200, {})
+
+        with self.lock:
+            self.counts[f"{method} {path}"] += 1
+        config = self.config
+        roll = random.random()
+        if roll < config.stall_rate:
+            time.sleep(config.stall_ms / 1000)
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if roll >= 1 - config.error_rate:
+            return self._reply(500, {"code": "INTERNAL_SERVER_ERROR", "message": "Injected error"})
+        self._reply(200, {"code": "SUCCESS", "message": "Success", "results": _results(method, path)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def serve(port=3000, config=None, host="127.0.0.1"):
+    # Starts the stub on a background thread and returns the server (call .shutdown() to stop)
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig(), "counts": Counter()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="go-wa-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Go WhatsApp API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of requests delayed by --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    args = parser.parse_args()
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.stall_rate, args.stall_ms)
+    server = serve(args.port, config, args.host)
+    print(f"Go WA API stub listening on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# Webhook load test against a local bot and the Go WA API stub, fully offline.
+#
+# Starts benchmarks/go_wa_stub.py in-process and the bot (python main.py) as a subprocess
+# pointed at it, replays a weighted mix of signed message webhooks from many senders, and
+# reports requests/sec, latency percentiles and the bot's memory growth.
+#
+#   python benchmarks/load_test.py --duration 30 --concurrency 16
+#   python benchmarks/load_test.py --env WEBHOOK_ASYNC=true --env WEBHOOK_ORDERED_DISPATCH=true
+#   python benchmarks/load_test.py --url http://127.0.0.1:5000 --secret ...   # an already running bot
+#   python benchmarks/load_test.py --json > report.json
+import argparse
+import hashlib
+import hmac
+import http.client
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from go_wa_stub import StubConfig, serve
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Message text -> weight
+DEFAULT_MIX = "ping=35,time=15,send text Halo=15,menu=5,send image=10,send audio=5,send link=5,hello there=10"
+
+# Environment for the bot under test. Pacing is opened up so the run measures the bot rather
+# than the outbound rate limits; pass --env to override any of these.
+BOT_ENV = {
+    "LOG_LEVEL": "WARNING",
+    "OUTBOUND_GLOBAL_RATE": "100000",
+    "OUTBOUND_GLOBAL_BURST": "100000",
+    "OUTBOUND_RECIPIENT_RATE": "100000",
+    "OUTBOUND_RECIPIENT_BURST": "100000",
+}
+
+
+def parse_mix(value):
+    mix = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        text, _, weight = item.rpartition("=")
+        mix.append((text, float(weight)))
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def tree_rss_bytes(pid):
+    # Resident memory of a process and its children (gunicorn workers etc.), from /proc
+    try:
+        children = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(ppid, []).append(int(entry))
+        total, stack = 0, [pid]
+        while stack:
+            current = stack.pop()
+            stack.extend(children.get(current, ()))
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        return total
+    except OSError:
+        return None
+
+
+class WebhookLoad:
+    def __init__(self, url, secret, mix, senders, concurrency):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = (parts.path.rstrip("/") or "") + "/webhook"
+        self.secret = secret.encode()
+        self.texts = [text for text, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.senders = [f"62812{i:07d}" for i in range(senders)]
+        self.concurrency = concurrency
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def payload(self, rng):
+        phone = rng.choice(self.senders)
+        event = {
+            "from": f"{phone}:12@s.whatsapp.net in {phone}@s.whatsapp.net",
+            "message": {"id": f"LOADTEST{next(self._ids):012d}", "text": rng.choices(self.texts, self.weights)[0]},
+            "pushname": "Load Test",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        body = json.dumps(event).encode()
+        signature = "sha256=" + hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        return body, signature
+
+    def _worker(self, seed, deadline, record_after):
+        rng = random.Random(seed)
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        latencies, statuses, errors = [], Counter(), Counter()
+        while True:
+            body, signature = self.payload(rng)
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+            try:
+                connection.request("POST", self.path, body, {
+                    "Content-Type": "application/json", "X-Hub-Signature-256": signature,
+                })
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                status = None
+                if start >= record_after:
+                    errors[type(e).__name__] += 1
+            elapsed = time.perf_counter() - start
+            if start >= record_after:
+                if status is not None:
+                    statuses[status] += 1
+                latencies.append(elapsed)
+        connection.close()
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.statuses.update(statuses)
+            self.errors.update(errors)
+
+    def run(self, duration, warmup, on_measure_start=None):
+        start = time.perf_counter()
+        record_after = start + warmup
+        deadline = record_after + duration
+        threads = [
+            threading.Thread(target=self._worker, args=(seed, deadline, record_after), daemon=True)
+            for seed in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        if on_measure_start is not None:
+            time.sleep(max(record_after - time.perf_counter(), 0))
+            on_measure_start()
+        for thread in threads:
+            thread.join()
+        return duration
+
+
+def start_bot(command, port, stub_url, secret, extra_env, workdir):
+    env = dict(os.environ)
+    env.update(BOT_ENV)
+    env.update({
+        "GO_WA_API_URL": stub_url,
+        "GO_WA_API_USERNAME": "loadtest",
+        "GO_WA_API_PASSWORD": "loadtest",
+        "PYTHON_WEBHOOK_SECRET": secret,
+        "FLASK_RUN_PORT": str(port),
+        "PORT": str(port),
+        # Keep on-disk state out of the working tree
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "BROADCAST_DIR": os.path.join(workdir, "broadcasts"),
+        "TRANSCODE_CACHE_DIR": os.path.join(workdir, "transcode"),
+        "MEDIA_VARIANT_DIR": os.path.join(workdir, "variants"),
+        "SHARED_STATE_PATH": os.path.join(workdir, "state.db"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+    env.update(extra_env)
+    process = subprocess.Popen(
+        command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Bot exited during startup:\n{process.stderr.read().decode(errors='replace')}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Bot did not start within 60s")
+
+
+def stop_bot(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def fetch_json(host, port, path):
+    connection = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signed webhook load test against a local bot and Go WA API stub")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load before measuring")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent webhook senders")
+    parser.add_argument("--senders", type=int, default=200, help="distinct WhatsApp users in the mix")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated text=weight pairs")
+    parser.add_argument("--url", help="load an already running bot instead of starting one")
+    parser.add_argument("--secret", default=os.getenv("PYTHON_WEBHOOK_SECRET") or "loadtest-secret")
+    parser.add_argument("--port", type=int, default=5055, help="port for the bot started by this script")
+    parser.add_argument("--command", default=f"{sys.executable} main.py", help="command that starts the bot")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra bot environment")
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-stall-rate", type=float, default=0.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    stub = serve(0, StubConfig(args.stub_latency_ms, args.stub_jitter_ms, args.stub_error_rate, args.stub_stall_rate))
+    stub_port = stub.server_port
+    process = None
+    workdir = tempfile.TemporaryDirectory()
+    try:
+        if args.url:
+            url = args.url
+        else:
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            process = start_bot(args.command.split(), args.port, f"http://127.0.0.1:{stub_port}",
+                                args.secret, extra_env, workdir.name)
+            url = f"http://127.0.0.1:{args.port}"
+
+        load = WebhookLoad(url, args.secret, parse_mix(args.mix), args.senders, args.concurrency)
+        memory = {}
+
+        def measure_start():
+            fetch_json("127.0.0.1", stub_port, "/stub/reset")
+            if process is not None:
+                memory["start"] = tree_rss_bytes(process.pid)
+
+        load.run(args.duration, args.warmup, measure_start)
+        if process is not None:
+            memory["end"] = tree_rss_bytes(process.pid)
+        # Let queued work reach the stub before counting its calls
+        time.sleep(1)
+        stub_counts = fetch_json("127.0.0.1", stub_port, "/stub/stats")
+    finally:
+        if process is not None:
+            stop_bot(process)
+        stub.shutdown()
+        workdir.cleanup()
+
+    latencies = sorted(load.latencies)
+    completed = sum(load.statuses.values())
+    succeeded = sum(count for status, count in load.statuses.items() if 200 <= status < 300)
+    report = {
+        "config": {
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "senders": args.senders,
+            "command": None if args.url else args.command,
+            "env": args.env,
+            "stub_latency_ms": args.stub_latency_ms,
+            "stub_error_rate": args.stub_error_rate,
+        },
+        "requests": completed,
+        "requests_per_second": round(completed / args.duration, 1),
+        "successful_per_second": round(succeeded / args.duration, 1),
+        "statuses": {str(status): count for status, count in sorted(load.statuses.items())},
+        "client_errors": dict(load.errors),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "memory": {
+            "rss_start_mb": round(memory["start"] / 2**20, 1) if memory.get("start") else None,
+            "rss_end_mb": round(memory["end"] / 2**20, 1) if memory.get("end") else None,
+            "growth_mb": round((memory["end"] - memory["start"]) / 2**20, 1)
+            if memory.get("start") and memory.get("end") else None,
+        },
+        "go_api_calls": sum(stub_counts.values()),
+        "go_api_calls_by_endpoint": stub_counts,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['requests']} webhooks in {args.duration:.0f}s: {report['requests_per_second']} req/s "
+          f"({report['successful_per_second']} req/s answered 2xx)")
+    print(f"statuses: {report['statuses']}  client errors: {report['client_errors'] or 'none'}")
+    latency = report["latency_ms"]
+    print(f"latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    mem = report["memory"]
+    if mem["rss_start_mb"] is not None:
+        print(f"bot RSS: {mem['rss_start_mb']} MB -> {mem['rss_end_mb']} MB ({mem['growth_mb']:+} MB)")
+    print(f"Go API calls: {report['go_api_calls']}")
+    for endpoint, count in sorted(stub_counts.items(), key=lambda item: -item[1]):
+        print(f"  {count:>7}  {endpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,238 +1,242 @@
 import os
-import requests
-import json
+import logging
 import subprocess # Add this import
-import pendulum
+from transcode_cache import TranscodeCache, OPUS_ARGS
+from media_registry import MediaRegistry
+from media_pipeline import MediaPipeline
+from command_router import CommandRouter
 
 # Get timezone from environment variable, default to 'Asia/Jakarta'
 timezone_name = os.getenv("TIMEZONE", "Asia/Jakarta")
 
+ASSETS_DIR = "assets"
+SAMPLE_IMAGE = os.path.join(ASSETS_DIR, "sample_image.jpeg")
+SAMPLE_DOCUMENT = os.path.join(ASSETS_DIR, "sample_document.pdf")
+SAMPLE_VIDEO = os.path.join(ASSETS_DIR, "sample_video.mp4")
+SAMPLE_AUDIO = os.path.join(ASSETS_DIR, "sample_audio.wav")
+
+logger = logging.getLogger(__name__)
+
+def now():
+    # pendulum is imported on first use: it takes longer to import than the rest of the bot
+    # logic, and only the "time" command (or the startup warm-up) needs it
+    import pendulum
+    return pendulum.now(tz=timezone_name)
+
+# Commands are registered with @commands.command(...); handlers are called as handler(bot, sender, args)
+commands = CommandRouter()
+
 class BotLogic:
-    def __init__(self, wa_client, allow_self_message=False):
+    def __init__(self, wa_client, allow_self_message=False, transcode_cache=None, media_registry=None, media_pipeline=None):
         self.wa_client = wa_client
         self.allow_self_message = allow_self_message
+        # Converted audio is cached on disk, keyed by source content and encoder settings
+        self.transcode_cache = transcode_cache or TranscodeCache()
+        # Sample assets are loaded into memory once and reused for every send
+        self.media = media_registry or MediaRegistry(preload_dir=ASSETS_DIR)
+        # Images and videos are uploaded as resized, recompressed variants, made once per file
+        self.preprocess = media_pipeline or MediaPipeline(self.media)
+        self.router = commands
+
+    # Startup warm-up (see startup.py): each step does ahead of time what the first command
+    # using it would otherwise do, and returns a short description for /ready
+
+    def preload_media(self):
+        # Reads the sample assets into memory and makes their upload variants
+        self.media.preload(ASSETS_DIR)
+        variants = sum(self.preprocess.get(path, wait=-1).path != path for path in (SAMPLE_IMAGE, SAMPLE_VIDEO))
+        return {"assets": self.media.stats()["assets"], "variants": variants}
+
+    def pretranscode_audio(self):
+        output_audio_path = self.transcode_cache.transcode(SAMPLE_AUDIO, OPUS_ARGS, ".ogg")
+        self.media.get(output_audio_path)
+        return {"path": output_audio_path}
+
+    def prime_timezone(self):
+        return {"timezone": timezone_name, "now": now().isoformat()}
 
     def handle_message(self, sender, message_content, is_self):
         if is_self and not self.allow_self_message:
-            print(f"Ignoring self-message from {sender}")
+            logger.debug("Ignoring self-message from %s", sender)
             return
 
         if message_content:
-            message_content_lower = message_content.lower()
-            if message_content_lower.startswith("ping"):
-                print(f"Replying 'pong' to {sender}")
-                self.wa_client.send_message(sender, "pong")
-            elif message_content_lower.startswith("menu"):
-                self._send_menu(sender)
-            elif message_content_lower.startswith("send"):
-                self._handle_send_command(sender, message_content_lower)
-            # Add more bot logic here for other commands or interactions
-            # elif message_content.lower() == "hello":
-            #     self.wa_client.send_message(sender, "Hi there!")
-            elif message_content_lower.startswith("time"):
-                self._send_current_time(sender)
-
-    def _send_current_time(self, sender):
-        current_time = pendulum.now(tz=timezone_name)
-        formatted_time_string = f"Current time: {current_time.format('HH:mm:ss ZZ')}"
-        print(f"Sending current time '{formatted_time_string}' to {sender}")
-        self.wa_client.send_message(sender, formatted_time_string)
-
-    def _send_menu(self, sender):
+            self.router.dispatch(self, sender, message_content)
+
+    @commands.command("menu", aliases=("help", "send menu"), hidden=True)
+    def _send_menu(self, sender, args=""):
+        # The menu is built from the help text of every registered command
+        menu_lines = [
+            f"{i}. `{command.usage}`: {command.help}"
+            for i, command in enumerate(self.router.commands(), start=1)
+        ]
         menu_text = (
             "Halo! Saya adalah bot WhatsApp. Berikut adalah daftar perintah yang bisa Anda coba:\n\n"
-            "1. `send text <pesan>`: Mengirim pesan teks.\n"
-            "2. `send image`: Mengirim gambar (contoh dari URL).\n"
-            "3. `send file`: Mengirim file (contoh PDF).\n"
-            "4. `send video`: Mengirim video (contoh dari URL).\n"
-            "5. `send contact`: Mengirim kontak.\n"
-            "6. `send link`: Mengirim link dengan preview.\n"
-            "7. `send location`: Mengirim lokasi.\n"
-            "8. `send audio`: Mengirim audio.\n"
-            "9. `send poll`: Mengirim polling.\n"
-            "10. `send presence <type>`: Mengatur status kehadiran (available, unavailable, composing, paused, recording).\n"
-            "11. `ping`: Membalas dengan 'pong'.\n"
-            "12. `time`: Mendapatkan waktu saat ini.\n\n"
-            # "Contoh: `send text Halo dunia!`"
+            + "\n".join(menu_lines)
+            + "\n\n"
         )
         self.wa_client.send_message(sender, menu_text)
 
-    def _handle_send_command(self, sender, command):
-        parts = command.split(' ', 2) # Split into 'send', 'type', 'args...'
-        if len(parts) < 2:
+    @commands.fallback("send")
+    def _handle_send_command(self, sender, args):
+        # Reached for 'send' on its own or followed by an unknown type
+        if not args:
             self.wa_client.send_message(sender, "Perintah 'send' tidak lengkap. Gunakan `send menu` untuk melihat opsi.")
             return
+        send_type = args.split()[0].lower()
+        self.wa_client.send_message(sender, f"Tipe pengiriman '{send_type}' tidak dikenal. Gunakan `send menu`.")
 
-        send_type = parts[1]
-        args = parts[2] if len(parts) > 2 else ""
-
-        if send_type == "text":
-            self._send_sample_text(sender, args)
-        elif send_type == "image":
-            self._send_sample_image(sender)
-        elif send_type == "file":
-            self._send_sample_file(sender)
-        elif send_type == "video":
-            self._send_sample_video(sender)
-        elif send_type == "contact":
-            self._send_sample_contact(sender)
-        elif send_type == "link":
-            self._send_sample_link(sender)
-        elif send_type == "location":
-            self._send_sample_location(sender)
-        elif send_type == "audio":
-            self._send_sample_audio(sender)
-        elif send_type == "poll":
-            self._send_sample_poll(sender)
-        elif send_type == "presence":
-            self._send_sample_presence(sender, args)
-        else:
-            self.wa_client.send_message(sender, f"Tipe pengiriman '{send_type}' tidak dikenal. Gunakan `send menu`.")
-
+    @commands.command("send text", usage="send text <pesan>", help="Mengirim pesan teks.")
     def _send_sample_text(self, sender, message):
         if not message:
             self.wa_client.send_message(sender, "Mohon berikan pesan untuk dikirim. Contoh: `send text Halo dunia!`")
             return
-        print(f"Sending text message '{message}' to {sender}")
+        logger.debug("Sending text message '%s' to %s", message, sender)
         self.wa_client.send_message(sender, message)
         self.wa_client.send_message(sender, f"Pesan teks '{message}' telah dikirim ke Anda.")
 
-    def _send_sample_image(self, sender):
-        image_path = "assets/sample_image.jpeg"
+    @commands.command("send image", help="Mengirim gambar (contoh dari URL).")
+    def _send_sample_image(self, sender, args=""):
+        image_path = SAMPLE_IMAGE
         caption = "Ini adalah contoh gambar dari aset lokal."
-        print(f"Sending image from '{image_path}' to {sender}")
+        logger.debug("Sending image from '%s' to %s", image_path, sender)
         try:
-            with open(image_path, 'rb') as f:
-                self.wa_client.send_image(sender, f, caption=caption)
+            self.wa_client.send_image(sender, self.preprocess.image(image_path), caption=caption)
             self.wa_client.send_message(sender, f"Gambar dari aset lokal telah dikirim ke Anda.")
         except FileNotFoundError:
             self.wa_client.send_message(sender, f"File gambar tidak ditemukan di: {image_path}")
-            print(f"Error: Image file not found at {image_path}")
+            logger.error("Image file not found at %s", image_path)
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim gambar: {e}")
-            print(f"Error sending image: {e}")
+            logger.error("Error sending image: %s", e)
 
-    def _send_sample_file(self, sender):
-        file_path = "assets/sample_document.pdf"
+    @commands.command("send file", help="Mengirim file (contoh PDF).")
+    def _send_sample_file(self, sender, args=""):
+        file_path = SAMPLE_DOCUMENT
         caption = "Ini adalah contoh dokumen PDF dari aset lokal."
-        print(f"Sending file from '{file_path}' to {sender}")
+        logger.debug("Sending file from '%s' to %s", file_path, sender)
         try:
-            with open(file_path, 'rb') as f:
-                self.wa_client.send_file(sender, f, caption=caption)
+            self.wa_client.send_file(sender, self.media.get(file_path), caption=caption)
             self.wa_client.send_message(sender, f"File dari aset lokal telah dikirim ke Anda.")
         except FileNotFoundError:
             self.wa_client.send_message(sender, f"File dokumen tidak ditemukan di: {file_path}")
-            print(f"Error: Document file not found at {file_path}")
+            logger.error("Document file not found at %s", file_path)
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim file: {e}")
-            print(f"Error sending file: {e}")
+            logger.error("Error sending file: %s", e)
 
-    def _send_sample_video(self, sender):
-        video_path = "assets/sample_video.mp4"
+    @commands.command("send video", help="Mengirim video (contoh dari URL).")
+    def _send_sample_video(self, sender, args=""):
+        video_path = SAMPLE_VIDEO
         caption = "Ini adalah contoh video dari aset lokal."
-        print(f"Sending video from '{video_path}' to {sender}")
+        logger.debug("Sending video from '%s' to %s", video_path, sender)
         try:
-            with open(video_path, 'rb') as f:
-                self.wa_client.send_video(sender, f, caption=caption)
+            self.wa_client.send_video(sender, self.preprocess.video(video_path), caption=caption)
             self.wa_client.send_message(sender, f"Video dari aset lokal telah dikirim ke Anda.")
         except FileNotFoundError:
             self.wa_client.send_message(sender, f"File video tidak ditemukan di: {video_path}")
-            print(f"Error: Video file not found at {video_path}")
+            logger.error("Video file not found at %s", video_path)
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim video: {e}")
-            print(f"Error sending video: {e}")
+            logger.error("Error sending video: %s", e)
 
-    def _send_sample_contact(self, sender):
+    @commands.command("send contact", help="Mengirim kontak.")
+    def _send_sample_contact(self, sender, args=""):
         contact_name = "John Doe"
         contact_phone = "6281234567891" # Example contact phone number
-        print(f"Sending contact '{contact_name}' to {sender}")
+        logger.debug("Sending contact '%s' to %s", contact_name, sender)
         try:
             self.wa_client.send_contact(sender, contact_name, contact_phone)
             self.wa_client.send_message(sender, f"Kontak '{contact_name}' telah dikirim ke Anda.")
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim kontak: {e}")
-            print(f"Error sending contact: {e}")
+            logger.error("Error sending contact: %s", e)
 
-    def _send_sample_link(self, sender):
+    @commands.command("send link", help="Mengirim link dengan preview.")
+    def _send_sample_link(self, sender, args=""):
         link = "https://www.google.com"
         caption = "Ini adalah contoh link ke Google."
-        print(f"Sending link '{link}' to {sender}")
+        logger.debug("Sending link '%s' to %s", link, sender)
         try:
             self.wa_client.send_link(sender, link, caption=caption)
             self.wa_client.send_message(sender, f"Link '{link}' telah dikirim ke Anda.")
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim link: {e}")
-            print(f"Error sending link: {e}")
+            logger.error("Error sending link: %s", e)
 
-    def _send_sample_location(self, sender):
+    @commands.command("send location", help="Mengirim lokasi.")
+    def _send_sample_location(self, sender, args=""):
         latitude = "-6.2088" # Example latitude for Jakarta
         longitude = "106.8456" # Example longitude for Jakarta
-        print(f"Sending location {latitude}, {longitude} to {sender}")
+        logger.debug("Sending location %s, %s to %s", latitude, longitude, sender)
         try:
             self.wa_client.send_location(sender, latitude, longitude)
             self.wa_client.send_message(sender, f"Lokasi ({latitude}, {longitude}) telah dikirim ke Anda.")
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim lokasi: {e}")
-            print(f"Error sending location: {e}")
+            logger.error("Error sending location: %s", e)
 
-    def _send_sample_audio(self, sender):
-        audio_path = "assets/sample_audio.wav"
-        output_audio_path = "assets/sample_audio.ogg" # New path for converted audio
-        print(f"Sending audio from '{audio_path}' to {sender}")
+    @commands.command("send audio", help="Mengirim audio.")
+    def _send_sample_audio(self, sender, args=""):
+        audio_path = SAMPLE_AUDIO
+        logger.debug("Sending audio from '%s' to %s", audio_path, sender)
         try:
-            # Convert WAV to OGG Opus using ffmpeg
-            command = [
-                "ffmpeg",
-                "-i", audio_path,
-                "-c:a", "libopus",
-                "-b:a", "64k",
-                "-vbr", "on",
-                "-compression_level", "10",
-                output_audio_path
-            ]
-            subprocess.run(command, check=True, capture_output=True)
-            print(f"Audio converted to OGG Opus: {output_audio_path}")
-
-            with open(output_audio_path, 'rb') as f:
-                self.wa_client.send_audio(sender, f)
-            self.wa_client.send_message(sender, f"Audio dari aset lokal telah dikirim ke Anda.")
-
-            # Clean up the converted file after successful sending
-            if os.path.exists(output_audio_path):
-                os.remove(output_audio_path)
-                print(f"Cleaned up converted audio file: {output_audio_path}")
+            # Convert WAV to OGG Opus using ffmpeg, or reuse an earlier conversion
+            output_audio_path = self.transcode_cache.transcode(audio_path, OPUS_ARGS, ".ogg")
+            logger.debug("Audio converted to OGG Opus: %s", output_audio_path)
 
+            self.wa_client.send_audio(sender, self.media.get(output_audio_path))
+            self.wa_client.send_message(sender, f"Audio dari aset lokal telah dikirim ke Anda.")
         except FileNotFoundError:
             self.wa_client.send_message(sender, f"File audio tidak ditemukan di: {audio_path}")
-            print(f"Error: Audio file not found at {audio_path}")
+            logger.error("Audio file not found at %s", audio_path)
         except subprocess.CalledProcessError as e:
             self.wa_client.send_message(sender, f"Gagal mengkonversi audio: {e.stderr.decode()}")
-            print(f"Error converting audio: {e.stderr.decode()}")
+            logger.error("Error converting audio: %s", e.stderr.decode())
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim audio: {e}")
-            print(f"Error sending audio: {e}")
+            logger.error("Error sending audio: %s", e)
 
-    def _send_sample_poll(self, sender):
+    @commands.command("send poll", help="Mengirim polling.")
+    def _send_sample_poll(self, sender, args=""):
         question = "Apa warna favoritmu?"
         options = ["Merah", "Biru", "Hijau", "Kuning"]
         max_answers = 1
-        print(f"Sending poll '{question}' to {sender}")
+        logger.debug("Sending poll '%s' to %s", question, sender)
         try:
             self.wa_client.send_poll(sender, question, options, max_answers)
             self.wa_client.send_message(sender, f"Polling '{question}' telah dikirim ke Anda.")
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengirim polling: {e}")
-            print(f"Error sending poll: {e}")
+            logger.error("Error sending poll: %s", e)
 
+    @commands.command(
+        "send presence",
+        usage="send presence <type>",
+        help="Mengatur status kehadiran (available, unavailable, composing, paused, recording).",
+    )
     def _send_sample_presence(self, sender, presence_type):
+        presence_type = presence_type.lower()
         valid_presence_types = ["available", "unavailable", "composing", "paused", "recording"]
         if presence_type not in valid_presence_types:
             self.wa_client.send_message(sender, f"Tipe kehadiran '{presence_type}' tidak valid. Gunakan salah satu: {', '.join(valid_presence_types)}.")
             return
-        print(f"Setting presence to '{presence_type}'")
+        logger.debug("Setting presence to '%s'", presence_type)
         try:
             self.wa_client.send_presence(presence_type)
             self.wa_client.send_message(sender, f"Status kehadiran diatur ke '{presence_type}'.")
         except Exception as e:
             self.wa_client.send_message(sender, f"Gagal mengatur kehadiran: {e}")
-            print(f"Error setting presence: {e}")
+            logger.error("Error setting presence: %s", e)
+
+    @commands.command("ping", help="Membalas dengan 'pong'.")
+    def _send_pong(self, sender, args=""):
+        logger.debug("Replying 'pong' to %s", sender)
+        self.wa_client.send_message(sender, "pong")
+
+    @commands.command("time", help="Mendapatkan waktu saat ini.")
+    def _send_current_time(self, sender, args=""):
+        current_time = now()
+        formatted_time_string = f"Current time: {current_time.format('HH:mm:ss ZZ')}"
+        logger.debug("Sending current time '%s' to %s", formatted_time_string, sender)
+        self.wa_client.send_message(sender, formatted_time_string)
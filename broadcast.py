@@ -0,0 +1,358 @@
+import os
+import json
+import threading
+import time
+import uuid
+import logging
+
+try:
+    import fcntl # POSIX only: lets worker processes agree on who runs a broadcast
+except ImportError:
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor
+from outbound_scheduler import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_DIR = os.getenv("BROADCAST_DIR", "cache/broadcasts")
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "4"))
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "2"))
+# Media for broadcasts can only be taken from this directory
+BROADCAST_MEDIA_DIR = os.getenv("BROADCAST_MEDIA_DIR", "assets")
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+# The send failed but the outbox retries it; not sent again on resume
+STATUS_QUEUED = "queued"
+
+PAYLOAD_TYPES = ("text", "image", "video", "file", "audio", "link")
+
+
+def _result_jids(response, *keys):
+    # go-wa-api list responses look like {"results": {"data": [{"jid": ...}, ...]}}
+    results = (response or {}).get("results") or {}
+    items = results.get("data") if isinstance(results, dict) else results
+    jids = []
+    for item in items or []:
+        for key in keys:
+            if isinstance(item, dict) and item.get(key):
+                jids.append(item[key])
+                break
+    return jids
+
+
+def recipients_from_contacts(client):
+    return _result_jids(client.user_my_contacts(), "jid", "JID")
+
+
+def recipients_from_groups(client):
+    return _result_jids(client.user_my_groups(), "JID", "jid")
+
+
+def validate_payload(payload):
+    kind = payload.get("type")
+    if kind not in PAYLOAD_TYPES:
+        raise ValueError(f"Unknown payload type '{kind}', expected one of: {', '.join(PAYLOAD_TYPES)}")
+    if kind == "text" and not payload.get("message"):
+        raise ValueError("A text broadcast needs a 'message'")
+    if kind == "link" and not payload.get("link"):
+        raise ValueError("A link broadcast needs a 'link'")
+    if kind == "image" and not (payload.get("path") or payload.get("image_url")):
+        raise ValueError("An image broadcast needs a 'path' or an 'image_url'")
+    if kind in ("video", "file", "audio") and not payload.get("path"):
+        raise ValueError(f"A {kind} broadcast needs a 'path'")
+    if payload.get("path"):
+        media_dir = os.path.realpath(BROADCAST_MEDIA_DIR)
+        if os.path.commonpath([media_dir, os.path.realpath(payload["path"])]) != media_dir:
+            raise ValueError(f"Broadcast media must be inside '{BROADCAST_MEDIA_DIR}'")
+
+
+class Broadcast:
+    # Sends one payload to many recipients. Per-recipient status is checkpointed to
+    # BROADCAST_DIR/<id>.json, so a broadcast interrupted by a restart picks up with the
+    # recipients that haven't been sent to yet.
+    def __init__(self, client, media, recipients, payload, broadcast_id=None,
+                 concurrency=BROADCAST_CONCURRENCY, directory=BROADCAST_DIR):
+        validate_payload(payload)
+        self.client = client
+        self.media = media
+        self.id = broadcast_id or uuid.uuid4().hex[:12]
+        self.payload = payload
+        self.concurrency = concurrency
+        self.path = os.path.join(directory, f"{self.id}.json")
+        # Created by another worker process to ask the one running this broadcast to stop it
+        self.stop_path = os.path.join(directory, f"{self.id}.stop")
+        self._lock_file = None
+        # dict keeps insertion order and drops duplicate recipients
+        self.status = {recipient: STATUS_PENDING for recipient in recipients}
+        self.errors = {}
+        self.created_at = time.time()
+        self.state = "created"
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshots = 0 # checkpoint snapshots taken, and the latest one written
+        self._written = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._started = None
+        self._sent_this_run = 0
+        self._last_checkpoint = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def load(cls, client, media, path):
+        with open(path) as f:
+            state = json.load(f)
+        broadcast = cls(client, media, [], state["payload"], broadcast_id=state["id"],
+                        directory=os.path.dirname(path))
+        broadcast.status = state["status"]
+        broadcast.errors = state.get("errors", {})
+        broadcast.created_at = state.get("created_at", broadcast.created_at)
+        broadcast.state = state.get("state", "interrupted")
+        return broadcast
+
+    def try_lock(self):
+        # Takes the broadcast's run lock, held until _run returns; False if another process has it
+        if fcntl is None:
+            return True
+        lock_file = open(os.path.join(os.path.dirname(self.path), f"{self.id}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _unlock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def start(self):
+        self.state = "running"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"broadcast-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        # Stops handing out new sends; the checkpoint keeps what is left for a later resume
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._send_all()
+        finally:
+            self._unlock()
+
+    def _send_all(self):
+        self._started = time.monotonic()
+        self._sent_this_run = 0
+        pending = [recipient for recipient, status in self.status.items() if status not in (STATUS_SENT, STATUS_QUEUED)]
+        logger.info("Broadcast %s: sending to %s of %s recipients", self.id, len(pending), len(self.status))
+        # Media is read once and the same in-memory buffer is reused for every recipient. With
+        # this many uploads of it, waiting for a smaller variant is always worth it.
+        try:
+            media = self.media.get(self.payload["path"], self.payload["type"], wait=-1) if self.payload.get("path") else None
+        except OSError as e:
+            logger.error("Broadcast %s: cannot load media: %s", self.id, e)
+            self.state = "failed"
+            self.checkpoint()
+            return
+        self.checkpoint()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"broadcast-{self.id}") as executor:
+            for recipient in pending:
+                if self._stop.is_set():
+                    break
+                executor.submit(self._send_one, recipient, media)
+        with self._lock:
+            if self._stop.is_set():
+                self.state = "stopped"
+            else:
+                self.state = "completed"
+        self.checkpoint()
+        logger.info("Broadcast %s %s: %s", self.id, self.state, self.progress())
+
+    def _send_one(self, recipient, media):
+        if not self._stop.is_set() and os.path.exists(self.stop_path):
+            logger.info("Broadcast %s: stop requested by another worker", self.id)
+            self._stop.set()
+            os.remove(self.stop_path)
+        if self._stop.is_set():
+            return
+        scheduler = getattr(self.client, "scheduler", None)
+        try:
+            if scheduler is not None:
+                with scheduler.priority(PRIORITY_BULK):
+                    response = self._send(recipient, media)
+            else:
+                response = self._send(recipient, media)
+            ok = isinstance(response, dict) and response.get("code") != "ERROR"
+            queued = not ok and isinstance(response, dict) and response.get("queued") is True
+            error = None if ok else (response or {}).get("message", "Unknown error")
+        except Exception as e:
+            ok, queued, error = False, False, str(e)
+        with self._lock:
+            if ok:
+                self.status[recipient] = STATUS_SENT
+                self._sent_this_run += 1
+                self.errors.pop(recipient, None)
+            elif queued:
+                self.status[recipient] = STATUS_QUEUED
+                self.errors.pop(recipient, None)
+            else:
+                self.status[recipient] = STATUS_FAILED
+                self.errors[recipient] = error
+            due = time.monotonic() - self._last_checkpoint >= BROADCAST_CHECKPOINT_INTERVAL
+        if due:
+            self.checkpoint()
+
+    def _send(self, recipient, media):
+        payload = self.payload
+        kind = payload["type"]
+        caption = payload.get("caption")
+        if kind == "text":
+            return self.client.send_message(recipient, payload["message"])
+        if kind == "link":
+            return self.client.send_link(recipient, payload["link"], caption=caption)
+        if kind == "image":
+            return self.client.send_image(recipient, media, image_url=payload.get("image_url"), caption=caption)
+        if kind == "video":
+            return self.client.send_video(recipient, media, caption=caption)
+        if kind == "file":
+            return self.client.send_file(recipient, media, caption=caption)
+        return self.client.send_audio(recipient, media)
+
+    def checkpoint(self):
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            self._snapshots += 1
+            seq = self._snapshots
+            state = {
+                "id": self.id,
+                "state": self.state,
+                "created_at": self.created_at,
+                "payload": self.payload,
+                "status": dict(self.status),
+                "errors": dict(self.errors),
+            }
+        # Sender threads checkpoint concurrently; a snapshot older than the one on disk is dropped
+        # rather than written over it, or a resume would send to recipients again
+        with self._write_lock:
+            if seq <= self._written:
+                return
+            # Write to a temporary file and rename, so a crash never leaves a half-written checkpoint
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+            self._written = seq
+
+    def progress(self):
+        with self._lock:
+            counts = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_QUEUED: 0, STATUS_FAILED: 0}
+            for status in self.status.values():
+                counts[status] += 1
+            elapsed = time.monotonic() - self._started if self._started else 0.0
+            rate = self._sent_this_run / elapsed if elapsed > 0 else 0.0
+            return {
+                "id": self.id,
+                "state": self.state,
+                "total": len(self.status),
+                "sent": counts[STATUS_SENT],
+                "queued": counts[STATUS_QUEUED],
+                "failed": counts[STATUS_FAILED],
+                "pending": counts[STATUS_PENDING],
+                "messages_per_second": round(rate, 2),
+                "eta_seconds": round(counts[STATUS_PENDING] / rate, 1) if rate > 0 else None,
+            }
+
+
+class BroadcastManager:
+    def __init__(self, client, media, directory=BROADCAST_DIR):
+        self.client = client
+        self.media = media
+        self.directory = directory
+        self._broadcasts = {}
+        self._lock = threading.Lock()
+
+    def start(self, recipients, payload, concurrency=BROADCAST_CONCURRENCY):
+        broadcast = Broadcast(self.client, self.media, recipients, payload,
+                              concurrency=concurrency, directory=self.directory)
+        broadcast.try_lock()
+        with self._lock:
+            self._broadcasts[broadcast.id] = broadcast
+        return broadcast.start()
+
+    def get(self, broadcast_id):
+        # Broadcasts run by another worker process are read from their checkpoint
+        with self._lock:
+            broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is not None or not broadcast_id.isalnum():
+            return broadcast
+        return self._load(f"{broadcast_id}.json")
+
+    def all(self):
+        with self._lock:
+            broadcasts = dict(self._broadcasts)
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if name.endswith(".json") and name[:-5] not in broadcasts:
+                    broadcast = self._load(name)
+                    if broadcast is not None:
+                        broadcasts[broadcast.id] = broadcast
+        return list(broadcasts.values())
+
+    def stop(self, broadcast):
+        if broadcast.state == "running" and broadcast._thread is None:
+            # Running in another worker process: leave a stop request for it
+            open(broadcast.stop_path, "w").close()
+        else:
+            broadcast.stop()
+
+    def _load(self, name):
+        try:
+            return Broadcast.load(self.client, self.media, os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Error loading broadcast checkpoint '%s': %s", name, e)
+            return None
+
+    def resume_pending(self):
+        # Restart every checkpointed broadcast that didn't finish before the last shutdown
+        if not os.path.isdir(self.directory):
+            return []
+        resumed = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            broadcast = self._load(name)
+            if broadcast is None:
+                continue
+            # With several worker processes, the first to take the lock resumes it
+            if broadcast.state in ("running", "interrupted") and broadcast.try_lock():
+                with self._lock:
+                    self._broadcasts[broadcast.id] = broadcast
+                logger.info("Resuming broadcast %s", broadcast.id)
+                resumed.append(broadcast.start())
+        return resumed
+
+    def shutdown(self, timeout=10.0):
+        # Only the broadcasts this process runs: the others' checkpoints belong to their workers
+        with self._lock:
+            owned = list(self._broadcasts.values())
+        for broadcast in owned:
+            if broadcast.state == "running":
+                broadcast.stop(timeout)
+                # Leave it marked as running so the next start resumes it
+                broadcast.state = "running"
+                broadcast.checkpoint()
@@ -0,0 +1,115 @@
+import time
+from metrics import COMMAND_DURATION, COMMAND_ERRORS
+
+
+class Command:
+    __slots__ = ("name", "handler", "help", "usage", "aliases", "hidden")
+
+    def __init__(self, name, handler, help=None, usage=None, aliases=(), hidden=False):
+        self.name = name
+        self.handler = handler
+        self.help = help
+        self.usage = usage or name
+        self.aliases = tuple(aliases)
+        self.hidden = hidden
+
+
+class _Node:
+    __slots__ = ("children", "command", "fallback")
+
+    def __init__(self):
+        self.children = {}
+        self.command = None
+        self.fallback = None
+
+
+class CommandRouter:
+    # Commands are stored in a trie keyed by whole words ("send" -> "image"), so routing
+    # costs one dict lookup per word of the command instead of a scan over every command.
+    def __init__(self):
+        self._root = _Node()
+        self._commands = []
+        self._depth = 1
+
+    def command(self, name, help=None, usage=None, aliases=(), hidden=False):
+        # Decorator for handlers with the signature handler(bot, sender, args)
+        def decorator(handler):
+            self.register(Command(name, handler, help=help, usage=usage, aliases=aliases, hidden=hidden))
+            return handler
+        return decorator
+
+    def fallback(self, prefix):
+        # Decorator for a handler called when `prefix` matches but none of its subcommands do
+        def decorator(handler):
+            self._node(prefix).fallback = Command(prefix, handler, hidden=True)
+            return handler
+        return decorator
+
+    def register(self, command):
+        for name in (command.name,) + command.aliases:
+            node = self._node(name)
+            if node.command is not None:
+                raise ValueError(f"Command '{name}' is already registered")
+            node.command = command
+        self._commands.append(command)
+
+    def _node(self, name):
+        words = name.lower().split()
+        self._depth = max(self._depth, len(words))
+        node = self._root
+        for word in words:
+            node = node.children.setdefault(word, _Node())
+        return node
+
+    def resolve(self, text):
+        # Returns (handler, args) for the longest registered prefix of `text`, or (None, None)
+        command, args = self._match(text)
+        return (command.handler, args) if command is not None else (None, None)
+
+    def _match(self, text):
+        words = text.split(None, self._depth)
+        node = self._root
+        match = (None, 0)
+        for i, word in enumerate(words[:self._depth]):
+            word = word.lower()
+            child = node.children.get(word)
+            if child is None and i == 0:
+                # The bot has always answered a first word that starts with a command ("ping!",
+                # "pingpong"); only reached when no command is the whole word
+                child = self._prefix_child(word)
+            node = child
+            if node is None:
+                break
+            if node.command is not None:
+                match = (node.command, i + 1)
+            elif node.fallback is not None:
+                match = (node.fallback, i + 1)
+        command, matched = match
+        if command is None:
+            return None, None
+        return command, " ".join(words[matched:])
+
+    def _prefix_child(self, word):
+        # Top-level node of the longest command word `word` starts with
+        best = None
+        for key, child in self._root.children.items():
+            if word.startswith(key) and (best is None or len(key) > len(best[0])):
+                best = (key, child)
+        return best[1] if best is not None else None
+
+    def dispatch(self, bot, sender, text):
+        command, args = self._match(text)
+        if command is None:
+            return False
+        start = time.perf_counter()
+        try:
+            command.handler(bot, sender, args)
+        except Exception:
+            COMMAND_ERRORS.inc(command.name)
+            raise
+        finally:
+            COMMAND_DURATION.observe(time.perf_counter() - start, command.name)
+        return True
+
+    def commands(self):
+        return [command for command in self._commands if not command.hidden]
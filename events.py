@@ -0,0 +1,167 @@
+import os
+import json
+import codecs
+import itertools
+from functools import lru_cache
+
+# Distinct senders whose normalized JID is remembered; chats repeat, so most lookups hit
+EVENT_JID_CACHE_SIZE = int(os.getenv("EVENT_JID_CACHE_SIZE", "65536"))
+# Limits for one /webhook/batch request
+WEBHOOK_BATCH_MAX_EVENTS = int(os.getenv("WEBHOOK_BATCH_MAX_EVENTS", "1000"))
+WEBHOOK_BATCH_MAX_BYTES = int(os.getenv("WEBHOOK_BATCH_MAX_BYTES", str(10 * 1024 * 1024)))
+
+_READ_SIZE = 64 * 1024
+_WHITESPACE = " \t\r\n"
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class BatchTooLarge(ValueError):
+    pass
+
+
+@lru_cache(maxsize=EVENT_JID_CACHE_SIZE)
+def _normalize_jid(raw_sender):
+    # "6285890392419:56@s.whatsapp.net in 6285890392419@s.whatsapp.net" -> "6285890392419@s.whatsapp.net":
+    # the part before " in ", without the device number
+    jid = raw_sender.split(" in ", 1)[0]
+    user, colon, rest = jid.partition(":")
+    if colon and "@s.whatsapp.net" in rest.split(":", 1)[0]:
+        return user + "@s.whatsapp.net"
+    return jid # No device part
+
+
+def normalize_jid(raw_sender):
+    if not raw_sender or not isinstance(raw_sender, str):
+        return None
+    return _normalize_jid(raw_sender)
+
+
+class Event:
+    # One webhook event from the Go WA API, with the fields the bot routes on pulled out once
+    __slots__ = ("data", "raw", "sender", "type", "text")
+
+    def __init__(self, data, raw):
+        if not isinstance(data, dict):
+            raise InvalidEvent("Webhook event must be a JSON object")
+        self.data = data
+        self.raw = raw # the event's bytes as received, for /logs and dedup hashing
+        sender = data.get("from")
+        # normalize_jid inlined: this runs for every event
+        self.sender = _normalize_jid(sender) if sender and type(sender) is str else None
+        message = data.get("message")
+        # Receipts, reactions etc. carry an explicit "event"; plain chat messages don't
+        self.type = data.get("event") or ("message" if "message" in data else "unknown")
+        self.text = message.get("text") if type(message) is dict else None
+
+
+def parse_event(payload):
+    # Raises json.JSONDecodeError or InvalidEvent (both ValueErrors)
+    return Event(json.loads(payload), payload)
+
+
+def iter_batch(chunks, max_events=WEBHOOK_BATCH_MAX_EVENTS, max_bytes=WEBHOOK_BATCH_MAX_BYTES):
+    # Parses a batch body as it arrives, from an iterable of byte chunks. The body is either
+    # NDJSON (one event per line) or a JSON array of events, told apart by its first byte.
+    # Only the unparsed tail of the body is held, never the whole of it.
+    chunks = _limited(chunks, max_bytes)
+    first = b""
+    for first in chunks:
+        if first.strip():
+            break
+    if first.lstrip()[:1] == b"[":
+        events = _iter_array(first, chunks)
+    else:
+        events = _iter_ndjson(first, chunks)
+    for count, event in enumerate(events, start=1):
+        if count > max_events:
+            raise BatchTooLarge(f"Batch has more than {max_events} events")
+        yield event
+
+
+def read_chunks(stream, size=_READ_SIZE):
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _limited(chunks, max_bytes):
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise BatchTooLarge(f"Batch is larger than {max_bytes} bytes")
+        yield chunk
+
+
+def _iter_ndjson(first, chunks):
+    buffer = b""
+    for chunk in itertools.chain((first,), chunks):
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield parse_event(line)
+    if buffer.strip():
+        yield parse_event(buffer)
+
+
+def _iter_array(first, chunks):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = text_decoder.decode(first)
+    position = buffer.index("[") + 1
+    values = 0
+    expect_value = True # after "[" or ","
+
+    def more(buffer, position):
+        # Drops the parsed head of the buffer and appends the next chunk; None at the end of the body
+        chunk = next(chunks, None)
+        if chunk is None:
+            return None
+        return buffer[position:] + text_decoder.decode(chunk)
+
+    while True:
+        position = _skip_whitespace(buffer, position)
+        if position == len(buffer):
+            buffer = more(buffer, position)
+            if buffer is None:
+                raise json.JSONDecodeError("Unterminated array", "", 0)
+            position = 0
+            continue
+        char = buffer[position]
+        if char == "]" and (not expect_value or values == 0):
+            position += 1
+            break
+        if char == "," and not expect_value:
+            expect_value = True
+            position += 1
+            continue
+        if not expect_value:
+            raise json.JSONDecodeError("Expected ',' or ']'", buffer, position)
+        try:
+            data, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Most likely an event cut off at the end of this chunk
+            extended = more(buffer, position)
+            if extended is None:
+                raise
+            buffer, position = extended, 0
+            continue
+        yield Event(data, buffer[position:end].encode("utf-8"))
+        values += 1
+        position = end
+        expect_value = False
+    if buffer[position:].strip() or any(chunk.strip() for chunk in chunks):
+        raise json.JSONDecodeError("Extra data after the array", buffer, position)
+
+
+def _skip_whitespace(text, position):
+    while position < len(text) and text[position] in _WHITESPACE:
+        position += 1
+    return position
@@ -0,0 +1,41 @@
+# Production serving: several worker processes, each with a few threads.
+#
+#   gunicorn -c gunicorn.conf.py main:app
+#
+# Workers share dedup keys, webhook logs, the API cache and rate limits through the SQLite
+# file at SHARED_STATE_PATH, and /metrics adds up the counters of every worker.
+import os
+import shutil
+import signal
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+if workers > 1:
+    # Set unconditionally: with per-process state each worker would dedup, log and rate-limit
+    # on its own, whatever an .env file says
+    os.environ["SHARED_STATE"] = "true"
+    if not os.getenv("METRICS_DIR"):
+        os.environ["METRICS_DIR"] = "cache/metrics"
+worker_class = "gthread"
+# Handlers mostly wait on the Go API, so each worker runs several of them at once
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Each worker imports main.py itself, so none of its threads, pools or database connections
+# are created before the fork
+preload_app = False
+# Time a worker gets on SIGTERM to drain its webhook queue, outbox writes and logs
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+
+def on_starting(server):
+    # Metric snapshots of a previous run would otherwise be added to this one's
+    if os.getenv("METRICS_DIR"):
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+
+def post_worker_init(worker):
+    # main.py turns SIGTERM into exit(0) for the single-process server; give it back to
+    # gunicorn so workers stop accepting requests first, then run the atexit drains
+    signal.signal(signal.SIGTERM, worker.handle_exit)
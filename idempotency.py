@@ -0,0 +1,126 @@
+import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+WEBHOOK_DEDUP_ENABLED = os.getenv("WEBHOOK_DEDUP_ENABLED", "true").lower() == "true"
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", "100000"))
+
+
+def event_key(event_data, payload):
+    # The message ID when the event has one, otherwise a hash of the raw body
+    message = event_data.get("message")
+    if isinstance(message, dict) and message.get("id"):
+        return "id:" + str(message["id"])
+    nested = event_data.get("payload")
+    if isinstance(nested, dict) and nested.get("id"):
+        return f"{event_data.get('event')}:{nested['id']}"
+    return "sha:" + hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class SeenSet:
+    # Keys expire after `ttl` seconds and the oldest are dropped past `max_entries`.
+    # With a single TTL, insertion order is also expiry order, so both checks
+    # only ever look at the front of the OrderedDict.
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, max_entries=WEBHOOK_DEDUP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> expires_at
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+
+    def seen(self, key):
+        # Returns True if `key` was seen within the TTL; otherwise records it and returns False
+        now = time.monotonic()
+        with self._lock:
+            self._checked += 1
+            expires_at = self._entries.get(key)
+            if expires_at is not None and expires_at > now:
+                self._duplicates += 1
+                return True
+            self._entries.pop(key, None)
+            self._entries[key] = now + self.ttl
+            while self._entries:
+                oldest_key, oldest_expiry = next(iter(self._entries.items()))
+                if oldest_expiry > now and len(self._entries) <= self.max_entries:
+                    break
+                del self._entries[oldest_key]
+            return False
+
+    def forget(self, key):
+        # Used when an event was not processed, so the sender's retry isn't treated as a duplicate
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "checked": self._checked,
+                "duplicates_dropped": self._duplicates,
+            }
+
+
+class SharedSeenSet:
+    # SeenSet backed by the shared state database, so a webhook retried to another worker
+    # process is still recognised. Expired keys are swept every `sweep_every` checks.
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS seen_events (key TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS seen_events_expiry ON seen_events (expires_at);
+    """
+
+    def __init__(self, db, ttl=WEBHOOK_DEDUP_TTL, max_entries=WEBHOOK_DEDUP_MAX_ENTRIES, sweep_every=1000):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_every = sweep_every
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+        db.ensure_schema("seen_events", self._SCHEMA)
+
+    def seen(self, key):
+        # Wall-clock time, since monotonic clocks aren't comparable after a restart
+        now = time.time()
+        with self.db.transaction() as db:
+            fresh = db.execute("SELECT 1 FROM seen_events WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if fresh is None:
+                db.execute("INSERT OR REPLACE INTO seen_events (key, expires_at) VALUES (?, ?)", (key, now + self.ttl))
+        with self._lock:
+            self._checked += 1
+            if fresh is not None:
+                self._duplicates += 1
+            sweep = self._checked % self.sweep_every == 0
+        if sweep:
+            self._sweep(now)
+        return fresh is not None
+
+    def _sweep(self, now):
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM seen_events WHERE expires_at <= ?", (now,))
+            # Past max_entries, drop the keys closest to expiring, like SeenSet drops the oldest
+            db.execute(
+                "DELETE FROM seen_events WHERE key IN (SELECT key FROM seen_events ORDER BY expires_at "
+                "LIMIT max(0, (SELECT COUNT(*) FROM seen_events) - ?))",
+                (self.max_entries,),
+            )
+
+    def forget(self, key):
+        self.db.execute("DELETE FROM seen_events WHERE key = ?", (key,))
+
+    def stats(self):
+        entries = self.db.execute("SELECT COUNT(*) FROM seen_events").fetchone()[0]
+        with self._lock:
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "checked": self._checked,
+                "duplicates_dropped": self._duplicates,
+                "shared": True,
+            }
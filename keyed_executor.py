@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+import zlib
+import logging
+from webhook_queue import QueueFull
+
+logger = logging.getLogger(__name__)
+
+# Sentinel put on every shard queue to stop its worker after the backlog is drained
+_STOP = object()
+
+
+class _Shard:
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class KeyedExecutor:
+    # Events with the same key always land on the same shard, and each shard is
+    # drained by a single worker, so they run in arrival order. Different keys
+    # spread over the shards and run in parallel.
+    def __init__(self, handler, key_func, shards=4, shard_maxsize=100, put_timeout=0.0):
+        self.handler = handler
+        self.key_func = key_func
+        self.put_timeout = put_timeout
+        self._shards = [_Shard(shard_maxsize) for _ in range(shards)]
+        self._accepting = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._accepting:
+                return
+            self._accepting = True
+            for i, shard in enumerate(self._shards):
+                shard.thread = threading.Thread(target=self._worker, args=(shard,), name=f"shard-worker-{i}", daemon=True)
+                shard.thread.start()
+
+    def shard_for(self, key):
+        # crc32 instead of hash() so a key maps to the same shard in every process
+        return zlib.crc32((key or "").encode("utf-8")) % len(self._shards)
+
+    def submit(self, event):
+        if not self._accepting:
+            raise QueueFull("Dispatcher is shutting down")
+        shard = self._shards[self.shard_for(self.key_func(event))]
+        try:
+            if self.put_timeout > 0:
+                shard.queue.put((time.monotonic(), event), timeout=self.put_timeout)
+            else:
+                shard.queue.put_nowait((time.monotonic(), event))
+        except queue.Full:
+            with self._lock:
+                shard.rejected += 1
+            raise QueueFull("Dispatcher shard is full")
+
+    def _worker(self, shard):
+        while True:
+            item = shard.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                enqueued_at, event = item
+                waited = time.monotonic() - enqueued_at
+                with self._lock:
+                    shard.wait_total += waited
+                    shard.wait_max = max(shard.wait_max, waited)
+                try:
+                    self.handler(event)
+                    with self._lock:
+                        shard.processed += 1
+                except Exception as e:
+                    with self._lock:
+                        shard.failed += 1
+                    logger.exception("Shard worker: An error occurred: %s", e)
+            finally:
+                shard.queue.task_done()
+
+    def depth(self):
+        return sum(shard.queue.qsize() for shard in self._shards)
+
+    def stats(self):
+        shards = []
+        with self._lock:
+            for shard in self._shards:
+                started = shard.processed + shard.failed
+                shards.append({
+                    "depth": shard.queue.qsize(),
+                    "capacity": shard.queue.maxsize,
+                    "processed": shard.processed,
+                    "failed": shard.failed,
+                    "rejected": shard.rejected,
+                    "wait_avg_ms": round(shard.wait_total / started * 1000, 3) if started else 0.0,
+                    "wait_max_ms": round(shard.wait_max * 1000, 3),
+                })
+        return {
+            "depth": sum(s["depth"] for s in shards),
+            "workers": len(shards),
+            "processed": sum(s["processed"] for s in shards),
+            "failed": sum(s["failed"] for s in shards),
+            "rejected": sum(s["rejected"] for s in shards),
+            "shards": shards,
+        }
+
+    def shutdown(self, timeout=30.0):
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        logger.info("Draining dispatcher (%s pending)...", self.depth())
+        deadline = time.monotonic() + timeout
+        stopping = []
+        for shard in self._shards:
+            # A full shard only frees up as its worker drains it, so this waits no longer than the deadline
+            try:
+                shard.queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0))
+                stopping.append(shard)
+            except queue.Full:
+                pass
+        for shard in stopping:
+            shard.thread.join(max(deadline - time.monotonic(), 0))
+        if len(stopping) < len(self._shards):
+            logger.warning("Dispatcher not drained within %ss (%s pending)", timeout, self.depth())
+            return
+        logger.info("Dispatcher drained.")
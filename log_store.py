@@ -0,0 +1,238 @@
+import bisect
+import threading
+import time
+
+
+class _SeqIndex:
+    # Ascending list of sequence numbers for one key. Evicted entries are always
+    # the oldest, so they are dropped by moving `head` forward and compacting now and then.
+    __slots__ = ("seqs", "head")
+
+    def __init__(self):
+        self.seqs = []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.seqs) - self.head
+
+    def append(self, seq):
+        self.seqs.append(seq)
+
+    def evict(self, seq):
+        if self.head < len(self.seqs) and self.seqs[self.head] == seq:
+            self.head += 1
+            if self.head > 64 and self.head * 2 > len(self.seqs):
+                del self.seqs[:self.head]
+                self.head = 0
+
+    def from_seq(self, seq):
+        start = bisect.bisect_left(self.seqs, seq, self.head)
+        return self.seqs, start
+
+
+class LogStore:
+    # Fixed-capacity ring buffer of raw webhook payloads, capped by entry count and bytes.
+    # Every entry gets an increasing sequence number which doubles as the pagination cursor.
+    def __init__(self, max_entries=1000, max_bytes=5 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._ring = [None] * max_entries
+        self._first_seq = 0
+        self._next_seq = 0
+        self._bytes = 0
+        self._by_sender = {}
+        self._by_type = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._next_seq - self._first_seq
+
+    def append(self, payload, sender=None, event_type=None, timestamp=None):
+        size = len(payload)
+        if size > self.max_bytes:
+            with self._lock:
+                self._dropped += 1
+            return None
+        entry = (timestamp or time.time(), sender, event_type, payload)
+        with self._lock:
+            while len(self) >= self.max_entries or self._bytes + size > self.max_bytes:
+                self._evict_oldest()
+            seq = self._next_seq
+            self._ring[seq % self.max_entries] = entry
+            self._next_seq += 1
+            self._bytes += size
+            if sender:
+                self._by_sender.setdefault(sender, _SeqIndex()).append(seq)
+            if event_type:
+                self._by_type.setdefault(event_type, _SeqIndex()).append(seq)
+            return seq
+
+    def _evict_oldest(self):
+        seq = self._first_seq
+        slot = seq % self.max_entries
+        _, sender, event_type, payload = self._ring[slot]
+        self._ring[slot] = None
+        self._first_seq += 1
+        self._bytes -= len(payload)
+        for index, key in ((self._by_sender, sender), (self._by_type, event_type)):
+            if key and key in index:
+                index[key].evict(seq)
+                if not len(index[key]):
+                    del index[key]
+
+    def _seq_at_or_after(self, timestamp):
+        # Entries are stored in arrival order, so timestamps are sorted by sequence number
+        lo, hi = self._first_seq, self._next_seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ring[mid % self.max_entries][0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, cursor=None, limit=100, sender=None, event_type=None, since=None, until=None):
+        # Returns up to `limit` entries newer than `cursor` as (seq, timestamp, payload)
+        # plus the cursor for the next page (None once the end is reached).
+        with self._lock:
+            start = self._first_seq
+            if cursor is not None:
+                start = max(start, cursor + 1)
+            if since is not None:
+                start = max(start, self._seq_at_or_after(since))
+
+            candidates = []
+            if sender is not None:
+                candidates.append(self._by_sender.get(sender))
+            if event_type is not None:
+                candidates.append(self._by_type.get(event_type))
+            if any(index is None for index in candidates):
+                return [], None
+
+            if candidates:
+                # Walk the smallest index and check the remaining filters per entry
+                seqs, pos = min(candidates, key=len).from_seq(start)
+                seq_iter = (seqs[i] for i in range(pos, len(seqs)))
+            else:
+                seq_iter = iter(range(start, self._next_seq))
+
+            page = []
+            for seq in seq_iter:
+                timestamp, entry_sender, entry_type, payload = self._ring[seq % self.max_entries]
+                if until is not None and timestamp > until:
+                    return page, None
+                if sender is not None and entry_sender != sender:
+                    continue
+                if event_type is not None and entry_type != event_type:
+                    continue
+                page.append((seq, timestamp, payload))
+                if len(page) >= limit:
+                    more = seq + 1 < self._next_seq
+                    return page, (seq if more else None)
+            return page, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "first_cursor": self._first_seq,
+                "last_cursor": self._next_seq - 1,
+                "senders": len(self._by_sender),
+                "event_types": len(self._by_type),
+                "dropped": self._dropped,
+            }
+
+
+class SharedLogStore:
+    # LogStore backed by the shared state database, for when several worker processes
+    # receive webhooks. Same caps and query semantics; the caps are enforced every
+    # `trim_every` appends, so the table can briefly run that many entries over.
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS webhook_logs (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        sender TEXT,
+        event_type TEXT,
+        payload BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS webhook_logs_sender ON webhook_logs (sender, seq);
+    CREATE INDEX IF NOT EXISTS webhook_logs_type ON webhook_logs (event_type, seq);
+    """
+
+    def __init__(self, db, max_entries=1000, max_bytes=5 * 1024 * 1024, trim_every=16):
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.trim_every = trim_every
+        self._appends = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+        db.ensure_schema("webhook_logs", self._SCHEMA)
+
+    def append(self, payload, sender=None, event_type=None, timestamp=None):
+        if len(payload) > self.max_bytes:
+            with self._lock:
+                self._dropped += 1
+            return None
+        cursor = self.db.execute(
+            "INSERT INTO webhook_logs (ts, sender, event_type, payload) VALUES (?, ?, ?, ?)",
+            (timestamp or time.time(), sender, event_type, bytes(payload)),
+        )
+        with self._lock:
+            self._appends += 1
+            trim = self._appends % self.trim_every == 0
+        if trim:
+            self._trim()
+        return cursor.lastrowid - 1 # sequence numbers start at 0, like LogStore
+
+    def _trim(self):
+        with self.db.transaction() as db:
+            db.execute(
+                "DELETE FROM webhook_logs WHERE seq <= "
+                "(SELECT seq FROM webhook_logs ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            db.execute(
+                "DELETE FROM webhook_logs WHERE seq <= (SELECT max(seq) FROM ("
+                "SELECT seq, sum(length(payload)) OVER (ORDER BY seq DESC) AS total FROM webhook_logs"
+                ") WHERE total > ?)",
+                (self.max_bytes,),
+            )
+
+    def query(self, cursor=None, limit=100, sender=None, event_type=None, since=None, until=None):
+        clauses, args = ["seq > ?"], [cursor + 1 if cursor is not None else 0]
+        for clause, value in (("sender = ?", sender), ("event_type = ?", event_type),
+                              ("ts >= ?", since), ("ts <= ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                args.append(value)
+        rows = self.db.execute(
+            f"SELECT seq - 1, ts, payload FROM webhook_logs WHERE {' AND '.join(clauses)} ORDER BY seq LIMIT ?",
+            args + [limit + 1],
+        ).fetchall()
+        page = rows[:limit]
+        return page, (page[-1][0] if len(rows) > limit else None)
+
+    def stats(self):
+        entries, size, first, last, senders, types = self.db.execute(
+            "SELECT COUNT(*), COALESCE(sum(length(payload)), 0), min(seq) - 1, max(seq) - 1, "
+            "COUNT(DISTINCT sender), COUNT(DISTINCT event_type) FROM webhook_logs"
+        ).fetchone()
+        with self._lock:
+            dropped = self._dropped
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "first_cursor": first if first is not None else 0,
+            "last_cursor": last if last is not None else -1,
+            "senders": senders,
+            "event_types": types,
+            "dropped": dropped,
+            "shared": True,
+        }
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import itertools
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # "text" or "json"
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "10000"))
+# At DEBUG, log the full payload of 1 in N webhooks (0 disables payload logging)
+LOG_PAYLOAD_SAMPLE_RATE = int(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "100"))
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_handler = None
+_listener = None
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class BoundedQueueHandler(QueueHandler):
+    # Hands records to the writer thread without formatting them. When the buffer is
+    # full the record is dropped and counted instead of blocking the caller.
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The default formats the message here, on the caller's thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PayloadSampler:
+    def __init__(self, rate=LOG_PAYLOAD_SAMPLE_RATE):
+        self.rate = rate
+        self._counter = itertools.count()
+
+    def sample(self):
+        return self.rate > 0 and next(self._counter) % self.rate == 0
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, buffer_size=LOG_BUFFER_SIZE, stream=None):
+    # Routes the root logger through a bounded queue to one background writer thread
+    global _handler, _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _handler = BoundedQueueHandler(buffer_size)
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    # Writes out what is still buffered
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    if _handler is None:
+        return None
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "buffered": _handler.queue.qsize(),
+        "capacity": _handler.queue.maxsize,
+        "dropped": _handler.dropped,
+    }
@@ -1,17 +1,43 @@
 import os
-import requests
-import base64
+import atexit
+import signal
 import hmac
 import hashlib
 import json
-from flask import Flask, request, jsonify
+import logging
+import time
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, Response
 from dotenv import load_dotenv
-from bot_logic import BotLogic
 
-# Load environment variables from .env file
+# Load environment variables from .env file before the local modules read their settings
 load_dotenv()
 
+from logging_config import setup_logging, PayloadSampler, stats as logging_stats
+setup_logging()
+
+from bot_logic import BotLogic
+from media_registry import MediaRegistry
+from whatsapp_client import WhatsAppClient
+from webhook_queue import WebhookQueue, QueueFull
+from keyed_executor import KeyedExecutor
+from log_store import LogStore, SharedLogStore
+from idempotency import SeenSet, SharedSeenSet, event_key, WEBHOOK_DEDUP_ENABLED
+from outbox import Outbox, OUTBOX_ENABLED
+from response_cache import SharedResponseCache, API_CACHE_ENABLED
+from outbound_scheduler import OutboundScheduler, OUTBOUND_SCHEDULER_ENABLED, OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST
+from client_pool import WhatsAppClientPool, GO_WA_API_URLS
+from shared_state import SHARED_STATE, state_db
+from events import parse_event, iter_batch, read_chunks, InvalidEvent, BatchTooLarge, WEBHOOK_BATCH_MAX_BYTES
+from broadcast import BroadcastManager, recipients_from_contacts, recipients_from_groups, BROADCAST_CONCURRENCY
+from startup import Warmup, STARTUP_WARMUP_CONNECTIONS
+from metrics import (
+    REGISTRY, Gauge, METRICS_DIR, WEBHOOK_DURATION, WEBHOOK_BATCH_DURATION, WEBHOOK_BATCH_EVENTS, HMAC_DURATION,
+    SIGNATURE_FAILURES,
+)
+
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 GO_WA_API_URL = os.getenv("GO_WA_API_URL")
 GO_WA_API_USERNAME = os.getenv("GO_WA_API_USERNAME")
@@ -19,340 +45,520 @@ GO_WA_API_PASSWORD = os.getenv("GO_WA_API_PASSWORD")
 PYTHON_WEBHOOK_SECRET = os.getenv("PYTHON_WEBHOOK_SECRET")
 ALLOW_SELF_MESSAGE = os.getenv("ALLOW_SELF_MESSAGE", "false").lower() == "true"
 
-# Global list to store webhook logs
-webhook_logs = []
-
-class WhatsAppClient:
-    def __init__(self, base_url, username, password):
-        self.base_url = base_url
-        self.auth_header = self._generate_auth_header(username, password)
-
-    def _generate_auth_header(self, username, password):
-        credentials = f"{username}:{password}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        return {"Authorization": f"Basic {encoded_credentials}"}
-
-    def _send_request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
-        url = f"{self.base_url}{endpoint}"
-        try:
-            response = requests.request(
-                method, url, params=params, json=json_data, files=files, headers=self.auth_header, data=data
-            )
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error during API request to {url}: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response content: {e.response.text}")
-            return {"code": "ERROR", "message": str(e)}
-
-    # App Endpoints
-
-    def app_devices(self):
-        return self._send_request("GET", "/app/devices")
-
-    # User Endpoints
-    def user_info(self, phone):
-        return self._send_request("GET", "/user/info", params={"phone": phone})
-
-    def user_avatar(self, phone, is_preview=None, is_community=None):
-        params = {"phone": phone}
-        if is_preview is not None:
-            params["is_preview"] = is_preview
-        if is_community is not None:
-            params["is_community"] = is_community
-        return self._send_request("GET", "/user/avatar", params=params)
-
-    def user_change_avatar(self, avatar_file):
-        files = {"avatar": avatar_file}
-        return self._send_request("POST", "/user/avatar", files=files)
-
-    def user_change_pushname(self, push_name):
-        json_data = {"push_name": push_name}
-        return self._send_request("POST", "/user/pushname", json_data=json_data)
-
-    def user_my_privacy(self):
-        return self._send_request("GET", "/user/my/privacy")
-
-    def user_my_groups(self):
-        return self._send_request("GET", "/user/my/groups")
-
-    def user_my_newsletters(self):
-        return self._send_request("GET", "/user/my/newsletters")
-
-    def user_my_contacts(self):
-        return self._send_request("GET", "/user/my/contacts")
-
-    def user_check(self, phone):
-        return self._send_request("GET", "/user/check", params={"phone": phone})
-
-    # Send Endpoints
-    def send_message(self, phone, message, reply_message_id=None, is_forwarded=False):
-        json_data = {
-            "phone": phone,
-            "message": message,
-            "is_forwarded": is_forwarded
-        }
-        if reply_message_id:
-            json_data["reply_message_id"] = reply_message_id
-        return self._send_request("POST", "/send/message", json_data=json_data)
-
-    def send_image(self, phone, image_file=None, image_url=None, caption=None, view_once=False, compress=False, is_forwarded=False):
-        files = {}
-        if image_file:
-            # If image_file is a file object, requests will handle it correctly
-            # Explicitly set content type for image
-            files["image"] = (image_file.name, image_file, "image/jpeg")
-
-        data_for_form = {
-            "phone": phone,
-            "view_once": str(view_once).lower(),
-            "compress": str(compress).lower(),
-            "is_forwarded": str(is_forwarded).lower()
-        }
-        if caption:
-            data_for_form["caption"] = caption
-        if image_url:
-            data_for_form["image_url"] = image_url
-
-        return self._send_request("POST", "/send/image", data=data_for_form, files=files)
-
-    def send_audio(self, phone, audio_file, is_forwarded=False):
-        # Explicitly set content type for audio
-        files = {"audio": (audio_file.name, audio_file, "audio/wav")}
-        data_for_form = {
-            "phone": phone,
-            "is_forwarded": str(is_forwarded).lower()
-        }
-        return self._send_request("POST", "/send/audio", data=data_for_form, files=files)
-
-    def send_file(self, phone, file_obj, caption=None, is_forwarded=False):
-        files = {"file": file_obj}
-        data_for_form = {
-            "phone": phone,
-            "is_forwarded": str(is_forwarded).lower()
-        }
-        if caption:
-            data_for_form["caption"] = caption
-        return self._send_request("POST", "/send/file", data=data_for_form, files=files)
-
-    def send_video(self, phone, video_file, caption=None, view_once=False, compress=False, is_forwarded=False):
-        # Explicitly set content type for video
-        files = {"video": (video_file.name, video_file, "video/mp4")}
-        data_for_form = {
-            "phone": phone,
-            "view_once": str(view_once).lower(),
-            "compress": str(compress).lower(),
-            "is_forwarded": str(is_forwarded).lower()
-        }
-        if caption:
-            data_for_form["caption"] = caption
-
-        return self._send_request("POST", "/send/video", data=data_for_form, files=files)
-
-    def send_contact(self, phone, contact_name, contact_phone, is_forwarded=False):
-        json_data = {
-            "phone": phone,
-            "contact_name": contact_name,
-            "contact_phone": contact_phone,
-            "is_forwarded": is_forwarded
-        }
-        return self._send_request("POST", "/send/contact", json_data=json_data)
-
-    def send_link(self, phone, link, caption=None, is_forwarded=False):
-        json_data = {
-            "phone": phone,
-            "link": link,
-            "is_forwarded": is_forwarded
-        }
-        if caption:
-            json_data["caption"] = caption
-        return self._send_request("POST", "/send/link", json_data=json_data)
-
-    def send_location(self, phone, latitude, longitude, is_forwarded=False):
-        json_data = {
-            "phone": phone,
-            "latitude": str(latitude),
-            "longitude": str(longitude),
-            "is_forwarded": is_forwarded
-        }
-        return self._send_request("POST", "/send/location", json_data=json_data)
-
-    def send_poll(self, phone, question, options, max_answer):
-        json_data = {
-            "phone": phone,
-            "question": question,
-            "options": options,
-            "max_answer": max_answer
-        }
-        return self._send_request("POST", "/send/poll", json_data=json_data)
-
-    def send_presence(self, type): # is_forwarded is not a parameter for send_presence in Go API
-        json_data = {
-            "type": type,
-        }
-        return self._send_request("POST", "/send/presence", json_data=json_data)
-
-    # Message Endpoints
-    def message_revoke(self, message_id, phone):
-        json_data = {"phone": phone}
-        return self._send_request("POST", f"/message/{message_id}/revoke", json_data=json_data)
-
-    def message_delete(self, message_id, phone):
-        json_data = {"phone": phone}
-        return self._send_request("POST", f"/message/{message_id}/delete", json_data=json_data)
-
-    def message_reaction(self, message_id, phone, emoji):
-        json_data = {"phone": phone, "emoji": emoji}
-        return self._send_request("POST", f"/message/{message_id}/reaction", json_data=json_data)
-
-    def message_update(self, message_id, phone, message):
-        json_data = {"phone": phone, "message": message}
-        return self._send_request("POST", f"/message/{message_id}/update", json_data=json_data)
-
-    def message_read(self, message_id, phone):
-        json_data = {"phone": phone}
-        return self._send_request("POST", f"/message/{message_id}/read", json_data=json_data)
-
-    def message_star(self, message_id, phone):
-        json_data = {"phone": phone}
-        return self._send_request("POST", f"/message/{message_id}/star", json_data=json_data)
-
-    def message_unstar(self, message_id, phone):
-        json_data = {"phone": phone}
-        return self._send_request("POST", f"/message/{message_id}/unstar", json_data=json_data)
-
-    # Group Endpoints
-    def group_join_with_link(self, link):
-        json_data = {"link": link}
-        return self._send_request("POST", "/group/join-with-link", json_data=json_data)
-
-    def group_leave(self, group_id):
-        json_data = {"group_id": group_id}
-        return self._send_request("POST", "/group/leave", json_data=json_data)
-
-    def group_create(self, name, participants):
-        json_data = {"name": name, "participants": participants}
-        return self._send_request("POST", "/group", json_data=json_data)
-
-    def group_add_participants(self, group_id, participants):
-        json_data = {"group_id": group_id, "participants": participants}
-        return self._send_request("POST", "/group/participants", json_data=json_data)
-
-    def group_remove_participant(self, group_id, participant):
-        json_data = {"group_id": group_id, "participant": participant}
-        return self._send_request("POST", "/group/participants/remove", json_data=json_data)
-
-    def group_promote_participant(self, group_id, participant):
-        json_data = {"group_id": group_id, "participant": participant}
-        return self._send_request("POST", "/group/participants/promote", json_data=json_data)
-
-    def group_demote_participant(self, group_id, participant):
-        json_data = {"group_id": group_id, "participant": participant}
-        return self._send_request("POST", "/group/participants/demote", json_data=json_data)
-
-    def group_list_requested_participants(self):
-        return self._send_request("GET", "/group/participant-requests")
-
-    def group_approve_requested_participant(self, group_id, participant):
-        json_data = {"group_id": group_id, "participant": participant}
-        return self._send_request("POST", "/group/participant-requests/approve", json_data=json_data)
-
-    def group_reject_requested_participant(self, group_id, participant):
-        json_data = {"group_id": group_id, "participant": participant}
-        return self._send_request("POST", "/group/participant-requests/reject", json_data=json_data)
-
-    # Newsletter Endpoints
-    def newsletter_unfollow(self, newsletter_id):
-        json_data = {"newsletter_id": newsletter_id}
-        return self._send_request("POST", "/newsletter/unfollow", json_data=json_data)
-
+# Asynchronous webhook ingestion: ack with 202 and process on a worker pool
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() == "true"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_QUEUE_PUT_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_PUT_TIMEOUT", "0"))
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", "5"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+# Keep replies to one sender in order while different senders run in parallel
+WEBHOOK_ORDERED_DISPATCH = os.getenv("WEBHOOK_ORDERED_DISPATCH", "false").lower() == "true"
+WEBHOOK_SHARD_QUEUE_SIZE = int(os.getenv("WEBHOOK_SHARD_QUEUE_SIZE", "100"))
+# Run the Go API calls made by the bot logic on one asyncio event loop instead of blocking the handler
+WEBHOOK_ASYNCIO = os.getenv("WEBHOOK_ASYNCIO", "false").lower() == "true"
+
+WEBHOOK_LOG_MAX_ENTRIES = int(os.getenv("WEBHOOK_LOG_MAX_ENTRIES", "1000"))
+WEBHOOK_LOG_MAX_BYTES = int(os.getenv("WEBHOOK_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOGS_PAGE_MAX = 1000
+
+# With several worker processes (see gunicorn.conf.py), the webhook logs, dedup keys, API cache
+# and rate limits live in a SQLite file all of them share instead of in process memory
+shared_db = state_db() if SHARED_STATE else None
+
+# Bounded store for the raw webhook payloads, indexed by sender, event type and time
+if shared_db is not None:
+    webhook_logs = SharedLogStore(shared_db, max_entries=WEBHOOK_LOG_MAX_ENTRIES, max_bytes=WEBHOOK_LOG_MAX_BYTES)
+else:
+    webhook_logs = LogStore(max_entries=WEBHOOK_LOG_MAX_ENTRIES, max_bytes=WEBHOOK_LOG_MAX_BYTES)
+# Full payloads are only written to the application log for a sample of webhooks, at DEBUG
+payload_sampler = PayloadSampler()
+
+# Message IDs of recently received webhooks, so retries from the Go API aren't processed twice
+seen_events = None
+if WEBHOOK_DEDUP_ENABLED:
+    seen_events = SharedSeenSet(shared_db) if shared_db is not None else SeenSet()
 
 # Initialize WhatsAppClient and BotLogic
-wa_client = WhatsAppClient(GO_WA_API_URL, GO_WA_API_USERNAME, GO_WA_API_PASSWORD)
-bot_logic = BotLogic(wa_client, allow_self_message=ALLOW_SELF_MESSAGE)
+# Writes are recorded in a SQLite outbox first, so failed or interrupted sends are retried
+outbox = Outbox() if OUTBOX_ENABLED else None
+api_cache = SharedResponseCache(shared_db) if shared_db is not None and API_CACHE_ENABLED else None
+scheduler = None
+if OUTBOUND_SCHEDULER_ENABLED:
+    # The global send rate is per WhatsApp session, so each pooled backend adds its own allowance
+    backend_count = len(GO_WA_API_URLS) or 1
+    scheduler = OutboundScheduler(
+        global_rate=OUTBOUND_GLOBAL_RATE * backend_count, global_burst=OUTBOUND_GLOBAL_BURST * backend_count, db=shared_db
+    )
+if GO_WA_API_URLS:
+    # Several Go WA containers/devices, with sends spread over the healthy ones (see client_pool.py)
+    wa_client = WhatsAppClientPool(
+        GO_WA_API_URLS, GO_WA_API_USERNAME, GO_WA_API_PASSWORD, cache=api_cache, scheduler=scheduler, outbox=outbox
+    )
+    atexit.register(wa_client.close)
+else:
+    wa_client = WhatsAppClient(
+        GO_WA_API_URL, GO_WA_API_USERNAME, GO_WA_API_PASSWORD, cache=api_cache, scheduler=scheduler, outbox=outbox
+    )
+if wa_client.scheduler is not None:
+    atexit.register(wa_client.scheduler.shutdown)
+if outbox is not None:
+    outbox.start_dispatcher(wa_client)
+    atexit.register(outbox.close)
+
+# Assets are read into memory by the warm-up below (or on first use), not while the app is imported
+media = MediaRegistry()
+
+event_loop = None
+if WEBHOOK_ASYNCIO:
+    # Imported only when used: aiohttp takes longer to import than Flask
+    from async_client import AsyncWhatsAppClient, EventLoopThread, LoopBoundClient
+    # Shares the cache, rate limits and circuit breakers with the sync client, but always talks to its first backend.
+    # The pool's scheduler allows every backend's global rate, so with a pool it gets one of its own
+    # at a single session's rate.
+    async_scheduler = wa_client.scheduler
+    if GO_WA_API_URLS and async_scheduler is not None:
+        async_scheduler = OutboundScheduler(db=shared_db, global_key="global:async")
+        atexit.register(async_scheduler.shutdown)
+    event_loop = EventLoopThread()
+    async_wa_client = AsyncWhatsAppClient(
+        wa_client.base_url, GO_WA_API_USERNAME, GO_WA_API_PASSWORD, cache=wa_client.cache, scheduler=async_scheduler,
+        resilience=wa_client.resilience, outbox=outbox, auth_header=wa_client.auth_header,
+    )
+    atexit.register(event_loop.stop, WEBHOOK_DRAIN_TIMEOUT, async_wa_client.close)
+    bot_logic = BotLogic(
+        LoopBoundClient(async_wa_client, event_loop), allow_self_message=ALLOW_SELF_MESSAGE, media_registry=media
+    )
+else:
+    bot_logic = BotLogic(wa_client, allow_self_message=ALLOW_SELF_MESSAGE, media_registry=media)
+
+def process_event(event):
+    # `event` is an events.Event; sender and text are pulled out of the payload when it is parsed
+    sender = event.sender
+    message_content = event.text
+
+    # For now, we'll assume all messages are to be processed.
+    # If 'is_self' is needed, we need to know how go-wa-api provides it in the webhook.
+    is_self = False # Placeholder, as 'is_self' is not in the provided payload example
+
+    if sender and message_content:
+        logger.info("New message from %s (self_message: %s): %s", sender, is_self, message_content)
+        bot_logic.handle_message(sender, message_content, is_self)
+    else:
+        # Handle other event types or incomplete message data
+        logger.debug("Received non-message event or incomplete message data.")
+        # You might want to add specific handling for 'qr' or 'connection' events if they are top-level
+        # For example, if 'qr_link' is directly in event.data:
+        # if event.data.get("qr_link"):
+        #     logger.info("New QR code received: %s", event.data['qr_link'])
+        # if event.data.get("status"): # For connection status
+        #     logger.info("Connection status changed: %s", event.data['status'])
+
+
+webhook_queue = None
+if WEBHOOK_ASYNC and WEBHOOK_ORDERED_DISPATCH:
+    webhook_queue = KeyedExecutor(
+        process_event,
+        lambda event: event.sender,
+        shards=WEBHOOK_WORKERS,
+        shard_maxsize=WEBHOOK_SHARD_QUEUE_SIZE,
+        put_timeout=WEBHOOK_QUEUE_PUT_TIMEOUT,
+    )
+elif WEBHOOK_ASYNC:
+    webhook_queue = WebhookQueue(
+        process_event,
+        workers=WEBHOOK_WORKERS,
+        maxsize=WEBHOOK_QUEUE_SIZE,
+        put_timeout=WEBHOOK_QUEUE_PUT_TIMEOUT,
+    )
+if webhook_queue is not None:
+    webhook_queue.start()
+    atexit.register(webhook_queue.shutdown, WEBHOOK_DRAIN_TIMEOUT)
+
+# Broadcasts send through the sync client; unfinished ones are resumed from their checkpoints
+broadcasts = BroadcastManager(wa_client, bot_logic.preprocess)
+broadcasts.resume_pending()
+atexit.register(broadcasts.shutdown)
+
+# Depths of the in-process queues, read when /metrics is scraped
+if webhook_queue is not None:
+    REGISTRY.register(Gauge("whatsapp_bot_webhook_queue_depth", "Webhooks waiting for a worker.", webhook_queue.depth))
+if wa_client.scheduler is not None:
+    REGISTRY.register(Gauge(
+        "whatsapp_bot_outbound_queue_depth", "Sends waiting for a rate limit slot.",
+        lambda: wa_client.scheduler.stats()["depth"],
+    ))
+if outbox is not None:
+    REGISTRY.register(Gauge(
+        "whatsapp_bot_outbox_pending", "Go API writes waiting to be retried.", lambda: outbox.stats()["pending"],
+        aggregate="max",
+    ))
+    REGISTRY.register(Gauge(
+        "whatsapp_bot_outbox_dead_letters", "Go API writes that gave up retrying.", lambda: outbox.stats()["dead"],
+        aggregate="max",
+    ))
+if wa_client.resilience is not None:
+    REGISTRY.register(Gauge(
+        "whatsapp_bot_circuits_open", "Go WhatsApp API endpoint circuits open or half-open.",
+        wa_client.resilience.open_circuits,
+    ))
+if isinstance(wa_client, WhatsAppClientPool):
+    REGISTRY.register(Gauge(
+        "whatsapp_bot_go_api_backends_healthy", "Pooled Go WhatsApp API backends in rotation.", wa_client.healthy,
+        aggregate="max",
+    ))
+if METRICS_DIR:
+    REGISTRY.share(METRICS_DIR)
+
+# Docker stops the container with SIGTERM; turn it into a normal exit so pending work drains
+try:
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+except ValueError:
+    pass # Not running in the main thread
+
+# Pay the cold costs of the first webhooks (connecting to the Go API, reading assets, ffmpeg,
+# loading timezone data) in the background; /ready reports when that is done
+warmup = Warmup({
+    "connections": lambda: {"ok": wa_client.warm_up(STARTUP_WARMUP_CONNECTIONS)},
+    "media": bot_logic.preload_media,
+    "audio": bot_logic.pretranscode_audio,
+    "timezone": bot_logic.prime_timezone,
+}).start()
+
 
 @app.route("/")
 def index():
     return "WhatsApp Bot Python Example is running!"
 
 
-@app.route("/webhook", methods=["POST"])
-def webhook_handler():
+@app.route("/ready")
+def ready():
+    # For load balancer / orchestrator readiness checks; "/" only says the process is up
+    stats = warmup.stats()
+    return jsonify(stats), 200 if stats["ready"] else 503
+
+
+def _signature_error(reason, message):
+    SIGNATURE_FAILURES.inc(reason)
+    return jsonify({"status": "error", "message": message}), 403
+
+
+def check_signature(payload, mac=None):
+    # Returns an error response if the request isn't signed with PYTHON_WEBHOOK_SECRET, else None.
+    # `mac` is an hmac object already fed the body, for bodies that were read as a stream.
     signature = request.headers.get("X-Hub-Signature-256")
-    payload = request.data
 
     if not signature:
-        print("Webhook: No signature provided.")
-        return jsonify({"status": "error", "message": "No signature provided"}), 403
+        logger.warning("Webhook: No signature provided.")
+        return _signature_error("missing", "No signature provided")
+
+    # Verify the signature; a streamed body was timed into HMAC_DURATION while it was hashed
+    if mac is None:
+        with HMAC_DURATION.time():
+            mac = hmac.new(PYTHON_WEBHOOK_SECRET.encode('utf-8'), payload, hashlib.sha256)
+    expected_signature = "sha256=" + mac.hexdigest()
+    valid = hmac.compare_digest(expected_signature, signature)
+
+    if not valid:
+        logger.warning("Webhook: Invalid signature: %s", signature)
+        return _signature_error("invalid", "Invalid signature")
+    return None
+
+
+# Outcomes of ingest_event
+INGEST_DUPLICATE = "duplicate"
+INGEST_QUEUED = "queued"
+INGEST_PROCESSED = "processed"
+
+def ingest_event(event):
+    # Dedups, logs and runs (or queues) one verified event, for both webhook endpoints.
+    # Raises QueueFull or whatever processing raised, with the event's dedup key released
+    # so that a redelivery isn't dropped as a duplicate.
+    dedup_key = None
+    if seen_events is not None:
+        dedup_key = event_key(event.data, event.raw)
+        if seen_events.seen(dedup_key):
+            logger.info("Webhook: Duplicate event %s ignored.", dedup_key)
+            return INGEST_DUPLICATE
+    try:
+        # Store the incoming webhook data
+        webhook_logs.append(event.raw, sender=event.sender, event_type=event.type)
+        # The raw bytes are logged as received: nothing is re-serialized on the request path
+        if logger.isEnabledFor(logging.DEBUG) and payload_sampler.sample():
+            logger.debug(
+                "Received webhook event: %s", event.raw.decode("utf-8", "replace"),
+                extra={"sender": event.sender, "event": event.type},
+            )
+        if webhook_queue is not None:
+            # Acknowledge right away and let the worker pool run the bot logic
+            webhook_queue.submit(event)
+            return INGEST_QUEUED
+        process_event(event)
+        return INGEST_PROCESSED
+    except Exception:
+        if dedup_key is not None:
+            seen_events.forget(dedup_key)
+        raise
 
-    # Verify the signature
-    expected_signature = "sha256=" + hmac.new(
-        PYTHON_WEBHOOK_SECRET.encode('utf-8'),
-        payload,
-        hashlib.sha256
-    ).hexdigest()
 
-    if not hmac.compare_digest(expected_signature, signature):
-        print(f"Webhook: Invalid signature. Expected: {expected_signature}, Got: {signature}")
-        return jsonify({"status": "error", "message": "Invalid signature"}), 403
+@app.route("/webhook", methods=["POST"])
+def webhook_handler():
+    start = time.perf_counter()
+    response = handle_webhook()
+    WEBHOOK_DURATION.observe(time.perf_counter() - start, str(response[1]))
+    return response
+
+def handle_webhook():
+    # Returns a (response, status) tuple
+    payload = request.data
+    error = check_signature(payload)
+    if error is not None:
+        return error
 
     try:
-        event_data = json.loads(payload)
-        webhook_logs.append(event_data) # Store the incoming webhook data
-        print(f"Received webhook event: {json.dumps(event_data, indent=2)}")
-
-        # Assuming the webhook payload directly contains message data
-        # Adjust these keys based on the actual webhook payload from go-wa-api
-        raw_sender = event_data.get("from")
-        message_content = event_data.get("message", {}).get("text")
-
-        # Extract the user JID (e.g., "6285890392419@s.whatsapp.net")
-        sender = None
-        if raw_sender:
-            # The format is "6285890392419:56@s.whatsapp.net in 6285890392419@s.whatsapp.net"
-            # We need to extract the part before " in " and remove the device part ":56"
-            parts = raw_sender.split(" in ")
-            if len(parts) > 0:
-                jid_with_device = parts[0]
-                sender_parts = jid_with_device.split(":")
-                if len(sender_parts) > 1 and "@s.whatsapp.net" in sender_parts[1]:
-                    sender = sender_parts[0] + "@s.whatsapp.net"
-                else:
-                    sender = jid_with_device # Fallback if no device part
-
-        # For now, we'll assume all messages are to be processed.
-        # If 'is_self' is needed, we need to know how go-wa-api provides it in the webhook.
-        is_self = False # Placeholder, as 'is_self' is not in the provided payload example
-
-        if sender and message_content:
-            print(f"New message from {sender} (self_message: {is_self}): {message_content}")
-            bot_logic.handle_message(sender, message_content, is_self)
-        else:
-            # Handle other event types or incomplete message data
-            print("Received non-message event or incomplete message data.")
-            # You might want to add specific handling for 'qr' or 'connection' events if they are top-level
-            # For example, if 'qr_link' is directly in event_data:
-            # if event_data.get("qr_link"):
-            #     print(f"New QR code received: {event_data['qr_link']}")
-            # if event_data.get("status"): # For connection status
-            #     print(f"Connection status changed: {event_data['status']}")
-
-        return jsonify({"status": "success", "message": "Webhook received"}), 200
-    except json.JSONDecodeError:
-        print("Webhook: Invalid JSON payload.")
+        event = parse_event(payload)
+    except (json.JSONDecodeError, InvalidEvent):
+        logger.warning("Webhook: Invalid JSON payload.")
         return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
+
+    try:
+        outcome = ingest_event(event)
+    except QueueFull as e:
+        logger.warning("Webhook: %s, rejecting event.", e)
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers["Retry-After"] = str(WEBHOOK_RETRY_AFTER)
+        return response, 503
     except Exception as e:
-        print(f"Webhook: An error occurred: {e}")
+        logger.exception("Webhook: An error occurred: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+    if outcome == INGEST_DUPLICATE:
+        return jsonify({"status": "success", "message": "Duplicate webhook ignored"}), 200
+    if outcome == INGEST_QUEUED:
+        return jsonify({"status": "accepted", "message": "Webhook queued"}), 202
+    return jsonify({"status": "success", "message": "Webhook received"}), 200
+
+
+@app.route("/webhook/batch", methods=["POST"])
+def webhook_batch_handler():
+    start = time.perf_counter()
+    response = handle_webhook_batch()
+    WEBHOOK_BATCH_DURATION.observe(time.perf_counter() - start, str(response[1]))
+    return response
+
+def _signed_chunks(stream, mac, max_bytes):
+    # Feeds the body to `mac` as it is read, timing the hashing into HMAC_DURATION
+    hashing = 0.0
+    total = 0
+    for chunk in read_chunks(stream):
+        total += len(chunk)
+        if total > max_bytes:
+            raise BatchTooLarge(f"Batch is larger than {max_bytes} bytes")
+        started = time.perf_counter()
+        mac.update(chunk)
+        hashing += time.perf_counter() - started
+        yield chunk
+    HMAC_DURATION.observe(hashing)
+
+def handle_webhook_batch():
+    # Many events in one request, as NDJSON or a JSON array, with one signature over the whole body.
+    # The body is parsed while it is read and hashed; no event runs before the signature checks out.
+    if not request.headers.get("X-Hub-Signature-256"):
+        return check_signature(b"")
+    if request.content_length is not None and request.content_length > WEBHOOK_BATCH_MAX_BYTES:
+        return jsonify({"status": "error", "message": f"Batch is larger than {WEBHOOK_BATCH_MAX_BYTES} bytes"}), 413
+
+    mac = hmac.new(PYTHON_WEBHOOK_SECRET.encode('utf-8'), digestmod=hashlib.sha256)
+    chunks = _signed_chunks(request.stream, mac, WEBHOOK_BATCH_MAX_BYTES)
+    invalid = None
+    try:
+        try:
+            events = list(iter_batch(chunks))
+        except BatchTooLarge:
+            raise
+        except ValueError as e:
+            # Read the rest so a bad signature is reported as such, not as a parse error
+            invalid = e
+            for _ in chunks:
+                pass
+    except BatchTooLarge as e:
+        logger.warning("Webhook batch: %s.", e)
+        return jsonify({"status": "error", "message": str(e)}), 413
+    error = check_signature(None, mac)
+    if error is not None:
+        return error
+    if invalid is not None:
+        logger.warning("Webhook batch: Invalid payload: %s", invalid)
+        return jsonify({"status": "error", "message": f"Invalid batch payload: {invalid}"}), 400
+
+    WEBHOOK_BATCH_EVENTS.observe(len(events))
+    counts = {"received": len(events), INGEST_PROCESSED: 0, INGEST_QUEUED: 0, "duplicates": 0, "rejected": 0, "failed": 0}
+    for index, event in enumerate(events):
+        try:
+            outcome = ingest_event(event)
+        except QueueFull as e:
+            # The rest would be turned away too; the sender retries the batch and the events
+            # taken so far are dropped as duplicates
+            logger.warning("Webhook batch: %s, rejecting %d events.", e, len(events) - index)
+            counts["rejected"] = len(events) - index
+            break
+        except Exception as e:
+            logger.exception("Webhook batch: An error occurred: %s", e)
+            counts["failed"] += 1
+            continue
+        counts["duplicates" if outcome == INGEST_DUPLICATE else outcome] += 1
+
+    if counts["rejected"]:
+        response = jsonify({"status": "error", "message": "Webhook queue is full", **counts})
+        response.headers["Retry-After"] = str(WEBHOOK_RETRY_AFTER)
+        return response, 503
+    if counts["failed"]:
+        return jsonify({"status": "error", "message": "Some events failed", **counts}), 500
+    if counts[INGEST_QUEUED]:
+        return jsonify({"status": "accepted", "message": "Webhook batch queued", **counts}), 202
+    return jsonify({"status": "success", "message": "Webhook batch received", **counts}), 200
+
+
+@app.route("/queue")
+def view_queue():
+    if webhook_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(webhook_queue.stats(), enabled=True))
+
+@app.route("/outbox")
+def view_outbox():
+    if outbox is None:
+        return jsonify({"enabled": False})
+    limit = min(request.args.get("limit", 50, type=int), LOGS_PAGE_MAX)
+    if limit < 1:
+        return jsonify({"status": "error", "message": "Invalid query parameter: limit must be at least 1"}), 400
+    return jsonify(dict(outbox.stats(), enabled=True, dead_letters=outbox.dead_letters(limit)))
+
+@app.route("/backends")
+def view_backends():
+    if not isinstance(wa_client, WhatsAppClientPool):
+        return jsonify({"pooled": False, "backends": [{"url": wa_client.base_url}]})
+    return jsonify({"pooled": True, "routing": wa_client.routing, "backends": wa_client.backend_stats()})
+
+@app.route("/broadcasts", methods=["POST"])
+def start_broadcast():
+    # Signed like webhooks. Body: {"recipients": [...] | "contacts" | "groups", "payload": {...}}
+    payload = request.data
+    error = check_signature(payload)
+    if error is not None:
+        return error
+    try:
+        body = json.loads(payload)
+        recipients = body.get("recipients")
+        if recipients == "contacts":
+            recipients = recipients_from_contacts(wa_client)
+        elif recipients == "groups":
+            recipients = recipients_from_groups(wa_client)
+        if not isinstance(recipients, list) or not recipients:
+            raise ValueError("No recipients to broadcast to")
+        broadcast = broadcasts.start(recipients, body.get("payload") or {}, concurrency=int(body.get("concurrency", BROADCAST_CONCURRENCY)))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(broadcast.progress()), 202
+
+@app.route("/broadcasts")
+def list_broadcasts():
+    return jsonify([broadcast.progress() for broadcast in broadcasts.all()])
+
+@app.route("/broadcasts/<broadcast_id>")
+def view_broadcast(broadcast_id):
+    broadcast = broadcasts.get(broadcast_id)
+    if broadcast is None:
+        return jsonify({"status": "error", "message": "Broadcast not found"}), 404
+    return jsonify(dict(broadcast.progress(), errors=broadcast.errors))
+
+@app.route("/broadcasts/<broadcast_id>/stop", methods=["POST"])
+def stop_broadcast(broadcast_id):
+    error = check_signature(request.data)
+    if error is not None:
+        return error
+    broadcast = broadcasts.get(broadcast_id)
+    if broadcast is None:
+        return jsonify({"status": "error", "message": "Broadcast not found"}), 404
+    broadcasts.stop(broadcast)
+    return jsonify(broadcast.progress())
+
+def _parse_log_time(value):
+    # Accept unix seconds or an ISO 8601 timestamp; without an offset it is taken as UTC
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00" # fromisoformat only accepts "Z" from Python 3.11
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
 @app.route("/logs")
 def view_logs():
-    return jsonify(webhook_logs)
+    try:
+        cursor = request.args.get("cursor", type=int)
+        limit = min(request.args.get("limit", 100, type=int), LOGS_PAGE_MAX)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        since = _parse_log_time(request.args.get("since"))
+        until = _parse_log_time(request.args.get("until"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid query parameter: {e}"}), 400
+
+    page, next_cursor = webhook_logs.query(
+        cursor=cursor,
+        limit=limit,
+        sender=request.args.get("sender"),
+        event_type=request.args.get("type"),
+        since=since,
+        until=until,
+    )
+    headers = {}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+
+    # Payloads are stored as the raw JSON bytes received, so they are written out without re-encoding
+    if request.args.get("format") == "ndjson":
+        def generate():
+            for _, _, payload in page:
+                yield payload + b"\n"
+        return Response(generate(), mimetype="application/x-ndjson", headers=headers)
+    body = b"[" + b",".join(payload for _, _, payload in page) + b"]"
+    return Response(body, mimetype="application/json", headers=headers)
+
+@app.route("/stats")
+def view_stats():
+    return jsonify({
+        "transport": wa_client.transport.stats(),
+        "backends": wa_client.backend_stats() if isinstance(wa_client, WhatsAppClientPool) else None,
+        "resilience": wa_client.resilience.stats() if wa_client.resilience is not None else None,
+        "outbound": wa_client.scheduler.stats() if wa_client.scheduler is not None else None,
+        "webhook_dedup": seen_events.stats() if seen_events is not None else None,
+        "api_cache": wa_client.cache.stats() if wa_client.cache is not None else None,
+        "outbox": outbox.stats() if outbox is not None else None,
+        "media": bot_logic.media.stats(),
+        "transcode": bot_logic.transcode_cache.stats(),
+        "preprocess": bot_logic.preprocess.stats(),
+        "warmup": warmup.stats(),
+        "logging": logging_stats(),
+    })
+
+@app.route("/metrics")
+def view_metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/logs/stats")
+def view_logs_stats():
+    return jsonify(webhook_logs.stats())
 
 if __name__ == "__main__":
     # To run the Flask app, you would typically use `flask run` or a WSGI server.
     # For this example, we'll use app.run for simplicity during development.
     # In production, use gunicorn or uWSGI.
-    print(f"Starting Flask app on port {os.getenv('FLASK_RUN_PORT', 5000)}...")
+    logger.info("Starting Flask app on port %s...", os.getenv('FLASK_RUN_PORT', 5000))
     app.run(host="0.0.0.0", port=os.getenv("FLASK_RUN_PORT", 5000))
@@ -0,0 +1,168 @@
+import os
+import threading
+import subprocess
+import logging
+from concurrent.futures import TimeoutError as FutureTimeout
+from transcode_cache import TranscodeCache
+from metrics import MEDIA_VARIANTS
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PREPROCESS_ENABLED = os.getenv("MEDIA_PREPROCESS_ENABLED", "true").lower() == "true"
+# Variants live in their own cache, so long video transcodes never hold up voice notes
+MEDIA_VARIANT_DIR = os.getenv("MEDIA_VARIANT_DIR", "cache/variants")
+MEDIA_VARIANT_MAX_BYTES = int(os.getenv("MEDIA_VARIANT_MAX_BYTES", str(512 * 1024 * 1024)))
+MEDIA_PREPROCESS_WORKERS = int(os.getenv("MEDIA_PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+# How long a send waits for a variant that isn't cached yet before uploading the original.
+# The transcode carries on, and later sends of the same file get the variant.
+MEDIA_PREPROCESS_WAIT = float(os.getenv("MEDIA_PREPROCESS_WAIT", "5"))
+# Smaller files are uploaded as they are
+MEDIA_PREPROCESS_MIN_BYTES = int(os.getenv("MEDIA_PREPROCESS_MIN_BYTES", str(64 * 1024)))
+# WhatsApp shows images at up to 1600px and plays video at up to 720p-1080p
+MEDIA_IMAGE_MAX_SIDE = int(os.getenv("MEDIA_IMAGE_MAX_SIDE", "1600"))
+MEDIA_IMAGE_QUALITY = int(os.getenv("MEDIA_IMAGE_QUALITY", "5")) # ffmpeg -q:v, 2 (best) to 31
+MEDIA_VIDEO_MAX_SIDE = int(os.getenv("MEDIA_VIDEO_MAX_SIDE", "1280"))
+MEDIA_VIDEO_CRF = int(os.getenv("MEDIA_VIDEO_CRF", "28"))
+MEDIA_VIDEO_PRESET = os.getenv("MEDIA_VIDEO_PRESET", "veryfast")
+MEDIA_THUMBNAIL_SIDE = int(os.getenv("MEDIA_THUMBNAIL_SIDE", "320"))
+
+KIND_IMAGE = "image"
+KIND_VIDEO = "video"
+KIND_THUMBNAIL = "thumbnail"
+
+# ffmpeg can't write these as a single JPEG without losing something (animation, vectors)
+_IMAGE_MIMES = ("image/jpeg", "image/png", "image/webp", "image/bmp", "image/tiff")
+
+
+def _fit(side):
+    # Scale down so the longer side is at most `side` pixels, keeping the aspect ratio and even
+    # dimensions (H.264 needs them); never scale up
+    return f"scale=w='trunc(iw*min(1,{side}/max(iw,ih))/2)*2':h=-2"
+
+
+def image_args(max_side=MEDIA_IMAGE_MAX_SIDE, quality=MEDIA_IMAGE_QUALITY):
+    return ("-vf", _fit(max_side), "-frames:v", "1", "-q:v", str(quality))
+
+
+def video_args(max_side=MEDIA_VIDEO_MAX_SIDE, crf=MEDIA_VIDEO_CRF, preset=MEDIA_VIDEO_PRESET):
+    # H.264 Main + AAC in an MP4 with the index up front: plays on every WhatsApp client as sent
+    return (
+        "-vf", _fit(max_side), "-c:v", "libx264", "-preset", preset, "-crf", str(crf),
+        "-profile:v", "main", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart",
+    )
+
+
+def thumbnail_args(side=MEDIA_THUMBNAIL_SIDE):
+    # A representative frame of a video (the only frame of an image)
+    return ("-vf", f"thumbnail,{_fit(side)}", "-frames:v", "1", "-q:v", "5")
+
+
+PROFILES = {
+    KIND_IMAGE: (image_args(), ".jpg"),
+    KIND_VIDEO: (video_args(), ".mp4"),
+    KIND_THUMBNAIL: (thumbnail_args(), ".jpg"),
+}
+
+
+class MediaPipeline:
+    # Hands out the media to upload: a resized, recompressed variant of an image or video when
+    # one is cached and smaller than the original, otherwise the original. Variants are made by
+    # ffmpeg processes, up to `cache`'s worker count at once, and stored by source content hash
+    # and settings, so the CPU cost is paid once per file however often it is sent.
+    def __init__(self, media, cache=None, enabled=MEDIA_PREPROCESS_ENABLED, wait=MEDIA_PREPROCESS_WAIT,
+                 min_bytes=MEDIA_PREPROCESS_MIN_BYTES, profiles=None):
+        self.media = media # MediaRegistry the originals and variants are read through
+        self.enabled = enabled
+        self.wait = wait
+        self.min_bytes = min_bytes
+        self.profiles = profiles or PROFILES
+        self.cache = cache
+        if enabled and cache is None:
+            self.cache = TranscodeCache(MEDIA_VARIANT_DIR, MEDIA_VARIANT_MAX_BYTES, MEDIA_PREPROCESS_WORKERS)
+        self._failed = set() # cache keys whose transcode failed; not retried until the source changes
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def image(self, path, wait=None):
+        return self.get(path, KIND_IMAGE, wait)
+
+    def video(self, path, wait=None):
+        return self.get(path, KIND_VIDEO, wait)
+
+    def thumbnail(self, path, wait=None):
+        # A small JPEG of an image or video, or None if it can't be made (in time)
+        variant = self._variant(path, KIND_THUMBNAIL, self.wait if wait is None else wait)
+        return self.media.get(variant) if variant else None
+
+    def get(self, path, kind=None, wait=None):
+        # Returns the MediaAsset to upload for `path`. `kind` is "image" or "video", or taken from
+        # the file's type; anything else is returned as it is. `wait` overrides how long to wait
+        # for a variant that isn't cached yet; None waits the configured time, a negative value
+        # as long as it takes (worth it when the same file goes to many recipients).
+        original = self.media.get(path)
+        if not self.enabled:
+            return original
+        if kind is None:
+            kind = original.mime.split("/")[0]
+        if kind not in (KIND_IMAGE, KIND_VIDEO):
+            return original
+        if kind == KIND_IMAGE and original.mime not in _IMAGE_MIMES:
+            return original
+        if original.size < self.min_bytes:
+            self._count(kind, "skipped")
+            return original
+        variant = self._variant(path, kind, self.wait if wait is None else wait)
+        if variant is None:
+            return original
+        asset = self.media.get(variant)
+        if asset.size >= original.size:
+            # Already well compressed; keep the original quality
+            self._count(kind, "larger")
+            return original
+        self._count(kind, "variant")
+        return asset
+
+    def _variant(self, path, kind, wait):
+        # Path of the cached variant, or None if it failed or isn't ready within `wait` seconds
+        if not self.enabled:
+            return None
+        args, ext = self.profiles[kind]
+        key = self.cache.cache_key(path, args, ext)
+        if key in self._failed:
+            self._count(kind, "failed")
+            return None
+        future = self.cache.submit(path, args, ext)
+        try:
+            return future.result(timeout=None if wait < 0 else wait)
+        except FutureTimeout:
+            self._count(kind, "pending")
+            return None
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", None)
+            logger.warning(
+                "Could not make %s variant of '%s': %s", kind, path,
+                stderr.decode("utf-8", "replace")[-500:].strip() if stderr else e,
+            )
+            with self._lock:
+                self._failed.add(key)
+            self._count(kind, "failed")
+            return None
+
+    def _count(self, kind, result):
+        MEDIA_VARIANTS.inc(kind, result)
+        with self._lock:
+            self._counts[f"{kind}_{result}"] = self._counts.get(f"{kind}_{result}", 0) + 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "enabled": self.enabled,
+            "results": counts,
+            "failed_sources": len(self._failed),
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def shutdown(self):
+        if self.cache is not None:
+            self.cache.shutdown()
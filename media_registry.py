@@ -0,0 +1,165 @@
+import os
+import mimetypes
+import threading
+import logging
+from collections import OrderedDict
+from multipart import FileSource
+
+try:
+    import magic # python-magic, optional: sniffs the type from the file content
+except ImportError:
+    magic = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MEDIA_RELOAD_INTERVAL = float(os.getenv("MEDIA_RELOAD_INTERVAL", "5"))
+# Files larger than this aren't read into memory; uploads stream them from disk instead
+MEDIA_STREAM_MIN_BYTES = int(os.getenv("MEDIA_STREAM_MIN_BYTES", str(8 * 1024 * 1024)))
+
+
+def detect_mime(path, data=None):
+    if magic is not None and data is not None:
+        try:
+            return magic.from_buffer(bytes(data[:2048]), mime=True)
+        except Exception:
+            pass
+    mime, _ = mimetypes.guess_type(path)
+    return mime or "application/octet-stream"
+
+
+class MediaAsset:
+    __slots__ = ("path", "name", "data", "mime", "size", "signature")
+
+    def __init__(self, path, data, mime, signature):
+        self.path = path
+        self.name = os.path.basename(path)
+        # Read-only view, handed out without copying; or a FileSource for files streamed from disk
+        self.data = data if isinstance(data, FileSource) else memoryview(data)
+        self.mime = mime
+        self.size = len(data)
+        self.signature = signature
+
+    @property
+    def streamed(self):
+        return isinstance(self.data, FileSource)
+
+
+class MediaPart(tuple):
+    # (filename, content, mime) multipart tuple that remembers the file it was read from
+    def __new__(cls, name, data, mime, path=None):
+        part = super().__new__(cls, (name, data, mime))
+        part.path = path
+        return part
+
+
+class MediaRegistry:
+    # Keeps media files in memory so repeat sends don't touch the filesystem.
+    # A background thread polls the loaded files and reloads the ones that changed on disk.
+    def __init__(self, max_bytes=MEDIA_CACHE_MAX_BYTES, reload_interval=MEDIA_RELOAD_INTERVAL, preload_dir=None,
+                 stream_min_bytes=MEDIA_STREAM_MIN_BYTES):
+        self.max_bytes = max_bytes
+        self.stream_min_bytes = stream_min_bytes
+        self.reload_interval = reload_interval
+        self._assets = OrderedDict() # path -> MediaAsset, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._reloads = 0
+        self._evictions = 0
+        self._streamed = 0
+        self._stop = threading.Event()
+        self._watcher = None
+        if preload_dir:
+            self.preload(preload_dir)
+        if reload_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name="media-watcher", daemon=True)
+            self._watcher.start()
+
+    def preload(self, directory):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                self.get(path)
+
+    def get(self, path):
+        # Raises FileNotFoundError like open() would if the file is missing
+        key = os.path.normpath(path)
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None:
+                self._assets.move_to_end(key)
+                self._hits += 1
+                return asset
+        asset = self._load(key)
+        with self._lock:
+            if asset.streamed:
+                self._streamed += 1
+                return asset
+            self._loads += 1
+            self._store(key, asset)
+        return asset
+
+    def _load(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size >= self.stream_min_bytes:
+                # Only the head is read, to sniff the type
+                return MediaAsset(path, FileSource(path), detect_mime(path, f.read(2048)), (stat.st_mtime_ns, stat.st_size))
+            data = f.read()
+        return MediaAsset(path, data, detect_mime(path, data), (stat.st_mtime_ns, stat.st_size))
+
+    def _store(self, key, asset):
+        previous = self._assets.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if asset.size > self.max_bytes or asset.streamed:
+            return # Too big to keep; the caller still gets it for this send
+        self._assets[key] = asset
+        self._bytes += asset.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._assets.popitem(last=False)
+            self._bytes -= evicted.size
+            self._evictions += 1
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            with self._lock:
+                assets = list(self._assets.items())
+            for key, asset in assets:
+                try:
+                    stat = os.stat(key)
+                except FileNotFoundError:
+                    with self._lock:
+                        if self._assets.get(key) is asset:
+                            del self._assets[key]
+                            self._bytes -= asset.size
+                    continue
+                if (stat.st_mtime_ns, stat.st_size) != asset.signature:
+                    try:
+                        reloaded = self._load(key)
+                    except OSError as e:
+                        logger.error("Error reloading media '%s': %s", key, e)
+                        continue
+                    with self._lock:
+                        if key in self._assets:
+                            self._store(key, reloaded)
+                            self._reloads += 1
+                    logger.info("Reloaded changed media file: %s", key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "assets": len(self._assets),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "loads": self._loads,
+                "reloads": self._reloads,
+                "evictions": self._evictions,
+                "streamed": self._streamed,
+            }
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,324 @@
+import os
+import json
+import atexit
+import threading
+import time
+from bisect import bisect_left
+
+# Directory where each worker process leaves a snapshot of its metrics, so /metrics on any
+# worker reports the totals of all of them. Empty for single-process serving.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+# Upper bounds in seconds; wide enough for an HMAC check (microseconds) and a media upload (seconds)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def series(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def merge(self, series_lists):
+        totals = {}
+        for series in series_lists:
+            for labels, value in series:
+                totals[labels] = totals.get(labels, 0) + value
+        return list(totals.items())
+
+    def collect(self, series=None):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.series() if series is None else series:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        # Bucket counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = _Series(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    def time(self, *labels):
+        # with histogram.time("label"): ...
+        return _Timer(self, labels)
+
+    def series(self):
+        with self._lock:
+            return [(labels, (list(s.counts), s.sum, s.count)) for labels, s in self._series.items()]
+
+    def merge(self, series_lists):
+        totals = {}
+        for series in series_lists:
+            for labels, (counts, total, count) in series:
+                merged = totals.get(labels)
+                if merged is None:
+                    totals[labels] = (list(counts), total, count)
+                else:
+                    totals[labels] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + total, merged[2] + count)
+        return list(totals.items())
+
+    def collect(self, series=None):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self.series() if series is None else series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Gauge:
+    # Read from `func` when /metrics is scraped, for values other components already track.
+    # Across worker processes the values are summed, or with aggregate="max" taken from one
+    # process, for values every worker reads from the same shared store.
+    def __init__(self, name, help, func, aggregate="sum"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.aggregate = aggregate
+
+    def series(self):
+        return [((), self.func())]
+
+    def merge(self, series_lists):
+        values = [value for series in series_lists for _, value in series]
+        if self.aggregate == "max":
+            return [((), max(values, default=0))]
+        return [((), sum(values))]
+
+    def collect(self, series=None):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for _, value in self.series() if series is None else series:
+            yield f"{self.name} {_number(value)}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.directory = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def share(self, directory, interval=5.0):
+        # Multi-process mode: every process writes its series to `directory` now and then,
+        # and render() adds up the series of all of them, so any worker can answer a scrape.
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.write_snapshot()
+        atexit.register(self.write_snapshot)
+        thread = threading.Thread(target=self._share_loop, args=(interval,), name="metrics-snapshot", daemon=True)
+        thread.start()
+
+    def _share_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.write_snapshot()
+
+    def _series(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        snapshot = {}
+        for metric in metrics:
+            try:
+                snapshot[metric.name] = metric.series()
+            except Exception:
+                continue
+        return metrics, snapshot
+
+    def write_snapshot(self):
+        _, snapshot = self._series()
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def _shared_series(self, own):
+        # Series of this process plus those in the snapshots of the others. Counters and
+        # histograms of exited processes still count; gauges only come from live ones.
+        snapshots = [(os.getpid(), own)]
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append((int(name[:-5]), json.load(f)))
+            except (OSError, ValueError):
+                continue
+        merged = {}
+        for pid, snapshot in snapshots:
+            alive = pid == os.getpid() or _pid_alive(pid)
+            for name, series in snapshot.items():
+                # JSON turns the label tuples into lists
+                merged.setdefault(name, []).append(([(tuple(labels), value) for labels, value in series], alive))
+        return merged
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        metrics, own = self._series()
+        shared = self._shared_series(own) if self.directory else None
+        lines = []
+        for metric in metrics:
+            try:
+                if shared is None:
+                    lines.extend(metric.collect(own.get(metric.name)))
+                    continue
+                series_lists = [series for series, alive in shared.get(metric.name, ()) if alive or not isinstance(metric, Gauge)]
+                lines.extend(metric.collect(metric.merge(series_lists)))
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def endpoint_label(endpoint):
+    # /message/<id>/revoke -> /message/:id/revoke, so message ids don't each become a series
+    if endpoint.startswith("/message/"):
+        parts = endpoint.split("/")
+        if len(parts) == 4:
+            parts[2] = ":id"
+            return "/".join(parts)
+    return endpoint
+
+
+REGISTRY = Registry()
+
+WEBHOOK_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_webhook_duration_seconds", "Time spent in the webhook handler.", ("status",)
+))
+WEBHOOK_BATCH_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_webhook_batch_duration_seconds", "Time spent in the batch webhook handler.", ("status",)
+))
+WEBHOOK_BATCH_EVENTS = REGISTRY.register(Histogram(
+    "whatsapp_bot_webhook_batch_events", "Events per accepted webhook batch.",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 5000),
+))
+HMAC_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_hmac_verify_duration_seconds", "Time spent verifying request signatures."
+))
+SIGNATURE_FAILURES = REGISTRY.register(Counter(
+    "whatsapp_bot_signature_failures_total", "Requests rejected for a missing or invalid signature.", ("reason",)
+))
+COMMAND_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_command_duration_seconds", "Time spent in a bot command handler.", ("command",)
+))
+COMMAND_ERRORS = REGISTRY.register(Counter(
+    "whatsapp_bot_command_errors_total", "Bot command handlers that raised.", ("command",)
+))
+API_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_go_api_request_duration_seconds", "Go WhatsApp API request latency.", ("method", "endpoint")
+))
+API_ERRORS = REGISTRY.register(Counter(
+    "whatsapp_bot_go_api_errors_total", "Failed Go WhatsApp API requests, by HTTP status or error type.",
+    ("method", "endpoint", "reason")
+))
+FFMPEG_DURATION = REGISTRY.register(Histogram(
+    "whatsapp_bot_ffmpeg_duration_seconds", "Wall time of ffmpeg subprocess runs."
+))
+FFMPEG_RUNS = REGISTRY.register(Counter(
+    "whatsapp_bot_ffmpeg_runs_total", "ffmpeg subprocess runs, by result.", ("result",)
+))
+MEDIA_VARIANTS = REGISTRY.register(Counter(
+    "whatsapp_bot_media_variants_total",
+    "Image/video sends by what was uploaded: a cached variant, or the original and why.", ("kind", "result")
+))
+BACKEND_REQUESTS = REGISTRY.register(Counter(
+    "whatsapp_bot_go_api_backend_requests_total", "Go WhatsApp API requests per pooled backend, by result.",
+    ("backend", "result")
+))
+BACKEND_EJECTIONS = REGISTRY.register(Counter(
+    "whatsapp_bot_go_api_backend_ejections_total", "Times a pooled Go WhatsApp API backend was taken out of rotation.",
+    ("backend",)
+))
+CIRCUIT_TRIPS = REGISTRY.register(Counter(
+    "whatsapp_bot_circuit_trips_total", "Times a Go WhatsApp API endpoint's circuit breaker opened.", ("endpoint",)
+))
+CIRCUIT_REJECTIONS = REGISTRY.register(Counter(
+    "whatsapp_bot_circuit_rejections_total", "Go WhatsApp API calls failed fast by an open circuit.", ("endpoint",)
+))
+API_RETRIES = REGISTRY.register(Counter(
+    "whatsapp_bot_go_api_retries_total", "Go WhatsApp API calls retried within the retry budget.", ("endpoint",)
+))
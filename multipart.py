@@ -0,0 +1,153 @@
+import os
+import uuid
+import mmap
+import contextvars
+from contextlib import contextmanager
+
+# Multipart bodies are encoded while they are sent, UPLOAD_CHUNK_SIZE bytes at a time, so an
+# upload holds one chunk in memory whatever the size of the file
+UPLOAD_STREAMING = os.getenv("UPLOAD_STREAMING", "true").lower() == "true"
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Progress callback for uploads started by the current thread or asyncio task
+_progress_callback = contextvars.ContextVar("upload_progress", default=None)
+
+
+@contextmanager
+def upload_progress(callback):
+    # with upload_progress(lambda sent, total: ...): client.send_video(...)
+    # `total` is None when the body size isn't known up front (generator content).
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+
+def current_progress():
+    return _progress_callback.get()
+
+
+class FileSource:
+    # A file on disk that is opened only while it is being sent, so holding one costs nothing
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+
+    def __len__(self):
+        return os.path.getsize(self.path)
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def read(self):
+        # For callers that need the content in one piece (requests' own multipart encoder)
+        with self.open() as f:
+            return f.read()
+
+
+def _size(content):
+    # Bytes left to send from `content`, or None if that can't be known without reading it
+    if isinstance(content, (bytes, bytearray, memoryview, mmap.mmap, FileSource)):
+        return len(content)
+    if hasattr(content, "read"):
+        try:
+            return os.fstat(content.fileno()).st_size - content.tell()
+        except (AttributeError, OSError, ValueError):
+            pass
+        try:
+            position = content.tell()
+            end = content.seek(0, os.SEEK_END)
+            content.seek(position)
+            return end - position
+        except (AttributeError, OSError, ValueError):
+            return None
+    return None
+
+
+class MultipartEncoder:
+    # Iterable multipart/form-data body for requests' `data=`. With a known length requests
+    # sends it with a Content-Length, otherwise with chunked transfer encoding. Content can
+    # be bytes, a memoryview or mmap (sliced, not copied), a file object, a FileSource, or an
+    # iterable of bytes. File objects are read from where they were when the encoder was made,
+    # so a body without generator content can be sent again, e.g. to another backend.
+    def __init__(self, fields=None, files=None, chunk_size=UPLOAD_CHUNK_SIZE, progress=None, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._parts = [] # (header bytes, content, start offset)
+        for name, value in (fields or {}).items():
+            header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+            self._parts.append((header.encode(), str(value).encode(), None))
+        for field, part in (files or {}).items():
+            if isinstance(part, tuple):
+                filename, content = part[0], part[1]
+                mime = part[2] if len(part) > 2 and part[2] else "application/octet-stream"
+            else:
+                filename, content, mime = getattr(part, "name", field), part, "application/octet-stream"
+            if isinstance(content, str):
+                content = content.encode()
+            header = (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(field)}"; '
+                f'filename="{_quote(os.path.basename(str(filename)))}"\r\nContent-Type: {mime}\r\n\r\n'
+            )
+            start = content.tell() if hasattr(content, "read") and hasattr(content, "tell") else None
+            self._parts.append((header.encode(), content, start))
+        self._trailer = f"--{self.boundary}--\r\n".encode()
+        # requests reads the body length from `len`; None makes it fall back to chunked encoding
+        self.len = self._length()
+
+    def _length(self):
+        total = len(self._trailer)
+        for header, content, _ in self._parts:
+            size = _size(content)
+            if size is None:
+                return None
+            total += len(header) + size + 2
+        return total
+
+    def __iter__(self):
+        sent = 0
+        for header, content, start in self._parts:
+            yield header
+            sent += len(header)
+            for chunk in self._content_chunks(content, start):
+                yield chunk
+                sent += len(chunk)
+                if self.progress is not None:
+                    self.progress(sent, self.len)
+            yield b"\r\n"
+            sent += 2
+        yield self._trailer
+        if self.progress is not None:
+            self.progress(sent + len(self._trailer), self.len)
+
+    def _content_chunks(self, content, start):
+        chunk_size = self.chunk_size
+        if isinstance(content, (bytes, bytearray, memoryview, mmap.mmap)):
+            view = memoryview(content)
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+        elif isinstance(content, FileSource):
+            with content.open() as f:
+                yield from _read_chunks(f, chunk_size)
+        elif hasattr(content, "read"):
+            if start is not None:
+                content.seek(start)
+            yield from _read_chunks(content, chunk_size)
+        else:
+            for chunk in content:
+                yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+def _read_chunks(f, chunk_size):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _quote(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\r", "").replace("\n", "")
@@ -0,0 +1,300 @@
+import os
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+OUTBOUND_SCHEDULER_ENABLED = os.getenv("OUTBOUND_SCHEDULER_ENABLED", "true").lower() == "true"
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "20"))
+OUTBOUND_GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "20"))
+OUTBOUND_RECIPIENT_RATE = float(os.getenv("OUTBOUND_RECIPIENT_RATE", "2"))
+OUTBOUND_RECIPIENT_BURST = float(os.getenv("OUTBOUND_RECIPIENT_BURST", "5"))
+
+# Priority classes, lowest value is dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_MEDIA = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_MEDIA: "media", PRIORITY_BULK: "bulk"}
+
+MEDIA_ENDPOINTS = {"/send/image", "/send/video", "/send/audio", "/send/file"}
+SCHEDULED_PREFIXES = ("/send/", "/message/")
+
+_MAX_IDLE_BUCKETS = 10000
+
+# Priority override for the current thread or asyncio task
+_priority_override = contextvars.ContextVar("outbound_priority", default=None)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        # Seconds until one token is available (0 if it is available now)
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class SharedTokenBucket:
+    # TokenBucket whose state lives in the shared state database, so worker processes draw
+    # from one budget. delay() and consume() aren't atomic together: two processes can both
+    # see the last token and both take it, which leaves the bucket in debt and delays the
+    # next send by the same amount, so the rate holds over time.
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+    """
+    __slots__ = ("db", "key", "rate", "burst")
+
+    def __init__(self, db, key, rate, burst):
+        db.ensure_schema("rate_buckets", self._SCHEMA)
+        self.db = db
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def _tokens(self, now):
+        row = self.db.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (self.key,)).fetchone()
+        if row is None:
+            return self.burst
+        return min(self.burst, row[0] + (now - row[1]) * self.rate)
+
+    # The `now` arguments are monotonic times from the scheduler; the shared state uses
+    # wall-clock time, which every process agrees on.
+
+    def delay(self, now):
+        tokens = self._tokens(time.time())
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate
+
+    def consume(self, now):
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ? - 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = min(?, tokens + (? - updated) * ?) - 1, updated = ?",
+            (self.key, self.burst, now, self.burst, now, self.rate, now),
+        )
+
+    def is_full(self, now):
+        return self._tokens(time.time()) >= self.burst
+
+
+class _AsyncGrant:
+    # Stands in for threading.Event when the waiter is a coroutine on an event loop
+    __slots__ = ("loop", "future")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "recipient", "enqueued", "granted")
+
+    def __init__(self, priority, seq, recipient, granted=None):
+        self.priority = priority
+        self.seq = seq
+        self.recipient = recipient
+        self.enqueued = time.monotonic()
+        self.granted = granted or threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ClassStats:
+    __slots__ = ("waiting", "granted", "wait_total", "recent_waits")
+
+    def __init__(self):
+        self.waiting = 0
+        self.granted = 0
+        self.wait_total = 0.0
+        self.recent_waits = deque(maxlen=1000)
+
+
+class OutboundScheduler:
+    # Callers block in acquire() until a dispatcher thread grants them a send slot.
+    # Slots go to the highest priority class first, subject to a global token bucket
+    # and a token bucket per recipient; a recipient that is out of tokens is parked
+    # so it doesn't hold up sends to anybody else.
+    # With a shared state `db`, the token buckets are shared by every process using it;
+    # schedulers with different `global_key`s share the recipient buckets but not the global one.
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, global_burst=OUTBOUND_GLOBAL_BURST,
+                 recipient_rate=OUTBOUND_RECIPIENT_RATE, recipient_burst=OUTBOUND_RECIPIENT_BURST, db=None,
+                 global_key="global"):
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.db = db
+        if db is not None:
+            self._global = SharedTokenBucket(db, global_key, global_rate, global_burst)
+        else:
+            self._global = TokenBucket(global_rate, global_burst)
+        self._buckets = {}
+        self._heap = []
+        self._parked = [] # (ready_at, ticket)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {priority: _ClassStats() for priority in PRIORITY_NAMES}
+        self._running = True
+        self._dispatcher = threading.Thread(target=self._dispatch, name="outbound-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def is_scheduled(self, endpoint):
+        return endpoint.startswith(SCHEDULED_PREFIXES)
+
+    def classify(self, endpoint):
+        override = _priority_override.get()
+        if override is not None:
+            return override
+        return PRIORITY_MEDIA if endpoint in MEDIA_ENDPOINTS else PRIORITY_INTERACTIVE
+
+    @contextmanager
+    def priority(self, priority):
+        # Sends made inside the block use `priority`, e.g. PRIORITY_BULK for broadcasts
+        token = _priority_override.set(priority)
+        try:
+            yield
+        finally:
+            _priority_override.reset(token)
+
+    def _enqueue(self, ticket):
+        with self._cond:
+            if not self._running:
+                return False # Shutting down: let the remaining sends through unpaced
+            self._stats[ticket.priority].waiting += 1
+            heapq.heappush(self._heap, ticket)
+            self._cond.notify()
+            return True
+
+    def acquire(self, priority, recipient=None):
+        ticket = _Ticket(priority, next(self._seq), recipient)
+        if self._enqueue(ticket):
+            ticket.granted.wait()
+
+    async def acquire_async(self, priority, recipient=None):
+        grant = _AsyncGrant(asyncio.get_running_loop())
+        if self._enqueue(_Ticket(priority, next(self._seq), recipient, grant)):
+            await grant.future
+
+    def call(self, priority, recipient, fn, *args, **kwargs):
+        self.acquire(priority, recipient)
+        return fn(*args, **kwargs)
+
+    def _bucket(self, recipient, now):
+        bucket = self._buckets.get(recipient)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                # Buckets that have refilled completely carry no state worth keeping
+                self._buckets = {r: b for r, b in self._buckets.items() if not b.is_full(now)}
+                if self.db is not None:
+                    self.db.execute(
+                        "DELETE FROM rate_buckets WHERE key LIKE 'recipient:%' AND tokens + (? - updated) * ? >= ?",
+                        (time.time(), self.recipient_rate, self.recipient_burst),
+                    )
+            if self.db is not None:
+                bucket = SharedTokenBucket(self.db, f"recipient:{recipient}", self.recipient_rate, self.recipient_burst)
+            else:
+                bucket = TokenBucket(self.recipient_rate, self.recipient_burst, now)
+            self._buckets[recipient] = bucket
+        return bucket
+
+    def _grant(self, ticket, now):
+        waited = now - ticket.enqueued
+        stats = self._stats[ticket.priority]
+        stats.waiting -= 1
+        stats.granted += 1
+        stats.wait_total += waited
+        stats.recent_waits.append(waited)
+        ticket.granted.set()
+
+    def _dispatch(self):
+        with self._cond:
+            while self._running or self._heap or self._parked:
+                now = time.monotonic()
+                while self._parked and self._parked[0][0] <= now:
+                    heapq.heappush(self._heap, heapq.heappop(self._parked)[1])
+
+                ticket = None
+                while self._heap:
+                    candidate = heapq.heappop(self._heap)
+                    if candidate.recipient is None:
+                        ticket = candidate
+                        break
+                    delay = self._bucket(candidate.recipient, now).delay(now)
+                    if delay <= 0:
+                        ticket = candidate
+                        break
+                    heapq.heappush(self._parked, (now + delay, candidate))
+
+                if ticket is None:
+                    timeout = self._parked[0][0] - now if self._parked else None
+                    if not self._running and not self._parked:
+                        break
+                    self._cond.wait(timeout)
+                    continue
+
+                delay = self._global.delay(now)
+                if delay > 0:
+                    heapq.heappush(self._heap, ticket)
+                    self._cond.wait(delay)
+                    continue
+
+                self._global.consume(now)
+                if ticket.recipient is not None:
+                    self._bucket(ticket.recipient, now).consume(now)
+                self._grant(ticket, now)
+
+    def stats(self):
+        with self._cond:
+            classes = {}
+            for priority, stats in self._stats.items():
+                waits = sorted(stats.recent_waits)
+                classes[PRIORITY_NAMES[priority]] = {
+                    "depth": stats.waiting,
+                    "granted": stats.granted,
+                    "wait_avg_ms": round(stats.wait_total / stats.granted * 1000, 3) if stats.granted else 0.0,
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 3) if waits else 0.0,
+                    "wait_p99_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else 0.0,
+                }
+            return {
+                "depth": sum(stats.waiting for stats in self._stats.values()),
+                "recipients_tracked": len(self._buckets),
+                "classes": classes,
+            }
+
+    def shutdown(self, timeout=30.0):
+        # Stop accepting new tickets and keep pacing the ones already waiting
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._dispatcher.join(timeout)
@@ -0,0 +1,362 @@
+import os
+import json
+import queue
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import nullcontext
+from media_registry import detect_mime
+from multipart import FileSource
+from outbound_scheduler import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() == "true"
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "cache/outbox.db")
+OUTBOX_BATCH_MAX = int(os.getenv("OUTBOX_BATCH_MAX", "256"))
+# Extra time the writer waits to grow a batch; with 0 a batch is whatever queued up during the last commit
+OUTBOX_BATCH_WINDOW = float(os.getenv("OUTBOX_BATCH_WINDOW", "0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+# An in-flight call whose process hasn't checked in for this long is considered abandoned
+OUTBOX_OWNER_TIMEOUT = float(os.getenv("OUTBOX_OWNER_TIMEOUT", "15"))
+# Dead letters are deleted this many seconds after the call was recorded (default 7 days)
+OUTBOX_DEAD_RETENTION = float(os.getenv("OUTBOX_DEAD_RETENTION", str(7 * 24 * 3600)))
+
+STATUS_PENDING = "pending"
+STATUS_INFLIGHT = "inflight"
+STATUS_DEAD = "dead"
+
+_PRUNE_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    method TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS outbox_owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL);
+"""
+
+
+class NotDurable(Exception):
+    # The request carries data that can't be replayed from disk (e.g. an in-memory file)
+    pass
+
+
+def encode_request(params, json_data, files, data):
+    # Files are stored as a path and re-read on replay, so only parts backed by a file on disk are durable
+    encoded_files = {}
+    for field, part in (files or {}).items():
+        if isinstance(part, tuple):
+            name, content, mime = part[:3]
+            path = getattr(part, "path", None) or getattr(content, "name", None)
+        else:
+            name, mime = getattr(part, "name", field), None
+            path = getattr(part, "name", None)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            raise NotDurable(f"File field '{field}' has no path on disk")
+        encoded_files[field] = {"path": path, "name": os.path.basename(name), "mime": mime}
+    return json.dumps({"params": params, "json": json_data, "data": data, "files": encoded_files})
+
+
+def decode_request(request):
+    decoded = json.loads(request)
+    files = None
+    if decoded["files"]:
+        files = {}
+        for field, part in decoded["files"].items():
+            if not os.path.isfile(part["path"]):
+                raise FileNotFoundError(f"File '{part['path']}' for field '{field}' no longer exists")
+            # Opened only while the replayed request streams it
+            files[field] = (part["name"], FileSource(part["path"]), part["mime"] or detect_mime(part["path"]))
+    return decoded["params"], decoded["json"], files, decoded["data"]
+
+
+def is_retryable(response):
+    if not isinstance(response, dict) or response.get("code") != "ERROR":
+        return False
+    # Client errors other than timeouts and throttling will fail the same way again
+    status = response.get("status")
+    return status is None or status >= 500 or status in (408, 429)
+
+
+class Outbox:
+    # Write-ahead log for Go API writes. A call is recorded before it is sent and deleted
+    # once it succeeds; failed calls are retried with exponential backoff and jitter by a
+    # dispatcher thread, and dead-lettered after OUTBOX_MAX_ATTEMPTS. All writes go through
+    # one thread that commits them in batches, so concurrent senders share an fsync.
+    # Delivery is at-least-once: a crash between sending and deleting replays the call.
+    # Several processes can share one outbox file: in-flight rows carry the id of the
+    # process sending them, and are only replayed once that process stops checking in.
+    def __init__(self, path=OUTBOX_PATH, batch_max=OUTBOX_BATCH_MAX, batch_window=OUTBOX_BATCH_WINDOW,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, backoff_base=OUTBOX_BACKOFF_BASE, backoff_max=OUTBOX_BACKOFF_MAX):
+        self.path = path
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._ops = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._batched_ops = 0
+        self._delivered = 0
+        self._retried = 0
+        self._dead = 0
+        self._stop = threading.Event()
+        self._dispatcher = None
+        self.owner = uuid.uuid4().hex
+
+        db = self._connect()
+        db.executescript(_SCHEMA)
+        if "owner" not in {row[1] for row in db.execute("PRAGMA table_info(outbox)")}:
+            db.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+        self._heartbeat(db)
+        self._recover(db)
+        db.close()
+        self._writer = threading.Thread(target=self._write_loop, name="outbox-writer", daemon=True)
+        self._writer.start()
+
+    def _heartbeat(self, db):
+        with db:
+            db.execute("INSERT OR REPLACE INTO outbox_owners (owner, heartbeat) VALUES (?, ?)", (self.owner, time.time()))
+
+    def _recover(self, db):
+        # Calls that were being sent by a process that has since died are replayed
+        with db:
+            stale = time.time() - OUTBOX_OWNER_TIMEOUT
+            recovered = db.execute(
+                "UPDATE outbox SET status = ?, next_attempt_at = 0, owner = NULL WHERE status = ? AND (owner IS NULL "
+                "OR owner NOT IN (SELECT owner FROM outbox_owners WHERE heartbeat > ?))",
+                (STATUS_PENDING, STATUS_INFLIGHT, stale),
+            ).rowcount
+            db.execute("DELETE FROM outbox_owners WHERE heartbeat <= ?", (stale,))
+        if recovered:
+            logger.info("Outbox: %s interrupted call(s) queued for replay", recovered)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL survives an application crash or container restart
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # Writer
+
+    def _submit(self, sql, args, wait=False):
+        done = threading.Event() if wait else None
+        self._ops.put((sql, args, done))
+        if done is not None:
+            done.wait()
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            op = self._ops.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_max:
+                timeout = deadline - time.monotonic()
+                try:
+                    op = self._ops.get(timeout=timeout) if timeout > 0 else self._ops.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._ops.put(None)
+                    break
+                batch.append(op)
+            try:
+                with db:
+                    for sql, args, _ in batch:
+                        db.execute(sql, args)
+            except sqlite3.Error as e:
+                logger.error("Outbox: Error writing batch of %s: %s", len(batch), e)
+            with self._stats_lock:
+                self._batches += 1
+                self._batched_ops += len(batch)
+            for _, _, done in batch:
+                if done is not None:
+                    done.set()
+        db.close()
+
+    def record(self, method, endpoint, params=None, json_data=None, files=None, data=None, status=STATUS_INFLIGHT):
+        # Returns the id once the record is committed; raises NotDurable if it can't be stored
+        request = encode_request(params, json_data, files, data)
+        record_id = uuid.uuid4().hex
+        self._submit(
+            "INSERT INTO outbox (id, created_at, method, endpoint, request, status, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record_id, time.time(), method, endpoint, request, status, self.owner),
+            wait=True,
+        )
+        return record_id
+
+    def complete(self, record_id):
+        with self._stats_lock:
+            self._delivered += 1
+        self._submit("DELETE FROM outbox WHERE id = ?", (record_id,))
+
+    def fail(self, record_id, attempts, response):
+        # Returns True if the call is queued for another attempt, False if it was dead-lettered
+        error = json.dumps(response)[:1000]
+        if attempts >= self.max_attempts or not is_retryable(response):
+            with self._stats_lock:
+                self._dead += 1
+            logger.warning("Outbox: Dead-lettering %s after %s attempt(s): %s", record_id, attempts, error)
+            self._submit(
+                "UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                (STATUS_DEAD, attempts, error, record_id),
+            )
+            return False
+        # Full jitter: a random delay up to the exponential backoff
+        backoff = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        with self._stats_lock:
+            self._retried += 1
+        self._submit(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (STATUS_PENDING, attempts, time.time() + random.uniform(0, backoff), error, record_id),
+        )
+        return True
+
+    # Sending
+
+    def send(self, client, method, endpoint, params=None, json_data=None, files=None, data=None):
+        # Records the call, sends it right away and leaves failures to the dispatcher. An error
+        # response the dispatcher will retry carries "queued": True, so callers don't send it again.
+        try:
+            record_id = self.record(method, endpoint, params, json_data, files, data)
+        except NotDurable:
+            return client._dispatch(method, endpoint, params, json_data, files, data)
+        return self.settle(record_id, client._dispatch(method, endpoint, params, json_data, files, data))
+
+    def settle(self, record_id, response):
+        # Completes or fails a recorded call after its first attempt and returns its response
+        if isinstance(response, dict) and response.get("code") == "ERROR":
+            if self.fail(record_id, 1, response):
+                response = dict(response, queued=True)
+        else:
+            self.complete(record_id)
+        return response
+
+    def start_dispatcher(self, client, poll_interval=OUTBOX_POLL_INTERVAL):
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, args=(client, poll_interval), name="outbox-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    def _dispatch_loop(self, client, poll_interval):
+        db = self._connect()
+        # Retries queue behind fresh replies
+        scheduler = getattr(client, "scheduler", None)
+        pruned_at = 0.0
+        while not self._stop.wait(poll_interval):
+            self._heartbeat(db)
+            self._recover(db)
+            if time.monotonic() - pruned_at >= _PRUNE_INTERVAL:
+                self._prune(db)
+                pruned_at = time.monotonic()
+            rows = db.execute(
+                "SELECT id, method, endpoint, request, attempts FROM outbox "
+                "WHERE status = ? AND next_attempt_at <= ? ORDER BY created_at LIMIT 50",
+                (STATUS_PENDING, time.time()),
+            ).fetchall()
+            for record_id, method, endpoint, request, attempts in rows:
+                if self._stop.is_set():
+                    break
+                # Claimed directly rather than through the writer, so only one process can win it
+                with db:
+                    claimed = db.execute(
+                        "UPDATE outbox SET status = ?, owner = ? WHERE id = ? AND status = ?",
+                        (STATUS_INFLIGHT, self.owner, record_id, STATUS_PENDING),
+                    ).rowcount
+                if not claimed:
+                    continue
+                try:
+                    params, json_data, files, data = decode_request(request)
+                except (OSError, ValueError) as e:
+                    self.fail(record_id, self.max_attempts, {"code": "ERROR", "message": f"Cannot replay: {e}"})
+                    continue
+                try:
+                    with scheduler.priority(PRIORITY_BULK) if scheduler is not None else nullcontext():
+                        response = client._dispatch(method, endpoint, params, json_data, files, data)
+                except Exception as e:
+                    # e.g. the file went away while the request was being built; one bad row
+                    # mustn't stop the dispatcher
+                    logger.exception("Outbox: Error replaying %s", record_id)
+                    response = {"code": "ERROR", "message": f"Replay failed: {e}", "error": type(e).__name__}
+                if isinstance(response, dict) and response.get("code") == "ERROR":
+                    self.fail(record_id, attempts + 1, response)
+                else:
+                    logger.info("Outbox: Delivered %s %s on attempt %s", method, endpoint, attempts + 1)
+                    self.complete(record_id)
+        db.close()
+
+    def _prune(self, db):
+        with db:
+            pruned = db.execute(
+                "DELETE FROM outbox WHERE status = ? AND created_at < ?", (STATUS_DEAD, time.time() - OUTBOX_DEAD_RETENTION)
+            ).rowcount
+        if pruned:
+            logger.info("Outbox: Deleted %s dead letter(s) past retention", pruned)
+
+    def dead_letters(self, limit=50):
+        db = self._connect()
+        try:
+            rows = db.execute(
+                "SELECT id, created_at, method, endpoint, attempts, last_error FROM outbox "
+                "WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                (STATUS_DEAD, limit),
+            ).fetchall()
+        finally:
+            db.close()
+        keys = ("id", "created_at", "method", "endpoint", "attempts", "last_error")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def stats(self):
+        db = self._connect()
+        try:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        finally:
+            db.close()
+        with self._stats_lock:
+            return {
+                "pending": counts.get(STATUS_PENDING, 0),
+                "inflight": counts.get(STATUS_INFLIGHT, 0),
+                "dead": counts.get(STATUS_DEAD, 0),
+                "delivered": self._delivered,
+                "retried": self._retried,
+                "dead_lettered": self._dead,
+                "batches": self._batches,
+                "avg_batch_size": round(self._batched_ops / self._batches, 2) if self._batches else 0.0,
+            }
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout)
+        self._ops.put(None)
+        self._writer.join(timeout)
+        # Anything still in flight is replayed right away by the next process
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM outbox_owners WHERE owner = ?", (self.owner,))
+        finally:
+            db.close()
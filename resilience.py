@@ -0,0 +1,280 @@
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+from transport import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from metrics import CIRCUIT_TRIPS, CIRCUIT_REJECTIONS, API_RETRIES
+
+logger = logging.getLogger(__name__)
+
+RESILIENCE_ENABLED = os.getenv("RESILIENCE_ENABLED", "true").lower() == "true"
+# Consecutive failures of one endpoint that open its circuit, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "10"))
+# Read timeouts follow each endpoint's latency: TIMEOUT_MULTIPLIER x p99 of the last
+# TIMEOUT_WINDOW calls, within [TIMEOUT_MIN, HTTP_READ_TIMEOUT]
+TIMEOUT_WINDOW = int(os.getenv("TIMEOUT_WINDOW", "200"))
+TIMEOUT_MIN_SAMPLES = int(os.getenv("TIMEOUT_MIN_SAMPLES", "20"))
+TIMEOUT_PERCENTILE = float(os.getenv("TIMEOUT_PERCENTILE", "99"))
+TIMEOUT_MULTIPLIER = float(os.getenv("TIMEOUT_MULTIPLIER", "3"))
+TIMEOUT_MIN = float(os.getenv("TIMEOUT_MIN", "1"))
+# Retries may add at most RETRY_BUDGET_RATIO to the request rate, plus RETRY_BUDGET_MIN per second
+RETRY_MAX = int(os.getenv("RETRY_MAX", "2"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN = float(os.getenv("RETRY_BUDGET_MIN", "1"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.1"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "1"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+TIMEOUT_ERRORS = ("ReadTimeout", "Timeout", "TimeoutError", "ServerTimeoutError")
+
+
+def is_unsent(response):
+    # True for an error response of a call that never reached the backend: its connection
+    # couldn't be opened ("unsent", set by the clients) or its circuit was open. Only such a
+    # write can be sent again without risking a duplicate.
+    if not isinstance(response, dict) or response.get("code") != "ERROR":
+        return False
+    return response.get("unsent") is True or response.get("error") == "CircuitOpen"
+
+
+def is_backend_failure(response):
+    # Errors that say something about the backend rather than about the request
+    if not isinstance(response, dict) or response.get("code") != "ERROR":
+        return False
+    if response.get("error") == "CircuitOpen":
+        return False # Not sent at all
+    status = response.get("status")
+    return status is None or status >= 500
+
+
+def is_retryable(method, response):
+    # Reads are retried on any backend failure or throttling; writes only when they can't
+    # have been delivered, since the outbox already retries the rest with a longer backoff
+    if not isinstance(response, dict) or response.get("code") != "ERROR":
+        return False
+    if response.get("error") == "CircuitOpen":
+        return False
+    if is_unsent(response):
+        return True
+    if method != "GET":
+        return False
+    status = response.get("status")
+    return status is None or status >= 500 or status in (408, 429)
+
+
+def circuit_open_response(label):
+    return {"code": "ERROR", "message": f"Circuit open for {label}: the Go API is failing", "error": "CircuitOpen"}
+
+
+class CircuitBreaker:
+    # closed -> open after `failures` consecutive failures; open -> half-open after `cooldown`
+    # seconds, letting one probe call through; the probe closes the circuit or reopens it
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+
+    def allow(self, now):
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN and now - self.opened_at >= self.cooldown:
+            self.state = STATE_HALF_OPEN
+        if self.state == STATE_HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok, now):
+        # Returns True if this call tripped the circuit
+        self._probing = False
+        if ok:
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            return False
+        self.consecutive_failures += 1
+        if self.state == STATE_HALF_OPEN or (self.state == STATE_CLOSED and self.consecutive_failures >= self.failures):
+            self.state = STATE_OPEN
+            self.opened_at = now
+            self.trips += 1
+            return True
+        return False
+
+
+class LatencyWindow:
+    # Latencies of an endpoint's last `size` calls; the percentile is recomputed every 16 samples
+    def __init__(self, size=TIMEOUT_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._added = 0
+        self._sorted = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self._added += 1
+        if self._added % 16 == 0 or len(self.samples) <= TIMEOUT_MIN_SAMPLES:
+            self._sorted = sorted(self.samples)
+
+    def percentile(self, p):
+        if not self._sorted:
+            return None
+        return self._sorted[min(int(len(self._sorted) * p / 100), len(self._sorted) - 1)]
+
+
+class RetryBudget:
+    # Token bucket shared by every endpoint: each request deposits `ratio` tokens, time adds
+    # `min_per_second`, and a retry costs one. Retries stop when a failing backend would
+    # otherwise see a multiple of the normal load.
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max(10.0, min_per_second * 10)
+        self.balance = self.max_balance
+        self.updated = time.monotonic()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self, now):
+        self.balance = min(self.max_balance, self.balance + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def deposit(self, now):
+        self._refill(now)
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self, now):
+        self._refill(now)
+        if self.balance < 1:
+            self.exhausted += 1
+            return False
+        self.balance -= 1
+        self.retries += 1
+        return True
+
+
+class Resilience:
+    # Circuit breakers per (backend, endpoint), adaptive read timeouts per endpoint and one
+    # retry budget, wrapped around single Go API calls by WhatsAppClient._call. All state is
+    # behind one lock; every operation on it is a few comparisons.
+    def __init__(self, breaker_failures=BREAKER_FAILURES, breaker_cooldown=BREAKER_COOLDOWN, max_retries=RETRY_MAX,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, budget=None):
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.budget = budget or RetryBudget()
+        self._breakers = {} # (base_url, endpoint label) -> CircuitBreaker
+        self._latencies = {} # endpoint label -> LatencyWindow
+        self._lock = threading.Lock()
+
+    def before(self, base_url, label, media):
+        # Returns (breaker, timeout) for an attempt, or (None, None) if the circuit is open.
+        # Uploads keep the static media timeout, since their latency depends on the file size.
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers.get((base_url, label))
+            if breaker is None:
+                breaker = self._breakers[(base_url, label)] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            allowed = breaker.allow(now)
+            timeout = None if media or not allowed else self._timeout(label)
+        if not allowed:
+            CIRCUIT_REJECTIONS.inc(label)
+            return None, None
+        return breaker, timeout
+
+    def rejects(self, base_urls, label):
+        # True while the circuits for `label` on all of `base_urls` are open, so a call can be
+        # failed before it waits for a rate limit slot. Doesn't start a half-open probe.
+        now = time.monotonic()
+        with self._lock:
+            for base_url in base_urls:
+                breaker = self._breakers.get((base_url, label))
+                if breaker is None or breaker.state != STATE_OPEN or now - breaker.opened_at >= breaker.cooldown:
+                    return False
+            for base_url in base_urls:
+                self._breakers[(base_url, label)].rejected += 1
+        CIRCUIT_REJECTIONS.inc(label)
+        return True
+
+    def _timeout(self, label):
+        window = self._latencies.get(label)
+        if window is None or len(window.samples) < TIMEOUT_MIN_SAMPLES:
+            return None # the transport's default
+        read = min(max(window.percentile(TIMEOUT_PERCENTILE) * TIMEOUT_MULTIPLIER, TIMEOUT_MIN), self.read_timeout)
+        return (self.connect_timeout, read)
+
+    def after(self, breaker, base_url, label, method, media, response, elapsed, attempt):
+        # Records an attempt's outcome; returns the delay before a retry, or None to return `response`.
+        # `response` is None if the attempt raised.
+        failed = response is None or is_backend_failure(response)
+        error = response.get("error") if isinstance(response, dict) else None
+        now = time.monotonic()
+        with self._lock:
+            if attempt == 0:
+                self.budget.deposit(now)
+            tripped = breaker.record(not failed, now)
+            # Timed-out calls count at the time they took, so a backend that got slower
+            # raises its own timeout instead of timing out forever
+            if not media and (not failed or error in TIMEOUT_ERRORS):
+                window = self._latencies.get(label)
+                if window is None:
+                    window = self._latencies[label] = LatencyWindow()
+                window.add(elapsed)
+            retry = (
+                failed and attempt < self.max_retries and breaker.state == STATE_CLOSED
+                and is_retryable(method, response) and self.budget.withdraw(now)
+            )
+        if tripped:
+            CIRCUIT_TRIPS.inc(label)
+            logger.warning("Circuit for %s%s opened after %d failures", base_url, label, breaker.consecutive_failures)
+        if not retry:
+            return None
+        API_RETRIES.inc(label)
+        # Full jitter
+        return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+    def open_circuits(self):
+        with self._lock:
+            return sum(breaker.state != STATE_CLOSED for breaker in self._breakers.values())
+
+    def stats(self):
+        with self._lock:
+            breakers = [{
+                "backend": base_url,
+                "endpoint": label,
+                "state": breaker.state,
+                "trips": breaker.trips,
+                "rejected": breaker.rejected,
+                "consecutive_failures": breaker.consecutive_failures,
+            } for (base_url, label), breaker in self._breakers.items()]
+            timeouts = {}
+            for label, window in self._latencies.items():
+                p50 = window.percentile(50)
+                p99 = window.percentile(TIMEOUT_PERCENTILE)
+                timeout = self._timeout(label)
+                timeouts[label] = {
+                    "samples": len(window.samples),
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                    "read_timeout": round(timeout[1], 3) if timeout else None,
+                }
+            return {
+                "breakers": breakers,
+                "timeouts": timeouts,
+                "retry_budget": {
+                    "balance": round(self.budget.balance, 2),
+                    "retries": self.budget.retries,
+                    "exhausted": self.budget.exhausted,
+                },
+            }
@@ -0,0 +1,290 @@
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+
+API_CACHE_ENABLED = os.getenv("API_CACHE_ENABLED", "true").lower() == "true"
+API_CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "5000"))
+
+# Seconds a successful GET response stays fresh, per endpoint.
+# Override with API_CACHE_TTLS, e.g. "/user/info=60,/user/check=600".
+DEFAULT_TTLS = {
+    "/user/info": 300,
+    "/user/check": 3600,
+    "/user/avatar": 600,
+    "/user/my/groups": 60,
+    "/user/my/contacts": 300,
+    "/user/my/newsletters": 300,
+    "/user/my/privacy": 300,
+    "/group/participant-requests": 30,
+    "/app/devices": 30,
+}
+
+# Write endpoints and the cached endpoints whose entries they make stale
+INVALIDATIONS = {
+    "/user/avatar": ("/user/avatar", "/user/info"),
+    "/user/pushname": ("/user/info",),
+    "/group": ("/user/my/groups",),
+    "/group/join-with-link": ("/user/my/groups",),
+    "/group/leave": ("/user/my/groups", "/group/participant-requests"),
+    "/group/participants": ("/user/my/groups", "/group/participant-requests"),
+    "/group/participants/remove": ("/user/my/groups",),
+    "/group/participants/promote": ("/user/my/groups",),
+    "/group/participants/demote": ("/user/my/groups",),
+    "/group/participant-requests/approve": ("/user/my/groups", "/group/participant-requests"),
+    "/group/participant-requests/reject": ("/group/participant-requests",),
+    "/newsletter/unfollow": ("/user/my/newsletters",),
+}
+
+
+def parse_ttls(value):
+    ttls = dict(DEFAULT_TTLS)
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        endpoint, _, seconds = item.partition("=")
+        ttls[endpoint.strip()] = float(seconds)
+    return ttls
+
+
+class _Pending:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    # Cached responses are shared between callers and must be treated as read-only.
+    def __init__(self, max_entries=API_CACHE_MAX_ENTRIES, ttls=None, invalidations=INVALIDATIONS):
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else parse_ttls(os.getenv("API_CACHE_TTLS"))
+        self.invalidations = invalidations
+        self._entries = OrderedDict() # (endpoint, params) -> (expires_at, value)
+        self._in_flight = {}
+        # Bumped on invalidation so a load that started before a write isn't stored afterwards
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def is_cacheable(self, endpoint):
+        return self.ttls.get(endpoint, 0) > 0
+
+    def make_key(self, endpoint, params):
+        return (endpoint, tuple(sorted((params or {}).items())))
+
+    def lookup(self, key):
+        # Returns (True, value) for a fresh entry, (False, None) otherwise
+        with self._lock:
+            return self._lookup(key, time.monotonic())
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return True, entry[1]
+            del self._entries[key]
+        return False, None
+
+    def generation(self, endpoint):
+        with self._lock:
+            return self._generation(endpoint)
+
+    def _generation(self, endpoint):
+        return self._generations.get(endpoint, 0)
+
+    def store(self, key, value, generation):
+        # Skipped when the endpoint was invalidated after `generation` was read
+        with self._lock:
+            self._store(key, value, generation)
+
+    def _store(self, key, value, generation):
+        endpoint = key[0]
+        if not self._is_success(value) or self._generation(endpoint) != generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttls[endpoint], value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def get_or_load(self, endpoint, params, loader):
+        key = self.make_key(endpoint, params)
+        with self._lock:
+            hit, value = self._lookup(key, time.monotonic())
+            if hit:
+                return value
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                self._misses += 1
+                pending = self._in_flight[key] = _Pending()
+                generation = self._generation(endpoint)
+                leader = True
+
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = loader()
+            pending.value = value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if pending.error is None:
+                    self._store(key, pending.value, generation)
+            pending.event.set()
+        return value
+
+    def record_miss(self, coalesced=False):
+        # For callers that coalesce concurrent misses themselves (the asyncio client)
+        with self._lock:
+            if coalesced:
+                self._coalesced += 1
+            else:
+                self._misses += 1
+
+    def _is_success(self, value):
+        # Never cache the {"code": "ERROR"} responses _send_request returns on failure
+        return isinstance(value, dict) and value.get("code") != "ERROR"
+
+    def invalidate(self, endpoint):
+        with self._lock:
+            self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+            stale = [key for key in self._entries if key[0] == endpoint]
+            for key in stale:
+                del self._entries[key]
+            self._invalidations += len(stale)
+
+    def invalidate_for(self, write_endpoint):
+        for endpoint in self.invalidations.get(write_endpoint, ()):
+            self.invalidate(endpoint)
+
+    def clear(self):
+        with self._lock:
+            for endpoint in list(self._generations) + list(self.ttls):
+                self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "invalidated": self._invalidations,
+            }
+
+
+class SharedResponseCache(ResponseCache):
+    # ResponseCache whose entries and invalidation generations live in the shared state
+    # database, so a write handled by one worker process invalidates the entry for all of
+    # them. Concurrent misses are still coalesced per process. Past max_entries, the
+    # entries closest to expiry are evicted rather than the least recently used.
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS api_cache (
+        key TEXT PRIMARY KEY,
+        endpoint TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        value TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS api_cache_endpoint ON api_cache (endpoint);
+    CREATE INDEX IF NOT EXISTS api_cache_expiry ON api_cache (expires_at);
+    CREATE TABLE IF NOT EXISTS api_cache_generations (endpoint TEXT PRIMARY KEY, generation INTEGER NOT NULL);
+    """
+
+    def __init__(self, db, max_entries=API_CACHE_MAX_ENTRIES, ttls=None, invalidations=INVALIDATIONS, trim_every=64):
+        super().__init__(max_entries, ttls, invalidations)
+        self.db = db
+        self.trim_every = trim_every
+        self._stores = 0
+        db.ensure_schema("api_cache", self._SCHEMA)
+
+    def _db_key(self, key):
+        return json.dumps([key[0], key[1]], default=str)
+
+    def _lookup(self, key, now):
+        # Wall-clock time: expiry has to mean the same thing in every process
+        now = time.time()
+        row = self.db.execute(
+            "SELECT value FROM api_cache WHERE key = ? AND expires_at > ?", (self._db_key(key), now)
+        ).fetchone()
+        if row is None:
+            return False, None
+        self._hits += 1
+        return True, json.loads(row[0])
+
+    def _generation(self, endpoint):
+        row = self.db.execute(
+            "SELECT generation FROM api_cache_generations WHERE endpoint = ?", (endpoint,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _store(self, key, value, generation):
+        endpoint = key[0]
+        if not self._is_success(value):
+            return
+        with self.db.transaction() as db:
+            if self._generation(endpoint) != generation:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO api_cache (key, endpoint, expires_at, value) VALUES (?, ?, ?, ?)",
+                (self._db_key(key), endpoint, time.time() + self.ttls[endpoint], json.dumps(value)),
+            )
+        self._stores += 1
+        if self._stores % self.trim_every == 0:
+            self._trim()
+
+    def _trim(self):
+        with self.db.transaction() as db:
+            db.execute("DELETE FROM api_cache WHERE expires_at <= ?", (time.time(),))
+            evicted = db.execute(
+                "DELETE FROM api_cache WHERE key IN (SELECT key FROM api_cache ORDER BY expires_at "
+                "LIMIT max(0, (SELECT COUNT(*) FROM api_cache) - ?))",
+                (self.max_entries,),
+            ).rowcount
+        self._evictions += evicted
+
+    def _bump(self, db, endpoint):
+        db.execute(
+            "INSERT INTO api_cache_generations (endpoint, generation) VALUES (?, 1) "
+            "ON CONFLICT(endpoint) DO UPDATE SET generation = generation + 1",
+            (endpoint,),
+        )
+
+    def invalidate(self, endpoint):
+        with self._lock:
+            with self.db.transaction() as db:
+                self._bump(db, endpoint)
+                self._invalidations += db.execute("DELETE FROM api_cache WHERE endpoint = ?", (endpoint,)).rowcount
+
+    def clear(self):
+        with self._lock:
+            with self.db.transaction() as db:
+                for endpoint in self.ttls:
+                    self._bump(db, endpoint)
+                db.execute("DELETE FROM api_cache")
+
+    def stats(self):
+        stats = super().stats()
+        stats["entries"] = self.db.execute("SELECT COUNT(*) FROM api_cache").fetchone()[0]
+        stats["shared"] = True
+        return stats
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# State that has to agree between worker processes (dedup keys, webhook logs, cached API
+# responses, rate-limit buckets) lives in one local SQLite file when SHARED_STATE is on.
+# gunicorn.conf.py turns it on for multi-worker serving.
+SHARED_STATE = os.getenv("SHARED_STATE", "false").lower() == "true"
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "cache/state.db")
+
+
+class StateDB:
+    # One connection per thread. The data is only shared between live processes and can be
+    # rebuilt, so writes skip fsync (synchronous=OFF) and only rely on WAL for consistency.
+    def __init__(self, path=SHARED_STATE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schemas = set()
+
+    @property
+    def connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None or getattr(self._local, "pid", None) != os.getpid():
+            # isolation_level=None: transactions are started explicitly in transaction()
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def ensure_schema(self, name, script):
+        # Runs `script` once per process; every statement in it must be idempotent
+        with self._schema_lock:
+            if name in self._schemas:
+                return
+            self.connection.executescript(script)
+            self._schemas.add(name)
+
+    def execute(self, sql, args=()):
+        return self.connection.execute(sql, args)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a read-then-write is atomic across processes
+        db = self.connection
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def state_db():
+    # The process-wide StateDB at SHARED_STATE_PATH
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = StateDB()
+        return _default
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Warm-up steps to run at startup, comma-separated; empty to skip the warm-up (/ready is then 200 at once)
+STARTUP_WARMUP = [step.strip() for step in os.getenv("STARTUP_WARMUP", "connections,media,audio,timezone").split(",") if step.strip()]
+# Pooled connections to open to each Go API backend
+STARTUP_WARMUP_CONNECTIONS = int(os.getenv("STARTUP_WARMUP_CONNECTIONS", "4"))
+# /ready turns 200 after this many seconds even if a step is still running
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "60"))
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+class Warmup:
+    # Runs the warm-up steps on background threads, all at once, so the app serves requests
+    # while it warms up. Ready once every step has finished; a failed step (Go API down, no
+    # ffmpeg) is logged and reported, and only means that the first request using it pays the
+    # cold cost, so it doesn't hold readiness back.
+    def __init__(self, steps, enabled=STARTUP_WARMUP, timeout=STARTUP_WARMUP_TIMEOUT):
+        unknown = [name for name in enabled if name not in steps]
+        if unknown:
+            logger.warning("Unknown warm-up steps ignored: %s (known: %s)", ", ".join(unknown), ", ".join(steps))
+        self.steps = {name: step for name, step in steps.items() if name in enabled}
+        self.timeout = timeout
+        self._results = {name: {"status": STATUS_PENDING} for name in self.steps}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started = None
+        self._finished = None
+        if not self.steps:
+            self._done.set()
+
+    def start(self):
+        self._started = time.monotonic()
+        if self.steps:
+            threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+        return self
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=len(self.steps), thread_name_prefix="warm-up") as executor:
+            for name, step in self.steps.items():
+                executor.submit(self._run_step, name, step)
+        self._finished = time.monotonic()
+        self._done.set()
+        logger.info("Warm-up finished in %.2fs: %s", self._finished - self._started, self.results())
+
+    def _run_step(self, name, step):
+        with self._lock:
+            self._results[name] = {"status": STATUS_RUNNING}
+        start = time.perf_counter()
+        try:
+            detail = step()
+            result = {"status": STATUS_OK, "detail": detail}
+        except Exception as e:
+            logger.warning("Warm-up step '%s' failed: %s", name, e)
+            result = {"status": STATUS_FAILED, "error": str(e)}
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        with self._lock:
+            self._results[name] = result
+
+    def ready(self):
+        if self._done.is_set():
+            return True
+        return self._started is not None and time.monotonic() - self._started >= self.timeout
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def results(self):
+        with self._lock:
+            return {name: dict(result) for name, result in self._results.items()}
+
+    def stats(self):
+        if self._finished is not None:
+            elapsed = self._finished - self._started
+        elif self._started is not None:
+            elapsed = time.monotonic() - self._started
+        else:
+            elapsed = 0.0
+        return {
+            "ready": self.ready(),
+            "finished": self._done.is_set(),
+            "seconds": round(elapsed, 3),
+            "steps": self.results(),
+        }
@@ -0,0 +1,178 @@
+import os
+import hashlib
+import subprocess
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from metrics import FFMPEG_DURATION, FFMPEG_RUNS
+
+logger = logging.getLogger(__name__)
+
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", "cache/transcode")
+TRANSCODE_CACHE_MAX_BYTES = int(os.getenv("TRANSCODE_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+
+# Encoder settings WhatsApp expects for voice notes
+OPUS_ARGS = ("-c:a", "libopus", "-b:a", "64k", "-vbr", "on", "-compression_level", "10")
+
+_TMP_MARKER = ".tmp-"
+_TMP_MAX_AGE = 3600
+
+
+def _run_ffmpeg(source_path, output_path, args):
+    command = ["ffmpeg", "-y", "-i", source_path, *args, output_path]
+    start = time.perf_counter()
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        FFMPEG_RUNS.inc("error")
+        raise
+    finally:
+        FFMPEG_DURATION.observe(time.perf_counter() - start)
+    FFMPEG_RUNS.inc("ok")
+
+
+class TranscodeCache:
+    # Transcoded files are stored under a name derived from the source content hash
+    # and the encoder arguments, so a changed source or changed settings never hit a stale entry.
+    def __init__(self, cache_dir=TRANSCODE_CACHE_DIR, max_bytes=TRANSCODE_CACHE_MAX_BYTES, workers=TRANSCODE_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # ffmpeg does the heavy lifting in its own process; the pool only caps how many run at once
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcode")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # cache file name -> size, least recently used first
+        self._bytes = 0
+        self._in_flight = {}
+        self._source_hashes = {}
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+        self._evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            if _TMP_MARKER in name:
+                # Left behind by a transcode that was interrupted, unless another worker
+                # process sharing the directory is still writing it
+                if time.time() - stat.st_mtime > _TMP_MAX_AGE:
+                    os.remove(path)
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._enforce_limit()
+
+    def _source_hash(self, source_path):
+        # Hash the file once per (mtime, size); raises FileNotFoundError if it is missing
+        stat = os.stat(source_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._source_hashes.get(source_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        self._source_hashes[source_path] = (signature, digest.hexdigest())
+        return digest.hexdigest()
+
+    def cache_key(self, source_path, args, ext):
+        params = hashlib.sha256("\0".join(args).encode("utf-8")).hexdigest()[:16]
+        return f"{self._source_hash(source_path)[:32]}-{params}{ext}"
+
+    def transcode(self, source_path, args=OPUS_ARGS, ext=".ogg"):
+        # Returns the path of the transcoded file, running ffmpeg only on a cache miss.
+        # Concurrent requests for the same key wait on the same ffmpeg run.
+        return self.submit(source_path, args, ext).result()
+
+    def submit(self, source_path, args=OPUS_ARGS, ext=".ogg"):
+        # Like transcode(), but returns a Future of the path instead of waiting for it
+        name = self.cache_key(source_path, args, ext)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if os.path.exists(path):
+                if name not in self._entries:
+                    # Written by another worker process sharing the cache directory
+                    self._adopt(name, path)
+                self._entries.move_to_end(name)
+                self._hits += 1
+                future = Future()
+                future.set_result(path)
+                return future
+            future = self._in_flight.get(name)
+            if future is None:
+                self._misses += 1
+                future = self._executor.submit(self._transcode, source_path, args, name)
+                self._in_flight[name] = future
+            else:
+                self._shared += 1
+        return future
+
+    def _adopt(self, name, path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        self._entries[name] = size
+        self._bytes += size
+        self._enforce_limit(keep=name)
+
+    def _transcode(self, source_path, args, name):
+        path = os.path.join(self.cache_dir, name)
+        root, ext = os.path.splitext(name)
+        tmp_path = os.path.join(self.cache_dir, f"{root}{_TMP_MARKER}{uuid.uuid4().hex}{ext}")
+        try:
+            _run_ffmpeg(source_path, tmp_path, args)
+            # Readers only ever see a complete file
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                self._bytes += size - self._entries.pop(name, 0)
+                self._entries[name] = size
+                self._enforce_limit(keep=name)
+            logger.info("Transcoded '%s' to cache: %s", source_path, path)
+            return path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._in_flight.pop(name, None)
+
+    def _enforce_limit(self, keep=None):
+        while self._bytes > self.max_bytes and self._entries:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                break
+            del self._entries[name]
+            self._bytes -= size
+            self._evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "shared_in_flight": self._shared,
+                "evictions": self._evictions,
+                "in_flight": len(self._in_flight),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,102 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ConnectTimeoutError
+from multipart import MultipartEncoder, UPLOAD_STREAMING, current_progress
+
+# Pool and timeout settings for the connection to the Go WA API
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "2"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_MEDIA_READ_TIMEOUT = float(os.getenv("HTTP_MEDIA_READ_TIMEOUT", "120"))
+
+# Endpoint classes: plain JSON calls vs. multipart media uploads
+ENDPOINT_TEXT = "text"
+ENDPOINT_MEDIA = "media"
+
+
+def connect_failed(exc):
+    # True if a requests exception was raised before the request could be sent: the connection
+    # couldn't be opened or timed out opening. requests raises ConnectionError for those, but
+    # also when the server drops the connection after it has read the request, so the type
+    # alone says nothing about delivery.
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.exceptions.ConnectionError) or not exc.args:
+        return False
+    reason = exc.args[0]
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class PooledTransport:
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 media_read_timeout=HTTP_MEDIA_READ_TIMEOUT, stream_uploads=UPLOAD_STREAMING):
+        self.session = requests.Session()
+        # Block instead of opening throwaway connections once the pool is exhausted,
+        # so the number of sockets to the Go container stays bounded.
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.timeouts = {
+            ENDPOINT_TEXT: (connect_timeout, read_timeout),
+            ENDPOINT_MEDIA: (connect_timeout, media_read_timeout),
+        }
+        # Encode multipart bodies while sending instead of building them in memory first
+        self.stream_uploads = stream_uploads
+        self._lock = threading.Lock()
+        self._requests = {ENDPOINT_TEXT: 0, ENDPOINT_MEDIA: 0}
+        self._timeouts = 0
+        self._uploaded = 0
+
+    def endpoint_class(self, files=None):
+        return ENDPOINT_MEDIA if files else ENDPOINT_TEXT
+
+    def request(self, method, url, files=None, timeout=None, **kwargs):
+        endpoint_class = self.endpoint_class(files)
+        with self._lock:
+            self._requests[endpoint_class] += 1
+        if files and self.stream_uploads:
+            body = MultipartEncoder(kwargs.pop("data", None), files, progress=current_progress())
+            kwargs["data"] = body
+            kwargs["headers"] = dict(kwargs.get("headers") or {}, **{"Content-Type": body.content_type})
+            files = None
+            if body.len is not None:
+                with self._lock:
+                    self._uploaded += body.len
+        try:
+            return self.session.request(
+                method, url, files=files, timeout=timeout or self.timeouts[endpoint_class], **kwargs
+            )
+        except requests.exceptions.Timeout:
+            with self._lock:
+                self._timeouts += 1
+            raise
+
+    def stats(self):
+        # urllib3 counts every request made through a pool and every new socket it opened;
+        # the difference is the number of requests served on a kept-alive connection.
+        opened = 0
+        served = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+        with self._lock:
+            return {
+                "requests": dict(self._requests),
+                "timeouts": self._timeouts,
+                "bytes_uploaded": self._uploaded,
+                "connections_opened": opened,
+                "connections_reused": max(served - opened, 0),
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sentinel put on the queue once per worker to stop it after the backlog is drained
+_STOP = object()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WebhookQueue:
+    def __init__(self, handler, workers=4, maxsize=1000, put_timeout=0.0):
+        self.handler = handler
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._accepting = False
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def start(self):
+        with self._lock:
+            if self._accepting:
+                return
+            self._accepting = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, event):
+        # Either waits up to put_timeout for a free slot (backpressure) or,
+        # with a timeout of 0, rejects right away (load shedding).
+        if not self._accepting:
+            raise QueueFull("Webhook queue is shutting down")
+        try:
+            if self.put_timeout > 0:
+                self._queue.put((time.monotonic(), event), timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait((time.monotonic(), event))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull("Webhook queue is full")
+        with self._lock:
+            self._enqueued += 1
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                _, event = item
+                try:
+                    self.handler(event)
+                    with self._lock:
+                        self._processed += 1
+                except Exception as e:
+                    with self._lock:
+                        self._failed += 1
+                    logger.exception("Webhook worker: An error occurred: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "capacity": self._queue.maxsize,
+                "workers": len(self._threads),
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, timeout=30.0):
+        # Stop accepting new events, let the workers finish what is already queued
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+            threads = list(self._threads)
+            self._threads = []
+        logger.info("Draining webhook queue (%s pending)...", self._queue.qsize())
+        deadline = time.monotonic() + timeout
+        try:
+            for _ in threads:
+                # A full queue only frees up as the workers drain it, so this waits no longer than the deadline
+                self._queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0))
+        except queue.Full:
+            logger.warning("Webhook queue not drained within %ss (%s pending)", timeout, self._queue.qsize())
+            return
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        logger.info("Webhook queue drained.")
@@ -0,0 +1,361 @@
+import base64
+import logging
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from transport import PooledTransport, connect_failed
+from media_registry import MediaAsset, MediaPart, detect_mime
+from response_cache import ResponseCache, API_CACHE_ENABLED
+from outbound_scheduler import OutboundScheduler, OUTBOUND_SCHEDULER_ENABLED
+from resilience import Resilience, RESILIENCE_ENABLED, circuit_open_response
+from metrics import API_DURATION, API_ERRORS, endpoint_label
+
+logger = logging.getLogger(__name__)
+
+
+class WhatsAppClient:
+    def __init__(self, base_url, username, password, transport=None, cache=None, scheduler=None, outbox=None,
+                 resilience=None):
+        self.base_url = base_url
+        self.auth_header = self._generate_auth_header(username, password)
+        # Keep-alive connection pool shared by every endpoint method
+        self.transport = transport or PooledTransport()
+        # TTL/LRU cache for read endpoints, invalidated by the writes that affect them
+        self.cache = cache if cache is not None else (ResponseCache() if API_CACHE_ENABLED else None)
+        # Paces sends with token buckets and lets interactive replies overtake media and bulk sends
+        if scheduler is None and OUTBOUND_SCHEDULER_ENABLED:
+            scheduler = OutboundScheduler()
+        self.scheduler = scheduler
+        # Durable record of writes, retried in the background when they fail (see outbox.py)
+        self.outbox = outbox
+        # Circuit breakers, latency-based timeouts and budgeted retries around each call
+        self.resilience = resilience if resilience is not None else (Resilience() if RESILIENCE_ENABLED else None)
+
+    def _generate_auth_header(self, username, password):
+        credentials = f"{username}:{password}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        return {"Authorization": f"Basic {encoded_credentials}"}
+
+    def _send_request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.outbox is not None and method != "GET":
+            return self.outbox.send(self, method, endpoint, params, json_data, files, data)
+        return self._dispatch(method, endpoint, params, json_data, files, data)
+
+    def _dispatch(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.resilience is not None and self.resilience.rejects(self._base_urls(), endpoint_label(endpoint)):
+            return circuit_open_response(endpoint_label(endpoint))
+        if self.scheduler is not None and self.scheduler.is_scheduled(endpoint):
+            recipient = (json_data or data or {}).get("phone")
+            self.scheduler.acquire(self.scheduler.classify(endpoint), recipient)
+        return self._cached_request(method, endpoint, params, json_data, files, data)
+
+    def _cached_request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.cache is None:
+            return self._request(method, endpoint, params, json_data, files, data)
+        if method == "GET" and self.cache.is_cacheable(endpoint):
+            return self.cache.get_or_load(
+                endpoint, params, lambda: self._request(method, endpoint, params, json_data, files, data)
+            )
+        response = self._request(method, endpoint, params, json_data, files, data)
+        if method != "GET":
+            self.cache.invalidate_for(endpoint)
+        return response
+
+    def _base_urls(self):
+        return [self.base_url]
+
+    def _backends(self):
+        # (base URL, auth header) of every Go API this client sends to
+        return [(self.base_url, self.auth_header)]
+
+    def warm_up(self, connections):
+        # Opens up to `connections` pooled connections to each backend before the first webhook
+        # needs one, by making that many concurrent GET /app/devices calls past the cache,
+        # scheduler and circuit breakers. Returns the number of calls that succeeded.
+        backends = self._backends()
+        with ThreadPoolExecutor(max_workers=connections * len(backends), thread_name_prefix="warm-up") as executor:
+            responses = list(executor.map(
+                lambda backend: self._attempt(backend[0], backend[1], "GET", "/app/devices"), backends * connections
+            ))
+        return sum(not (isinstance(r, dict) and r.get("code") == "ERROR") for r in responses)
+
+    def _request(self, method, endpoint, params=None, json_data=None, files=None, data=None):
+        return self._call(self.base_url, self.auth_header, method, endpoint, params, json_data, files, data)
+
+    def _call(self, base_url, auth_header, method, endpoint, params=None, json_data=None, files=None, data=None):
+        if self.resilience is None:
+            return self._attempt(base_url, auth_header, method, endpoint, params, json_data, files, data)
+        label = endpoint_label(endpoint)
+        attempt = 0
+        while True:
+            breaker, timeout = self.resilience.before(base_url, label, bool(files))
+            if breaker is None:
+                return circuit_open_response(label)
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self._attempt(base_url, auth_header, method, endpoint, params, json_data, files, data, timeout)
+            finally:
+                delay = self.resilience.after(
+                    breaker, base_url, label, method, bool(files), response, time.perf_counter() - start, attempt
+                )
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, base_url, auth_header, method, endpoint, params=None, json_data=None, files=None, data=None,
+                 timeout=None):
+        url = f"{base_url}{endpoint}"
+        label = endpoint_label(endpoint)
+        start = time.perf_counter()
+        try:
+            response = self.transport.request(
+                method, url, params=params, json=json_data, files=files, headers=auth_header, data=data, timeout=timeout
+            )
+            response.raise_for_status()  # Raise an exception for HTTP errors
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error("Error during API request to %s: %s", url, e)
+            if hasattr(e, 'response') and e.response is not None:
+                logger.debug("Response content: %s", e.response.text)
+                API_ERRORS.inc(method, label, str(e.response.status_code))
+                return {"code": "ERROR", "message": str(e), "status": e.response.status_code}
+            API_ERRORS.inc(method, label, type(e).__name__)
+            error = {"code": "ERROR", "message": str(e), "error": type(e).__name__}
+            if connect_failed(e):
+                error["unsent"] = True # see resilience.is_unsent
+            return error
+        finally:
+            API_DURATION.observe(time.perf_counter() - start, method, label)
+
+    def _media_part(self, media, field):
+        # Multipart file tuple for a MediaAsset from the registry or an open file object. A
+        # (filename, content, mime) tuple is passed through, so content can also be an mmap or
+        # a generator of bytes. A file object without a name (io.BytesIO) is sent as `field`,
+        # like requests does.
+        if isinstance(media, tuple):
+            return media
+        if isinstance(media, MediaAsset):
+            return MediaPart(media.name, media.data, media.mime, media.path)
+        name = getattr(media, "name", None)
+        if not isinstance(name, str):
+            return MediaPart(field, media, "application/octet-stream")
+        return MediaPart(name, media, detect_mime(name), name)
+
+    # App Endpoints
+
+    def app_devices(self):
+        return self._send_request("GET", "/app/devices")
+
+    # User Endpoints
+    def user_info(self, phone):
+        return self._send_request("GET", "/user/info", params={"phone": phone})
+
+    def user_avatar(self, phone, is_preview=None, is_community=None):
+        params = {"phone": phone}
+        if is_preview is not None:
+            params["is_preview"] = is_preview
+        if is_community is not None:
+            params["is_community"] = is_community
+        return self._send_request("GET", "/user/avatar", params=params)
+
+    def user_change_avatar(self, avatar_file):
+        files = {"avatar": avatar_file}
+        return self._send_request("POST", "/user/avatar", files=files)
+
+    def user_change_pushname(self, push_name):
+        json_data = {"push_name": push_name}
+        return self._send_request("POST", "/user/pushname", json_data=json_data)
+
+    def user_my_privacy(self):
+        return self._send_request("GET", "/user/my/privacy")
+
+    def user_my_groups(self):
+        return self._send_request("GET", "/user/my/groups")
+
+    def user_my_newsletters(self):
+        return self._send_request("GET", "/user/my/newsletters")
+
+    def user_my_contacts(self):
+        return self._send_request("GET", "/user/my/contacts")
+
+    def user_check(self, phone):
+        return self._send_request("GET", "/user/check", params={"phone": phone})
+
+    # Send Endpoints
+    def send_message(self, phone, message, reply_message_id=None, is_forwarded=False):
+        json_data = {
+            "phone": phone,
+            "message": message,
+            "is_forwarded": is_forwarded
+        }
+        if reply_message_id:
+            json_data["reply_message_id"] = reply_message_id
+        return self._send_request("POST", "/send/message", json_data=json_data)
+
+    def send_image(self, phone, image_file=None, image_url=None, caption=None, view_once=False, compress=False, is_forwarded=False):
+        files = {}
+        if image_file:
+            files["image"] = self._media_part(image_file, "image")
+
+        data_for_form = {
+            "phone": phone,
+            "view_once": str(view_once).lower(),
+            "compress": str(compress).lower(),
+            "is_forwarded": str(is_forwarded).lower()
+        }
+        if caption:
+            data_for_form["caption"] = caption
+        if image_url:
+            data_for_form["image_url"] = image_url
+
+        return self._send_request("POST", "/send/image", data=data_for_form, files=files)
+
+    def send_audio(self, phone, audio_file, is_forwarded=False):
+        files = {"audio": self._media_part(audio_file, "audio")}
+        data_for_form = {
+            "phone": phone,
+            "is_forwarded": str(is_forwarded).lower()
+        }
+        return self._send_request("POST", "/send/audio", data=data_for_form, files=files)
+
+    def send_file(self, phone, file_obj, caption=None, is_forwarded=False):
+        files = {"file": self._media_part(file_obj, "file")}
+        data_for_form = {
+            "phone": phone,
+            "is_forwarded": str(is_forwarded).lower()
+        }
+        if caption:
+            data_for_form["caption"] = caption
+        return self._send_request("POST", "/send/file", data=data_for_form, files=files)
+
+    def send_video(self, phone, video_file, caption=None, view_once=False, compress=False, is_forwarded=False):
+        files = {"video": self._media_part(video_file, "video")}
+        data_for_form = {
+            "phone": phone,
+            "view_once": str(view_once).lower(),
+            "compress": str(compress).lower(),
+            "is_forwarded": str(is_forwarded).lower()
+        }
+        if caption:
+            data_for_form["caption"] = caption
+
+        return self._send_request("POST", "/send/video", data=data_for_form, files=files)
+
+    def send_contact(self, phone, contact_name, contact_phone, is_forwarded=False):
+        json_data = {
+            "phone": phone,
+            "contact_name": contact_name,
+            "contact_phone": contact_phone,
+            "is_forwarded": is_forwarded
+        }
+        return self._send_request("POST", "/send/contact", json_data=json_data)
+
+    def send_link(self, phone, link, caption=None, is_forwarded=False):
+        json_data = {
+            "phone": phone,
+            "link": link,
+            "is_forwarded": is_forwarded
+        }
+        if caption:
+            json_data["caption"] = caption
+        return self._send_request("POST", "/send/link", json_data=json_data)
+
+    def send_location(self, phone, latitude, longitude, is_forwarded=False):
+        json_data = {
+            "phone": phone,
+            "latitude": str(latitude),
+            "longitude": str(longitude),
+            "is_forwarded": is_forwarded
+        }
+        return self._send_request("POST", "/send/location", json_data=json_data)
+
+    def send_poll(self, phone, question, options, max_answer):
+        json_data = {
+            "phone": phone,
+            "question": question,
+            "options": options,
+            "max_answer": max_answer
+        }
+        return self._send_request("POST", "/send/poll", json_data=json_data)
+
+    def send_presence(self, type): # is_forwarded is not a parameter for send_presence in Go API
+        json_data = {
+            "type": type,
+        }
+        return self._send_request("POST", "/send/presence", json_data=json_data)
+
+    # Message Endpoints
+    def message_revoke(self, message_id, phone):
+        json_data = {"phone": phone}
+        return self._send_request("POST", f"/message/{message_id}/revoke", json_data=json_data)
+
+    def message_delete(self, message_id, phone):
+        json_data = {"phone": phone}
+        return self._send_request("POST", f"/message/{message_id}/delete", json_data=json_data)
+
+    def message_reaction(self, message_id, phone, emoji):
+        json_data = {"phone": phone, "emoji": emoji}
+        return self._send_request("POST", f"/message/{message_id}/reaction", json_data=json_data)
+
+    def message_update(self, message_id, phone, message):
+        json_data = {"phone": phone, "message": message}
+        return self._send_request("POST", f"/message/{message_id}/update", json_data=json_data)
+
+    def message_read(self, message_id, phone):
+        json_data = {"phone": phone}
+        return self._send_request("POST", f"/message/{message_id}/read", json_data=json_data)
+
+    def message_star(self, message_id, phone):
+        json_data = {"phone": phone}
+        return self._send_request("POST", f"/message/{message_id}/star", json_data=json_data)
+
+    def message_unstar(self, message_id, phone):
+        json_data = {"phone": phone}
+        return self._send_request("POST", f"/message/{message_id}/unstar", json_data=json_data)
+
+    # Group Endpoints
+    def group_join_with_link(self, link):
+        json_data = {"link": link}
+        return self._send_request("POST", "/group/join-with-link", json_data=json_data)
+
+    def group_leave(self, group_id):
+        json_data = {"group_id": group_id}
+        return self._send_request("POST", "/group/leave", json_data=json_data)
+
+    def group_create(self, name, participants):
+        json_data = {"name": name, "participants": participants}
+        return self._send_request("POST", "/group", json_data=json_data)
+
+    def group_add_participants(self, group_id, participants):
+        json_data = {"group_id": group_id, "participants": participants}
+        return self._send_request("POST", "/group/participants", json_data=json_data)
+
+    def group_remove_participant(self, group_id, participant):
+        json_data = {"group_id": group_id, "participant": participant}
+        return self._send_request("POST", "/group/participants/remove", json_data=json_data)
+
+    def group_promote_participant(self, group_id, participant):
+        json_data = {"group_id": group_id, "participant": participant}
+        return self._send_request("POST", "/group/participants/promote", json_data=json_data)
+
+    def group_demote_participant(self, group_id, participant):
+        json_data = {"group_id": group_id, "participant": participant}
+        return self._send_request("POST", "/group/participants/demote", json_data=json_data)
+
+    def group_list_requested_participants(self):
+        return self._send_request("GET", "/group/participant-requests")
+
+    def group_approve_requested_participant(self, group_id, participant):
+        json_data = {"group_id": group_id, "participant": participant}
+        return self._send_request("POST", "/group/participant-requests/approve", json_data=json_data)
+
+    def group_reject_requested_participant(self, group_id, participant):
+        json_data = {"group_id": group_id, "participant": participant}
+        return self._send_request("POST", "/group/participant-requests/reject", json_data=json_data)
+
+    # Newsletter Endpoints
+    def newsletter_unfollow(self, newsletter_id):
+        json_data = {"newsletter_id": newsletter_id}
+        return self._send_request("POST", "/newsletter/unfollow", json_data=json_data)